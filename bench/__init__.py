@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+
+from .fleet import run_fleet, summarize
+from .micro import run_micro
+from .procstats import ProcessSampler
\ No newline at end of file
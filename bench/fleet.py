@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import asyncio
+import multiprocessing
+import random
+import time
+from servers.framing import create_framer
+
+def data_message(device, seq, width, churn, rng):
+    '''
+        Returns a DataServer message of width key:value pairs, plus a never seen before key with probability churn
+    '''
+    fields = [f"k{i}:{rng.randint(0, 1000)}" for i in range(width)]
+    if churn > 0 and rng.random() < churn:
+        fields.append(f"d{device}_{seq}:1")
+    return ",".join(fields)
+
+def log_message(device, seq, width, churn, rng):
+    return f"device {device} event {seq} " + "x" * width
+
+def time_message(device, seq, width, churn, rng):
+    return "timezone:utc,offset_seconds:0"
+
+MESSAGES = {"data": data_message, "log": log_message, "time": time_message}
+
+async def _run_device(host, port, kind, device, rate, width, churn, idle, start, deadline, framing, rng, results):
+    message = MESSAGES[kind]
+
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        results["connect_errors"] += 1
+        return
+
+    framer = create_framer(framing)
+    interval = 1 / rate if rate > 0 else 0
+    next_send = start + rng.random() * interval # Spread devices over the first interval
+    seq = 0
+
+    try:
+        if idle: # Holds a connection slot without sending
+            await asyncio.sleep(max(0, deadline - time.perf_counter()))
+            return
+
+        while next_send < deadline:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            writer.write(framer.frame(message(device, seq, width, churn, rng).encode()))
+            await writer.drain()
+
+            responses = []
+            while not responses:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionResetError("Connection closed by server")
+                responses = framer.feed(data)
+
+            # Measured from the scheduled send, so a stalled server is not hidden by devices sending less
+            results["latencies"].append(time.perf_counter() - next_send)
+            code = responses[0][:3].decode()
+            results["codes"][code] = results["codes"].get(code, 0) + 1
+
+            seq += 1
+            next_send += interval
+
+    except OSError:
+        results["errors"] += 1
+
+    finally:
+        writer.close()
+
+async def _run_devices(host, port, kind, devices, rate, duration, width, churn, idle_ratio, framing, seed):
+    rng = random.Random(seed)
+    results = {"latencies": [], "codes": {}, "errors": 0, "connect_errors": 0}
+
+    start = time.perf_counter()
+    deadline = start + duration
+
+    await asyncio.gather(*[
+        _run_device(host, port, kind, device, rate, width, churn, rng.random() < idle_ratio, start, deadline, framing, random.Random(rng.random()), results)
+        for device in devices])
+
+    return results
+
+def _run_client(args):
+    return asyncio.run(_run_devices(*args))
+
+def run_fleet(host, port, kind, devices=100, rate=1.0, duration=10.0, width=8, churn=0.0, idle_ratio=0.0, framing="raw", client_procs=1, seed=0):
+    '''
+        Simulates devices connected to host:port, each sending rate messages per second of the given kind
+        (see MESSAGES) and waiting for the response. A fraction idle_ratio of the devices only holds its connection.
+        Devices are spread over client_procs processes so the load generator does not become the bottleneck.
+        Returns dict with the latencies of all responses, counts per response code and errors.
+    '''
+    args = [(host, port, kind, range(i, devices, client_procs), rate, duration, width, churn, idle_ratio, framing, seed + i) for i in range(client_procs)]
+
+    if client_procs == 1:
+        parts = [_run_client(args[0])]
+    else:
+        with multiprocessing.Pool(client_procs) as pool:
+            parts = pool.map(_run_client, args)
+
+    results = {"latencies": [], "codes": {}, "errors": 0, "connect_errors": 0}
+    for part in parts:
+        results["latencies"].extend(part["latencies"])
+        results["errors"] += part["errors"]
+        results["connect_errors"] += part["connect_errors"]
+        for code, count in part["codes"].items():
+            results["codes"][code] = results["codes"].get(code, 0) + count
+
+    return results
+
+def percentile(values, q):
+    '''
+        Returns the q-th percentile (0-100) of sorted values by the nearest-rank method
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+def summarize(results, duration):
+    latencies = sorted(results["latencies"])
+
+    return {
+        "responses": len(latencies),
+        "throughput": len(latencies) / duration,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "latency_p999": percentile(latencies, 99.9),
+        "latency_max": latencies[-1] if latencies else None,
+        "codes": results["codes"],
+        "errors": results["errors"],
+        "connect_errors": results["connect_errors"],
+    }
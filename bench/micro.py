@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import time
+from servers import DataServer
+from util.data_util import BufferedFileWriter, create_file_writer
+from .fleet import data_message
+
+def bench(fn, min_time=0.5):
+    '''
+        Calls fn repeatedly for at least min_time seconds, returns dict with the calls per second and ns per call
+    '''
+    ops = 0
+    batch = 1
+    start = time.perf_counter()
+
+    while True:
+        for _ in range(batch):
+            fn()
+        ops += batch
+
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        batch *= 2
+
+    return {"ops": ops, "ops_per_sec": ops / elapsed, "ns_per_op": elapsed / ops * 1e9}
+
+def run_micro(work_dir, width=8, min_time=0.5):
+    '''
+        Benchmarks DataServer.parse_data/process_data and the file writers of util/data_util.py in isolation,
+        writing under work_dir. Returns dict of benchmark name to result of bench().
+    '''
+    results = {}
+    message = data_message(0, 0, width, 0.0, random.Random(0))
+
+    data_server = DataServer(os.path.join(work_dir, "data/"), 30, "bench_data_server", logs_dir=os.path.join(work_dir, "logs/"))
+    data_server.init_resources()
+
+    try:
+        results["DataServer.parse_data"] = bench(lambda: data_server.parse_data(message), min_time=min_time)
+
+        values = data_server.parse_data(message)
+        results["DataServer.process_data"] = bench(lambda: data_server.process_data(values), min_time=min_time)
+
+    finally:
+        data_server.close_resources()
+
+    for durability in BufferedFileWriter.DURABILITIES:
+        writer = BufferedFileWriter(os.path.join(work_dir, f"buffered-{durability}.log"), durability=durability)
+        try:
+            results[f"BufferedFileWriter.write[{durability}]"] = bench(lambda: writer.write([message]), min_time=min_time)
+        finally:
+            writer.close()
+
+    writer = create_file_writer(os.path.join(work_dir, "partitioned"), "data", "csv", ts_index=True, partition="hourly")
+    try:
+        results["PartitionedFileWriter.write[hourly,ts_index]"] = bench(lambda: writer.write([message]), min_time=min_time)
+    finally:
+        writer.close()
+
+    return results
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+'''
+    CPU time and resident memory of server processes, read from /proc (Linux only, None elsewhere)
+'''
+
+def cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split() # The process name may contain spaces
+
+    except OSError:
+        return None
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+
+    except OSError:
+        pass
+
+    return None
+
+class ProcessSampler:
+    '''
+        Samples the RSS of pids every interval seconds between start() and stop(), which returns
+            {"cpu_seconds": ..., "cpu_percent": ..., "rss_max": ...}
+        summed over all pids, or None values where /proc is not available.
+    '''
+
+    def __init__(self, pids, interval=0.5):
+        self.pids = pids
+        self.interval = interval
+
+        self._rss_max = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._cpu_start = self._cpu()
+        self._thread = threading.Thread(target=self._sample_periodically, daemon=True)
+        self._thread.start()
+
+    def stop(self, duration):
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+
+        cpu_end = self._cpu()
+        cpu = cpu_end - self._cpu_start if cpu_end is not None and self._cpu_start is not None else None
+
+        return {
+            "cpu_seconds": cpu,
+            "cpu_percent": 100 * cpu / duration if cpu is not None else None,
+            "rss_max": self._rss_max,
+        }
+
+    def _cpu(self):
+        values = [cpu_seconds(pid) for pid in self.pids]
+        return None if None in values else sum(values)
+
+    def _sample(self):
+        values = [rss_bytes(pid) for pid in self.pids]
+        if None not in values:
+            self._rss_max = max(self._rss_max or 0, sum(values))
+
+    def _sample_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
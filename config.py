@@ -6,23 +6,63 @@
 HOST = "192.168.1.169"
 ENCODING = "utf-8"
 LOGS_DIR = "./logs/"
+METRICS_INTERVAL = 10 # In seconds, 0 to only dump <server_name>.prom on exit
+LOG_QUEUE = True # Write log files from a background thread
+LOG_SAMPLE = 1 # Log "Received data" for one in every LOG_SAMPLE messages
+LOG_RATE_LIMIT = 0 # At most this many "Received data" lines per second, 0 for no limit
+HANDOFF_DIR = "" # Restarted servers take over the listening sockets of the running ones through here, "" to disable
 
 '''
 	Data server config
 '''
 DATA_SERVER_PORT = 13000
 DATA_SERVER_SOCKET_TIMEOUT = 30 # In seconds
+DATA_SERVER_UDP_PORT = 0 # Fire-and-forget ingest, 0 to disable
+DATA_SERVER_UDP_QUEUE_SIZE = 10000 # Datagrams, more are dropped
 DATA_DIR = "./data/sensor_data/"
+DATA_SERVER_FLUSH_SIZE = 65536 # In bytes
+DATA_SERVER_FLUSH_INTERVAL = 1.0 # In seconds
+DATA_SERVER_DURABILITY = "none" # One of: none, flush, record
+DATA_SERVER_STORAGE = "csv" # One of: csv, columnar
+DATA_SERVER_PARTITION = "none" # One of: none, hourly, daily
+DATA_SERVER_PARTITION_SIZE = 0 # In bytes, 0 to disable size-based partitioning
+DATA_SERVER_RETENTION = 0 # In seconds, 0 to keep all partitions
+DATA_SERVER_SHARD_KEY = "" # Key of the device id records are sharded by, "" to disable sharding
+DATA_SERVER_SHARDS = 0 # Number of hash shards, 0 for one shard per device
+DATA_SERVER_ROLLUPS = () # Rollup bucket lengths in seconds, () to disable rollups
+DATA_SERVER_ROLLUP_KEY = "" # Key of the device id rollups are grouped by, "" for fleet-wide rollups
+DATA_SERVER_LATEST_HISTORY = 0 # Values kept in memory per device and key for "latest;" requests, 0 to disable
+DATA_SERVER_LATEST_KEY = "" # Key of the device id latest values are kept per, "" for one table of all keys
+DATA_SERVER_LATEST_SIZE = 65536 # Device and key pairs kept in shared memory by multi-process servers
 
 '''
 	Time server config
 '''
 TIME_SERVER_PORT = 13001
 TIME_SERVER_SOCKET_TIMEOUT = 30 # In seconds
+TIME_SERVER_UDP_PORT = 0 # UDP time protocol, 0 to disable
 
 '''
 	Log server config
 '''
 LOG_SERVER_PORT = 13002
 LOG_SERVER_SOCKET_TIMEOUT = 30 # In seconds
-LOG_DATA_DIR = "./data/log_data/"
\ No newline at end of file
+LOG_SERVER_UDP_PORT = 0 # Fire-and-forget ingest, 0 to disable
+LOG_SERVER_UDP_QUEUE_SIZE = 10000 # Datagrams, more are dropped
+LOG_DATA_DIR = "./data/log_data/"
+LOG_SERVER_FLUSH_SIZE = 65536 # In bytes
+LOG_SERVER_FLUSH_INTERVAL = 1.0 # In seconds
+LOG_SERVER_DURABILITY = "none" # One of: none, flush, record
+LOG_SERVER_PARTITION = "none" # One of: none, hourly, daily
+LOG_SERVER_PARTITION_SIZE = 0 # In bytes, 0 to disable size-based partitioning
+LOG_SERVER_RETENTION = 0 # In seconds, 0 to keep all partitions
+LOG_SERVER_RETENTION_SIZE = 0 # In bytes on disk, 0 to keep all partitions
+LOG_SERVER_COMPRESS = False # Compress closed partitions in the background
+LOG_SERVER_TOKEN_INDEX = False # Index the words of every line for search_logs.py
+
+'''
+	Query server config
+'''
+QUERY_SERVER_PORT = 13003
+QUERY_SERVER_SOCKET_TIMEOUT = 30 # In seconds
+QUERY_SERVER_CHUNK_ROWS = 1000 # Rows per streamed response chunk
\ No newline at end of file
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+from argparse import ArgumentParser
+from config import *
+from util.convert import CHUNK_SIZE, convert_csv
+
+'''
+    Converts the CSV data stored by the data server into columns that NumPy memory-maps without copying, e.g.
+        python convert_data.py ./data/sensor_columns/
+    then, from Python,
+        columns = load_columns("./data/sensor_columns/") # util/columnar.py
+        received = load_timestamps("./data/sensor_columns/")
+    The data directory is only read, convert it while the data server is stopped to include every row.
+'''
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("out_dir", help="Directory the columns are written to, may be the data directory itself")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Bytes of CSV parsed at a time")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    started = time.monotonic()
+    rows, size = convert_csv(args.data_dir, args.out_dir, chunk_size=args.chunk_size)
+    elapsed = max(time.monotonic() - started, 1e-9)
+
+    print(f"Converted {rows} row(s), {size / 1e6:.1f} MB in {elapsed:.1f}s ({size / 1e6 / elapsed:.1f} MB/s)")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from bench import ProcessSampler, run_fleet, run_micro, summarize
+from bench.fleet import MESSAGES
+from servers import Server, DataServer, LogServer, TimeServer
+from util.data_util import BufferedFileWriter
+from util.storage import STORAGES
+
+'''
+    Starts each server on localhost in turn, drives it with a simulated fleet of devices and writes the results as
+    JSON, e.g.
+        python run_bench.py --devices 200 --rate 10 --duration 30 --output results.json
+    Compare results between commits with the same arguments on the same box.
+'''
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def create_server(name, args, work_dir):
+    kwargs = dict(
+        max_conn=args.devices,
+        logs_dir=os.path.join(work_dir, "logs/"),
+        logging_level=logging.WARNING, # Per message logging would dominate the results
+        engine=args.engine,
+        framing=args.framing,
+        workers=args.workers,
+        backlog=max(128, args.devices))
+    timeout = args.duration + 10 # Idle devices keep their connection for the whole run
+
+    if name == "data":
+        return DataServer(os.path.join(work_dir, "data/"), timeout, "bench_data_server", durability=args.durability, storage=args.storage, **kwargs)
+
+    if name == "log":
+        return LogServer(os.path.join(work_dir, "log_data/"), timeout, "bench_log_server", durability=args.durability, **kwargs)
+
+    return TimeServer(timeout, "bench_time_server", **kwargs)
+
+def bench_server(name, port, args, work_dir):
+    server = create_server(name, args, work_dir)
+    server.start("127.0.0.1", port)
+    time.sleep(args.warmup)
+
+    sampler = ProcessSampler([server_proc.pid for server_proc in server.server_procs])
+    sampler.start()
+
+    results = run_fleet(
+        "127.0.0.1",
+        port,
+        name,
+        devices=args.devices,
+        rate=args.rate,
+        duration=args.duration,
+        width=args.width,
+        churn=args.churn,
+        idle_ratio=args.idle_ratio,
+        framing=args.framing,
+        client_procs=args.client_procs,
+        seed=args.seed)
+
+    stats = sampler.stop(args.duration)
+
+    server.stop()
+    while server.is_running():
+        time.sleep(0.1)
+
+    return {**summarize(results, args.duration), **stats}
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("--servers", default="data,log,time", help="Comma separated list of: data, log, time")
+    parser.add_argument("--devices", default=100, type=int)
+    parser.add_argument("--rate", default=10.0, type=float, help="Messages per second per device")
+    parser.add_argument("--duration", default=10.0, type=float, help="In seconds, per server")
+    parser.add_argument("--width", default=8, type=int, help="Key:value pairs per data message, characters per log message")
+    parser.add_argument("--churn", default=0.0, type=float, help="Probability of a message adding a new key")
+    parser.add_argument("--idle-ratio", default=0.0, type=float, help="Fraction of devices that connect but never send")
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="newline", choices=Server.FRAMINGS)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--durability", default="none", choices=BufferedFileWriter.DURABILITIES)
+    parser.add_argument("--storage", default="csv", choices=STORAGES)
+    parser.add_argument("--client-procs", default=1, type=int, help="Load generator processes")
+    parser.add_argument("--base-port", default=24000, type=int)
+    parser.add_argument("--warmup", default=1.0, type=float, help="In seconds, after starting a server")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--micro", action="store_true", help="Also run the microbenchmarks")
+    parser.add_argument("--work-dir", help="Directory for data and logs, temporary if not set")
+    parser.add_argument("--output", help="JSON results file, printed if not set")
+    args = parser.parse_args()
+
+    names = args.servers.split(",")
+    for name in names:
+        if name not in MESSAGES:
+            parser.error(f"Unknown server: {name}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+
+        results = {
+            "commit": git_commit(),
+            "time": time.time(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "servers": {},
+        }
+
+        for i, name in enumerate(names):
+            print(f"Benchmarking {name} server")
+            results["servers"][name] = bench_server(name, args.base_port + i, args, os.path.join(work_dir, name))
+
+        if args.micro:
+            print("Running microbenchmarks")
+            results["micro"] = run_micro(os.path.join(work_dir, "micro"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
\ No newline at end of file
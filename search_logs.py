@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+import itertools
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from config import *
+from util.token_index import search_lines
+
+'''
+    Prints the lines stored by the log server that hold all words of a query, in time order, e.g.
+        python search_logs.py "device 7 error" --from 1700000000 --limit 100
+    Words are matched case-insensitively through the token index, lines it does not cover are scanned.
+'''
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("query", help="Words all matching lines hold")
+    parser.add_argument("--from", dest="start", type=float, help="Receipt time in epoch seconds")
+    parser.add_argument("--to", dest="end", type=float, help="Receipt time in epoch seconds")
+    parser.add_argument("--limit", type=int, help="Print at most this many lines")
+    parser.add_argument("--log-data-dir", default=LOG_DATA_DIR)
+    args = parser.parse_args()
+
+    lines = search_lines(args.log_data_dir, "data", "log", args.query, start=args.start, end=args.end)
+
+    for received, line in itertools.islice(lines, args.limit):
+        print(f"{datetime.fromtimestamp(received, timezone.utc).isoformat()} {line}")
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+from .server import Server
 from .time_server import TimeServer
 from .data_server import DataServer
-from .log_server import LogServer
\ No newline at end of file
+from .log_server import LogServer
+from .query_server import QueryServer
+from .server_group import ServerGroup
\ No newline at end of file
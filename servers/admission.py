@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import deque
+
+class AdmissionControl:
+    '''
+        Hands out connection slots (indices 0 to max_conn - 1) in O(1) and enforces a per-client-IP connection limit
+        (0 for no limit). Safe to share between the accept loop and connection threads.
+    '''
+
+    def __init__(self, max_conn, max_conn_per_ip=0):
+        self.max_conn = max_conn
+        self.max_conn_per_ip = max_conn_per_ip
+
+        self._free = deque(range(max_conn))
+        self._conn_per_ip = {}
+        self._slot_freed = threading.Condition()
+
+    @property
+    def active(self):
+        return self.max_conn - len(self._free)
+
+    @property
+    def available(self):
+        return len(self._free)
+
+    def wait_for_slot(self, timeout=None):
+        '''
+            Blocks until a slot is free, returns False on timeout
+        '''
+        with self._slot_freed:
+            return self._slot_freed.wait_for(lambda: len(self._free) > 0, timeout)
+
+    def admit(self, host):
+        '''
+            Returns a free slot index for a connection from host, or None if the server or host is at its limit
+        '''
+        with self._slot_freed:
+            if not self._free:
+                return None
+
+            if self.max_conn_per_ip > 0 and self._conn_per_ip.get(host, 0) >= self.max_conn_per_ip:
+                return None
+
+            self._conn_per_ip[host] = self._conn_per_ip.get(host, 0) + 1
+            return self._free.popleft()
+
+    def release(self, idx, host):
+
+        with self._slot_freed:
+            self._free.append(idx)
+
+            count = self._conn_per_ip[host] - 1
+            if count > 0:
+                self._conn_per_ip[host] = count
+            else:
+                del self._conn_per_ip[host]
+
+            self._slot_freed.notify()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import struct
+import sys
+
+'''
+    Binary encoding, negotiated per connection: a client that sends HELLO as its first message is answered HELLO
+    and every later message of the connection, both ways, is binary. Other clients keep the text protocol, as do
+    all clients of a framing that cannot carry arbitrary bytes (see BINARY_FRAMINGS). All integers big-endian.
+
+    A message is a type byte followed by its body, a response a uint16 status code (as in the text protocol)
+    followed by its body:
+        KEYS    - repeated (key id uint16, key length uint8, UTF-8 key), assigns key ids for the connection -> 200
+        RECORDS - record count uint16, then per record: field count uint16, the key id (uint16) of every field,
+                  the value tag (byte) of every field and the value of every field (see VALUE_STRUCTS, strings are
+                  a uint16 length and UTF-8 bytes) -> overall status and the status of every record, as a batch
+                  message of the text protocol. Records of the same key ids and tags are decoded at once.
+        LINE    - UTF-8 text of one or more newline separated log lines -> status
+        TIME    - client transmit time uint64 (echoed as is) -> 200, client transmit time, server receive time
+                  and server transmit time uint64, in ns since the epoch (UTC)
+    Malformed messages are answered 400 and do not close the connection. Connections rejected while the server
+    is busy are answered its text BUSY_RESPONSE before any HELLO.
+'''
+
+HELLO = b"\x00BIN1" # Never a text message, which cannot start with NUL
+
+BINARY_FRAMINGS = ("length",)
+
+KEYS = 0x01
+RECORDS = 0x02
+LINE = 0x03
+TIME = 0x04
+
+STATUS = struct.Struct("!H")
+COUNT = struct.Struct("!H")
+KEY_HEADER = struct.Struct("!HB")
+TIMES = struct.Struct("!QQQ")
+TRANSMIT_TIME = struct.Struct("!Q")
+
+KEY_SEPARATORS = b",:;\n\r" # Never part of a key, they separate the fields, records and rows of the text protocol and of the schema
+
+STRING_TAG = b"s"
+VALUE_STRUCTS = {
+    b"q": struct.Struct("!q"), # int64
+    b"i": struct.Struct("!i"), # int32
+    b"d": struct.Struct("!d"), # float64
+    b"f": struct.Struct("!f"), # float32
+}
+
+class BinaryError(ValueError):
+    pass
+
+class BinarySession:
+    '''
+        Encoding state of one connection: whether binary was negotiated and the key ids assigned by the client
+    '''
+
+    MAX_LAYOUTS = 1024
+
+    def __init__(self):
+        self.active = False
+        self.started = False
+        self.keys = {}
+        self.layouts = {} # Key ids and value tags of a record -> (keys, Struct of its values if all are numbers, Struct of every value)
+
+    def negotiate(self, message, framing):
+        '''
+            Returns True if message switches the connection to binary, only ever the case for its first message
+        '''
+        if self.started:
+            return False
+
+        self.started = True
+        self.active = message == HELLO and framing in BINARY_FRAMINGS
+        return self.active
+
+    def define_keys(self, body):
+        offset = 0
+        while offset < len(body):
+            key_id, length = _unpack(KEY_HEADER, body, offset)
+            offset += KEY_HEADER.size
+
+            key = bytes(body[offset:offset + length])
+            if len(key) < length or not key or any([separator in key for separator in KEY_SEPARATORS]):
+                raise BinaryError(f"Invalid key of id {key_id}")
+
+            self.keys[key_id] = sys.intern(key.decode("utf-8"))
+            offset += length
+
+        self.layouts.clear() # Key ids may have been reassigned
+
+    def decode_records(self, body):
+        '''
+            Returns list of records (dicts of key to int, float or str), None for invalid records: those using
+            undefined key ids or holding strings with ',', ';' or newlines, which the text protocol cannot carry
+        '''
+        count, = _unpack(COUNT, body, 0)
+        offset = COUNT.size
+
+        records = []
+        try:
+            for _ in range(count):
+                fields, = COUNT.unpack_from(body, offset)
+                offset += COUNT.size
+
+                layout = bytes(body[offset:offset + 3 * fields]) # Key ids and tags
+                offset += len(layout)
+                keys, values_struct, field_structs = self.layouts.get(layout) or self._add_layout(layout, fields)
+
+                if values_struct is not None: # Only numbers, unpacked at once
+                    values = values_struct.unpack_from(body, offset)
+                    offset += values_struct.size
+                    valid = keys is not None
+                else:
+                    values, offset = _unpack_values(body, offset, field_structs)
+                    valid = keys is not None and not any([isinstance(value, str) and ("," in value or ";" in value or "\n" in value) for value in values])
+
+                records.append(dict(zip(keys, values)) if valid else None)
+
+        except (struct.error, UnicodeDecodeError) as e:
+            raise BinaryError(f"Truncated or invalid record: {e}")
+
+        if offset > len(body): # A string ran past the end
+            raise BinaryError("Truncated record")
+
+        if offset < len(body):
+            raise BinaryError(f"{len(body) - offset} byte(s) after the last record")
+
+        return records
+
+    def _add_layout(self, layout, fields):
+        # Devices send the same fields in every record, so each layout is resolved once per connection
+        if len(layout) != 3 * fields:
+            raise BinaryError("Truncated record")
+
+        key_ids = struct.unpack(f"!{fields}H", layout[:2 * fields])
+        tags = [layout[i:i + 1] for i in range(2 * fields, 3 * fields)]
+        for tag in tags:
+            if tag != STRING_TAG and tag not in VALUE_STRUCTS:
+                raise BinaryError(f"Unknown value tag {tag!r}")
+
+        keys = tuple([self.keys.get(key_id) for key_id in key_ids])
+        values_struct = None if STRING_TAG in tags else struct.Struct("!" + b"".join(tags).decode("ascii"))
+        field_structs = [VALUE_STRUCTS.get(tag) for tag in tags] # None for strings
+
+        if not keys or None in keys:
+            return None, values_struct, field_structs # Invalid, not cached as the keys may still be defined
+
+        if len(self.layouts) >= self.MAX_LAYOUTS:
+            self.layouts.clear()
+        self.layouts[layout] = (keys, values_struct, field_structs)
+
+        return keys, values_struct, field_structs
+
+def _unpack_values(body, offset, field_structs):
+    # Returns (values, offset after them) of a record holding strings, field_structs is None for its strings
+    values = []
+    for value_struct in field_structs:
+        if value_struct is None:
+            length, = COUNT.unpack_from(body, offset)
+            offset += COUNT.size
+            values.append(str(body[offset:offset + length], "utf-8"))
+            offset += length
+        else:
+            values.append(value_struct.unpack_from(body, offset)[0])
+            offset += value_struct.size
+
+    return values, offset
+
+def _unpack(fmt, body, offset):
+    try:
+        return fmt.unpack_from(body, offset)
+    except struct.error as e:
+        raise BinaryError(f"Truncated message: {e}")
+
+def encode_status(code, body=b""):
+    return STATUS.pack(code) + body
+
+def decode_status(response):
+    '''
+        Returns (status code, body) of a binary response
+    '''
+    code, = _unpack(STATUS, response, 0)
+    return code, response[STATUS.size:]
+
+def encode_keys(key_ids):
+    '''
+        Returns KEYS message assigning the ids of key_ids (dict of key to id)
+    '''
+    data = bytearray([KEYS])
+    for key, key_id in key_ids.items():
+        encoded = key.encode("utf-8")
+        data += KEY_HEADER.pack(key_id, len(encoded)) + encoded
+    return bytes(data)
+
+def encode_records(records, key_ids):
+    '''
+        Returns RECORDS message of records (dicts of key to int, float or str), with keys already sent in KEYS
+    '''
+    data = bytearray([RECORDS]) + COUNT.pack(len(records))
+    for record in records:
+        tags = [STRING_TAG if isinstance(value, str) else b"d" if isinstance(value, float) else b"q" for value in record.values()]
+
+        data += COUNT.pack(len(record))
+        data += struct.pack(f"!{len(record)}H", *[key_ids[key] for key in record])
+        data += b"".join(tags)
+
+        for tag, value in zip(tags, record.values()):
+            if tag == STRING_TAG:
+                encoded = value.encode("utf-8")
+                data += COUNT.pack(len(encoded)) + encoded
+            else:
+                data += VALUE_STRUCTS[tag].pack(value)
+
+    return bytes(data)
+
+def encode_line(line):
+    return bytes([LINE]) + line.encode("utf-8")
+
+def encode_time(transmit_time):
+    return bytes([TIME]) + TRANSMIT_TIME.pack(transmit_time)
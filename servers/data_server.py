@@ -2,12 +2,54 @@
 
 import logging
 import os
-from util.data_util import *
+import time
+from util.latest import create_latest_values
+from util.rollup import RollupWriter
+from util.storage import STORAGES, create_storage
+from .binary import RECORDS, encode_status
+from .datagram_ingest import DatagramIngest
 from .server import Server
 
 class DataServer(Server):
+    '''
+        Stores "key:value,key:value" records. Many records can be sent in one batch message,
+            batch;key:value,key:value;key:value,...
+        which is stored in one pass and answered with the overall code followed by the code of every record,
+        e.g. "400 200,400,200". The overall code is the worst of the record codes.
+
+        With udp_port, records (or batches) can also be sent one per datagram without any response, see
+        DatagramIngest. Datagrams dropped under load and invalid records are only counted in the metrics.
+
+        Connections that negotiated the binary encoding send RECORDS messages instead, whose typed values are
+        stored without any parsing, see servers/binary.py.
+
+        With shard_key, records are stored in a directory per value of that key (e.g. per device) or in shards
+        hashed from it, each with its own schema and writer, see ShardedStorage. With rollups, count, min, max,
+        sum and mean of every numeric column are also kept per bucket of each rollup interval, see RollupWriter.
+
+        With latest_history, the latest values of every key of every device (the value of latest_key) are kept in
+        memory as records are received, before they are stored, and answered without touching disk:
+            latest;<device>                 -> all keys of the device
+            latest;<device>;<key>,<key>     -> the given keys
+            history;<device>;<key>          -> the last latest_history values of the key, oldest first
+        as "200 key:value:ts,key:value:ts,..." with receipt times in epoch seconds, or "404" if there are none.
+        <device> is empty without latest_key. Workers of a multi-process server share one table in shared memory
+        of latest_size (device, key) pairs, see SharedLatestValues.
+
+        Every comma separated field of a record must hold exactly one ':' between a non-empty key and its value,
+        so keys and values cannot contain ',', ':', ';' or line breaks (values may be empty). Other records are
+        invalid (400). If a key appears more than once, its last value is stored.
+    '''
+
+    BATCH_PREFIX = "batch;"
+    LATEST_PREFIX = "latest;"
+    HISTORY_PREFIX = "history;"
+    NOT_SEPARATORS = bytes(sorted(set(range(256)) - set(b",:;\n\r")))
+
+    def __init__(self, data_dir, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8", engine="thread", framing="raw", max_frame_size=65536, workers=1, backlog=128, reject_busy=False, max_conn_per_ip=0, metrics_interval=10.0, log_queue=False, log_sample=1, log_rate_limit=0, udp_port=0, udp_queue_size=10000, flush_size=65536, flush_interval=1.0, durability="none", storage="csv", partition="none", partition_size=0, retention=0, shard_key="", shards=0, rollups=(), rollup_key="", latest_history=0, latest_key="", latest_size=65536, handoff_dir=""):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown storage backend: {storage}")
 
-    def __init__(self, data_dir, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8"):
         super().__init__(
             timeout, 
             server_name, 
@@ -15,58 +57,233 @@ class DataServer(Server):
             logs_dir=logs_dir, 
             logging_level=logging_level, 
             log_console=log_console, 
-            encoding=encoding)
+            encoding=encoding,
+            engine=engine,
+            framing=framing,
+            max_frame_size=max_frame_size,
+            workers=workers,
+            backlog=backlog,
+            reject_busy=reject_busy,
+            max_conn_per_ip=max_conn_per_ip,
+            metrics_interval=metrics_interval,
+            log_queue=log_queue,
+            log_sample=log_sample,
+            log_rate_limit=log_rate_limit,
+            udp_port=udp_port,
+            handoff_dir=handoff_dir)
 
         self.data_dir = data_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.storage_backend = storage
+        self.partition = partition
+        self.partition_size = partition_size
+        self.retention = retention
+        self.shard_key = shard_key # Records are stored in shards by the value of this key, see ShardedStorage
+        self.shards = shards
+        self.rollups = rollups # Bucket lengths in seconds of the rollups maintained at ingest, see RollupWriter
+        self.rollup_key = rollup_key
+        self.latest_history = latest_history # Values kept per device and key for latest requests, 0 to disable
+        self.latest_key = latest_key
+        self.latest_size = latest_size
+        self.latest_values = None
+        self.udp_queue_size = udp_queue_size
 
         os.makedirs(os.path.dirname(self.data_dir), exist_ok=True) # Recursively create directory if it does not exist yet
 
-        self.init_header()
+    def start(self, host, port):
+        # Shared by the workers, so it is created before they are forked
+        if self.latest_history > 0 and self.workers > 1 and not self.is_running():
+            self.latest_values = create_latest_values(device_key=self.latest_key, history=self.latest_history, size=self.latest_size, shared=True)
+
+        super().start(host, port)
+
+    def init_resources(self):
+        if self.latest_history > 0 and self.workers == 1:
+            self.latest_values = create_latest_values(device_key=self.latest_key, history=self.latest_history)
+
+        data_dir = self.worker_dir(self.data_dir)
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.storage = create_storage(
+            self.storage_backend,
+            data_dir,
+            flush_size=self.flush_size,
+            flush_interval=self.flush_interval,
+            durability=self.durability,
+            partition=self.partition,
+            partition_size=self.partition_size,
+            retention=self.retention,
+            shard_key=self.shard_key,
+            shards=self.shards)
 
-    def init_header(self):
-        self.current_header = []
+        self.rollup_writer = None
+        if self.rollups:
+            self.rollup_writer = RollupWriter(
+                data_dir,
+                intervals=self.rollups,
+                group_key=self.rollup_key,
+                flush_interval=self.flush_interval,
+                durability=self.durability)
 
-        header = read_header_file(self.data_dir).rstrip()
-        if not header:
-            self.current_header = []
-        else:
-            self.current_header = header.split(",")
+    def close_resources(self):
+        self.storage.close()
+
+        if self.rollup_writer is not None:
+            self.rollup_writer.close()
+
+        if self.latest_values is not None:
+            self.latest_values.close()
 
     def receive_data(self, data):
+        if data.startswith(self.BATCH_PREFIX):
+            return self.receive_batch(data[len(self.BATCH_PREFIX):])
+
+        if data.startswith(self.LATEST_PREFIX):
+            return self.receive_latest(data[len(self.LATEST_PREFIX):])
+
+        if data.startswith(self.HISTORY_PREFIX):
+            return self.receive_history(data[len(self.HISTORY_PREFIX):])
+
         values = self.parse_data(data)
         if values is None:
             logging.debug("Response: 400 Bad Request")
             return "400"
 
-        if not self.process_data(values):
+        return self.store_records([values], self._record_response)
+
+    def _record_response(self, stored):
+        if not stored:
             logging.debug("Response: 500 Internal Server Error")
             return "500"
 
         logging.debug("Response: 200 OK")
         return "200"
 
+    def receive_batch(self, data):
+        records = [self.parse_data(x) for x in data.split(";")]
+        return self.store_records([values for values in records if values is not None], lambda stored: self._batch_response(records, stored))
+
+    def _batch_response(self, records, stored):
+        codes = [400 if values is None else 200 if stored else 500 for values in records]
+        response = f"{max(codes)} {','.join([str(code) for code in codes])}"
+
+        logging.debug("Response: %s", response)
+        return response
+
+    def receive_latest(self, data):
+        if self.latest_values is None:
+            logging.error("Latest values are not kept. Error in reading latest values.")
+            return "400"
+
+        device, _, keys = data.partition(";")
+        latest = self.latest_values.latest(device, keys.split(",") if keys else None)
+
+        return self._values_response([(key, received, value) for key, (received, value) in latest.items()])
+
+    def receive_history(self, data):
+        if self.latest_values is None:
+            logging.error("Latest values are not kept. Error in reading value history.")
+            return "400"
+
+        device, _, key = data.partition(";")
+        readings = self.latest_values.readings(device, key)
+
+        return self._values_response([(key, received, value) for received, value in readings])
+
+    def _values_response(self, values):
+        if not values:
+            logging.debug("Response: 404 Not Found")
+            return "404"
+
+        response = "200 " + ",".join([f"{key}:{value}:{received!r}" for key, received, value in values])
+        logging.debug("Response: %s", response)
+        return response
+
+    def receive_binary(self, session, message_type, body):
+        if message_type != RECORDS:
+            return super().receive_binary(session, message_type, body)
+
+        records = session.decode_records(body)
+        return self.store_records([values for values in records if values is not None], lambda stored: self._binary_response(records, stored))
+
+    def _binary_response(self, records, stored):
+        codes = [400 if values is None else 200 if stored else 500 for values in records]
+        return encode_status(max(codes, default=200), b"".join([encode_status(code) for code in codes]))
+
+    def serve_datagrams(self, sock):
+        DatagramIngest(self.receive_datagrams, self.metrics, queue_size=self.udp_queue_size).serve(sock, lambda: self.udp_sock is None)
+
+    def receive_datagrams(self, payloads):
+        '''
+            Stores the records of many datagrams at once, each holding a record or a batch message
+        '''
+        records = []
+        for payload in payloads:
+            try:
+                data = self.decode_data(payload).rstrip()
+            except UnicodeDecodeError as e:
+                logging.error(f"{e}. Error in decoding datagram.")
+                self.metrics.inc("datagram_records_invalid")
+                continue
+
+            messages = data[len(self.BATCH_PREFIX):].split(";") if data.startswith(self.BATCH_PREFIX) else [data]
+            records.extend([self.parse_data(x) for x in messages])
+
+        valid_records = [values for values in records if values is not None]
+        self.metrics.inc("datagram_records_invalid", len(records) - len(valid_records))
+
+        if valid_records and not self.process_records(valid_records):
+            self.metrics.inc("datagram_records_failed", len(valid_records))
+
     def parse_data(self, data):
-        try:
-            values = dict([x.split(":") for x in data.split(",")])
+        # Checked on the separators alone, which must alternate ":,:,...:". None of them is part of a multi-byte
+        # UTF-8 sequence, so the encoded record holds the same separators in the same order.
+        separators = data.encode("utf-8", "surrogatepass").translate(None, self.NOT_SEPARATORS)
+        fields = data.replace(":", ",").split(",")
 
-        except ValueError as e:
-            logging.error(f"{e}. Error in parsing data.")
+        if separators != b":," * (len(separators) // 2) + b":" or "" in fields[0::2]:
+            logging.error("Malformed record %r. Error in parsing data.", data)
             return None
 
-        return values
+        return dict(zip(fields[0::2], fields[1::2]))
 
     def process_data(self, data):
+        return self.process_records([data])
+
+    def process_records(self, records):
+        '''
+            Stores many parsed records with a single schema check and a single append, returns True once stored
+        '''
+        received = time.time()
+        return self._stored(records, self.append_records(records, received).wait(), received)
+
+    def store_records(self, records, respond):
+        '''
+            Like process_records, returns respond(stored) or, until the records are durable, a DeferredResponse of it
+        '''
+        if not records:
+            return respond(True)
+
+        received = time.time()
+        commit = self.append_records(records, received)
+        return self.respond_when_durable(commit, lambda ok: respond(self._stored(records, ok, received)))
+
+    def append_records(self, records, received):
+        '''
+            Updates the latest values with records received at epoch seconds received and appends them to the
+            storage, returns their Commit
+        '''
+        if self.latest_values is not None:
+            dropped = self.latest_values.update(records, received=received)
+            if dropped:
+                self.metrics.inc("latest_values_dropped", dropped)
+
+        return self.storage.append_records(records)
+
+    def _stored(self, records, stored, received):
+        if stored and self.rollup_writer is not None: # Rolled up once stored, in the bucket of their receipt time
+            self.rollup_writer.add(records, received=received)
 
-        # Update header, if any new column(s) are added
-        header_diff = [key for key in data.keys() if key not in self.current_header]
-        if (len(header_diff) > 0):
-            logging.debug(f"Writing new column(s) to header file: {','.join(header_diff)}")
-            self.current_header += header_diff
-            if (not write_header_file(self.data_dir, self.current_header)):
-                return False
-            logging.debug(f"Current header is: {','.join(self.current_header)}")
-
-        # In case new data does not have some columns in current_header, fill with empty string
-        new_data = [str(data[key]) if key in data else "" for key in self.current_header]
-        
-        return append_data_file(self.data_dir, new_data)
+        return stored
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import socket
+import threading
+
+class DatagramIngest:
+    '''
+        Receives fire-and-forget datagrams on a UDP socket and passes their payloads to handle(payloads) in a
+        consumer thread, through a queue of at most queue_size datagrams.
+
+        The receiver never waits for processing: datagrams that arrive while queue_size datagrams are queued are
+        dropped and counted as datagrams_dropped. After every blocking receive, whatever else is already waiting on the socket
+        is drained with non-blocking receives (up to BURST_SIZE datagrams) and queued as one burst, and the
+        consumer hands several bursts to handle at once, so bursts cost one queue operation and one store.
+    '''
+
+    BURST_SIZE = 64
+    MAX_HANDLE_SIZE = 1024 # Datagrams per call to handle
+    DATAGRAM_SIZE = 65535
+
+    def __init__(self, handle, metrics, queue_size=10000):
+        self.handle = handle
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self._queue = queue.SimpleQueue() # Bounded by _queued
+        self._queued = 0 # Datagrams in _queue
+        self._queued_lock = threading.Lock()
+
+    def serve(self, sock, is_stopped):
+        '''
+            Receives until is_stopped() is True after receiving fails or returns nothing (i.e. the socket was shut
+            down), then waits for the consumer to handle what is queued
+        '''
+        consumer = threading.Thread(target=self._consume, daemon=True)
+        consumer.start()
+
+        buffer = bytearray(self.DATAGRAM_SIZE)
+        view = memoryview(buffer)
+
+        # Bound once, this loop runs for every datagram
+        recv_into = sock.recv_into
+        put = self._queue.put
+        queued_lock = self._queued_lock
+        inc = self.metrics.inc
+
+        try:
+            while True:
+                try:
+                    size = recv_into(buffer)
+                except OSError:
+                    if is_stopped():
+                        return
+                    continue
+
+                if not size:
+                    if is_stopped():
+                        return
+                    continue
+
+                burst = [bytes(view[:size])]
+                while len(burst) < self.BURST_SIZE:
+                    try:
+                        size = recv_into(buffer, 0, socket.MSG_DONTWAIT)
+                    except OSError: # Nothing waiting (BlockingIOError) or shut down
+                        break
+
+                    if not size:
+                        break
+                    burst.append(bytes(view[:size]))
+
+                with queued_lock:
+                    room = max(self.queue_size - self._queued, 0)
+                    if len(burst) > room:
+                        inc("datagrams_dropped", len(burst) - room)
+                        burst = burst[:room]
+                    self._queued += len(burst)
+
+                if burst:
+                    put(burst)
+                    inc("datagrams", len(burst))
+
+        finally:
+            self._queue.put(None)
+            consumer.join()
+
+    def _consume(self):
+
+        stopped = False
+        while not stopped:
+            burst = self._queue.get()
+            if burst is None:
+                return
+
+            payloads = list(burst)
+            while len(payloads) < self.MAX_HANDLE_SIZE:
+                try:
+                    burst = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if burst is None:
+                    stopped = True
+                    break
+                payloads.extend(burst)
+
+            with self._queued_lock:
+                self._queued -= len(payloads)
+
+            try:
+                self.handle(payloads)
+            except (OSError, ValueError) as e:
+                logging.error(f"{e}. Error handling {len(payloads)} datagram(s).")
+                self.metrics.inc("datagram_errors", len(payloads))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import struct
+
+class FrameError(ValueError):
+    pass
+
+class RawFramer:
+    '''
+        Legacy framing, every chunk read off the socket is treated as exactly one message
+    '''
+
+    def __init__(self, max_frame_size=65536):
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        '''
+            Returns list of complete messages (byte-strings)
+        '''
+        return [data]
+
+    def frame(self, data):
+        '''
+            Returns byte-string ready to be written to the socket
+        '''
+        return data
+
+class NewlineFramer(RawFramer):
+    '''
+        Newline-delimited messages, reassembled across reads
+    '''
+
+    def __init__(self, max_frame_size=65536):
+        super().__init__(max_frame_size=max_frame_size)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            if len(self.buffer) > self.max_frame_size:
+                raise FrameError(f"Message exceeds maximum frame size of {self.max_frame_size} bytes")
+            return []
+
+        messages = self.buffer[:end].split(b"\n")
+        del self.buffer[:end + 1]
+
+        if len(self.buffer) > self.max_frame_size or (end > self.max_frame_size and max(map(len, messages)) > self.max_frame_size):
+            raise FrameError(f"Message exceeds maximum frame size of {self.max_frame_size} bytes")
+
+        return [bytes(message) for message in messages if message.strip()]
+
+    def frame(self, data):
+        return data + b"\n"
+
+class LengthPrefixFramer(RawFramer):
+    '''
+        Messages prefixed with their length as a 4-byte big-endian unsigned integer
+    '''
+
+    HEADER = struct.Struct("!I")
+
+    def __init__(self, max_frame_size=65536):
+        super().__init__(max_frame_size=max_frame_size)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+        messages = []
+        start = 0
+        while len(self.buffer) - start >= self.HEADER.size:
+            length, = self.HEADER.unpack_from(self.buffer, start)
+            if length > self.max_frame_size:
+                raise FrameError(f"Message exceeds maximum frame size of {self.max_frame_size} bytes")
+
+            end = start + self.HEADER.size + length
+            if end > len(self.buffer): # Incomplete message, wait for more data
+                break
+
+            messages.append(bytes(self.buffer[start + self.HEADER.size:end]))
+            start = end
+
+        del self.buffer[:start]
+
+        return messages
+
+    def frame(self, data):
+        return self.HEADER.pack(len(data)) + data
+
+FRAMERS = {
+    "raw": RawFramer,
+    "newline": NewlineFramer,
+    "length": LengthPrefixFramer,
+}
+
+def create_framer(framing, max_frame_size=65536):
+    try:
+        return FRAMERS[framing](max_frame_size=max_frame_size)
+    except KeyError:
+        raise ValueError(f"Unknown framing: {framing}")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import socket
+import threading
+
+'''
+    Handover of listening sockets from a running server to its replacement over a Unix socket, so restarting a
+    server never refuses a connection:
+        1. the new process connects to the old one's handoff socket and sends REQUEST
+        2. the old one answers with the file descriptors of its listening sockets (SCM_RIGHTS)
+        3. the new process starts its workers accepting on them and sends READY
+        4. the old one stops accepting and drains its connections as on SIGTERM, see Server.stop()
+    Connections that arrive meanwhile wait in the backlog of the listening socket, which both processes share.
+    Without an old process (or if it does not answer READY in time) both simply carry on as before.
+'''
+
+REQUEST = b"HANDOFF"
+READY = b"READY"
+
+MAX_SOCKETS = 256
+TIMEOUT = 30 # In seconds
+
+_held = set() # Sockets the servers of this process hold for their workers, which forked workers must not keep open
+
+def hold(sock):
+    _held.add(sock)
+
+def release(sock):
+    _held.discard(sock)
+    sock.close()
+
+def close_held(keep=()):
+    '''
+        Closes the held sockets other than keep, called in forked workers. A listening socket must only be open in
+        processes that accept on it, or connections queue on it once they have stopped instead of being refused.
+    '''
+    for sock in list(_held):
+        if sock not in keep:
+            release(sock)
+
+def handoff_path(handoff_dir, server_name):
+    return os.path.join(handoff_dir, server_name + ".sock")
+
+def request_sockets(path):
+    '''
+        Returns (connection to the old process, its listening sockets), or (None, []) if no process serves path
+    '''
+    if not os.path.exists(path):
+        return None, []
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(TIMEOUT)
+
+    try:
+        conn.connect(path)
+        conn.sendall(REQUEST)
+        _, fds, _, _ = socket.recv_fds(conn, 64, MAX_SOCKETS)
+
+    except OSError as e: # Stale socket file of a process that is gone
+        logging.info(f"{e}. No server to take over from at {path}.")
+        conn.close()
+        return None, []
+
+    return conn, [socket.socket(fileno=fd) for fd in fds]
+
+def acknowledge(conn):
+    '''
+        Tells the old process that the taken over sockets are accepted on, so it can stop
+    '''
+    try:
+        conn.sendall(READY)
+    except OSError as e:
+        logging.error(f"{e}. Error acknowledging the socket handoff.")
+    finally:
+        conn.close()
+
+class HandoffListener:
+    '''
+        Hands socks over to the first process that requests them on path, then calls on_handoff() once it is
+        ready. Runs in a thread of the process that started the server.
+    '''
+
+    def __init__(self, path, socks, on_handoff):
+        self.path = path
+        self.socks = socks
+        self.on_handoff = on_handoff
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path): # Left by the process this one took over from, or by one that is gone
+            os.remove(path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(1)
+        self._inode = os.stat(path).st_ino
+        self._closed = False
+        hold(self.sock)
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError: # Closed
+                return
+
+            with conn:
+                if self._hand_over(conn):
+                    logging.info(f"Listening socket(s) handed over through {self.path}, stopping")
+                    self.close(remove=False) # The path now belongs to the new process
+                    self.on_handoff()
+                    return
+
+    def _hand_over(self, conn):
+        # Returns True once the new process accepts on the sockets
+        conn.settimeout(TIMEOUT)
+
+        try:
+            if conn.recv(len(REQUEST)) != REQUEST:
+                return False
+
+            socket.send_fds(conn, [str(len(self.socks)).encode()], [sock.fileno() for sock in self.socks])
+            return conn.recv(len(READY)) == READY
+
+        except OSError as e:
+            logging.error(f"{e}. Error handing over listening socket(s), still serving.")
+            return False
+
+    def close(self, remove=True):
+
+        if self._closed: # Again by on_handoff()
+            return
+        self._closed = True
+
+        try:
+            if remove and os.stat(self.path).st_ino == self._inode:
+                os.remove(self.path)
+        except OSError: # Already replaced or removed
+            pass
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # Wakes _serve up from accepting
+        except OSError:
+            pass
+
+        release(self.sock)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import logging.handlers
+import queue
+import time
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    '''
+        Enqueues records unformatted, so formatting happens in the QueueListener thread rather than the thread
+        that logged. Only for listeners in the same process, records are not made picklable.
+    '''
+
+    def prepare(self, record):
+        return record
+
+def start_queue_listener(handlers):
+    '''
+        Returns (handler, listener), the handler only enqueues records and the started listener writes them to
+        handlers from a background thread. Stop the listener to write out what is still queued.
+    '''
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    return LazyQueueHandler(log_queue), listener
+
+class LogSampler:
+    '''
+        Decides which lines of a per-message log line stream are written: one in every `every` lines and at most
+        rate_limit lines per second (0 for no limit). Not locked, concurrent callers may let an extra line through.
+    '''
+
+    def __init__(self, every=1, rate_limit=0):
+        self.every = max(1, every)
+        self.rate_limit = rate_limit
+
+        self._count = 0
+        self._window = 0
+        self._window_lines = 0
+        self._suppressed = 0
+
+    def sample(self):
+        '''
+            Returns None if the line should be dropped, otherwise the number of lines dropped since the last one
+        '''
+        self._count += 1
+        if self._count % self.every:
+            self._suppressed += 1
+            return None
+
+        if self.rate_limit > 0:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._window_lines = 0
+
+            if self._window_lines >= self.rate_limit:
+                self._suppressed += 1
+                return None
+
+            self._window_lines += 1
+
+        suppressed = self._suppressed
+        self._suppressed = 0
+        return suppressed
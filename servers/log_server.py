@@ -4,11 +4,22 @@ import logging
 import os
 from datetime import datetime
 from util.data_util import *
+from .binary import LINE, encode_status
+from .datagram_ingest import DatagramIngest
 from .server import Server
 
 class LogServer(Server):
+    '''
+        Appends every message as a line to data.log, or to rolling partitions of it (see PartitionedFileWriter),
+        which can be compressed once closed. Receipt times are kept in a timestamp index next to each file and,
+        with token_index, the words of every line in a token index, see search_logs.py.
 
-    def __init__(self, log_data_dir, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8"):
+        With udp_port, lines can also be sent without any response, any number of newline-separated lines per
+        datagram, see DatagramIngest. Connections that negotiated the binary encoding send lines as LINE messages,
+        see servers/binary.py.
+    '''
+
+    def __init__(self, log_data_dir, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8", engine="thread", framing="raw", max_frame_size=65536, workers=1, backlog=128, reject_busy=False, max_conn_per_ip=0, metrics_interval=10.0, log_queue=False, log_sample=1, log_rate_limit=0, udp_port=0, udp_queue_size=10000, flush_size=65536, flush_interval=1.0, durability="none", partition="none", partition_size=0, retention=0, retention_size=0, compress=False, token_index=False, handoff_dir=""):
         super().__init__(
             timeout, 
             server_name, 
@@ -16,20 +27,101 @@ class LogServer(Server):
             logs_dir=logs_dir, 
             logging_level=logging_level, 
             log_console=log_console, 
-            encoding=encoding)
+            encoding=encoding,
+            engine=engine,
+            framing=framing,
+            max_frame_size=max_frame_size,
+            workers=workers,
+            backlog=backlog,
+            reject_busy=reject_busy,
+            max_conn_per_ip=max_conn_per_ip,
+            metrics_interval=metrics_interval,
+            log_queue=log_queue,
+            log_sample=log_sample,
+            log_rate_limit=log_rate_limit,
+            udp_port=udp_port,
+            handoff_dir=handoff_dir)
 
         self.log_data_dir = log_data_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.partition = partition
+        self.partition_size = partition_size
+        self.retention = retention
+        self.retention_size = retention_size
+        self.compress = compress
+        self.token_index = token_index
+        self.udp_queue_size = udp_queue_size
         
         os.makedirs(os.path.dirname(self.log_data_dir), exist_ok=True) # Recursively create directory if it does not exist yet
 
+    def init_resources(self):
+        log_data_dir = self.worker_dir(self.log_data_dir)
+        os.makedirs(log_data_dir, exist_ok=True)
+
+        self.log_data_writer = create_file_writer(
+            log_data_dir,
+            "data",
+            "log",
+            flush_size=self.flush_size,
+            flush_interval=self.flush_interval,
+            durability=self.durability,
+            ts_index=True,
+            partition=self.partition,
+            partition_size=self.partition_size,
+            retention=self.retention,
+            retention_size=self.retention_size,
+            compress=self.compress,
+            token_index=self.token_index)
+
+    def close_resources(self):
+        self.log_data_writer.close()
+
+    def serve_datagrams(self, sock):
+        DatagramIngest(self.receive_datagrams, self.metrics, queue_size=self.udp_queue_size).serve(sock, lambda: self.udp_sock is None)
+
+    def receive_datagrams(self, payloads):
+        '''
+            Writes the lines of many datagrams at once
+        '''
+        lines = []
+        for payload in payloads:
+            try:
+                lines.extend([line for line in self.decode_data(payload).rstrip().split("\n") if line])
+            except UnicodeDecodeError as e:
+                logging.error(f"{e}. Error in decoding datagram.")
+                self.metrics.inc("datagram_records_invalid")
+
+        if lines and not self.log_data_writer.write(lines):
+            self.metrics.inc("datagram_records_failed", len(lines))
+
     def receive_data(self, data):
+        return self.respond_when_durable(self._append_lines([data]), self._line_response)
 
-        if not self.process_data(data):
+    def _line_response(self, stored):
+        if not stored:
             logging.debug("Response: 500 Internal Server Error")
             return "500"
 
         logging.debug("Response: 200 OK")
         return "200"
 
+    def receive_binary(self, session, message_type, body):
+        if message_type != LINE:
+            return super().receive_binary(session, message_type, body)
+
+        try:
+            lines = [line for line in bytes(body).decode("utf-8").rstrip().split("\n") if line]
+        except UnicodeDecodeError as e:
+            logging.error(f"{e}. Error in decoding binary data.")
+            return encode_status(400)
+
+        return self.respond_when_durable(self._append_lines(lines), lambda stored: encode_status(200 if stored else 500))
+
     def process_data(self, data):
-        return append_log_data_file(self.log_data_dir, data)
+        return self.log_data_writer.write([data])
+
+    def _append_lines(self, lines):
+        # Returns the Commit of lines, see respond_when_durable
+        return Commit([(self.log_data_writer, self.log_data_writer.append(lines))])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+class Metrics:
+    '''
+        Counters and latency histograms of a server process, e.g.
+            metrics.inc("messages")
+            metrics.inc("responses", labels=(("code", "200"),))
+            metrics.observe("handle", seconds)
+
+        Every thread records into its own shard, so recording never takes a lock or contends with other threads.
+        Shards are only merged when a snapshot is taken, shards of finished threads are folded into one.
+        Histograms have log2 buckets of microseconds, from 1us up to 2**(BUCKETS - 1)us (~8s) and +Inf.
+    '''
+
+    BUCKETS = 24
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = [] # (thread, counters, histograms)
+        self._retired = ({}, {}) # Merged shards of finished threads
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = ({}, {})
+            with self._lock: # Once per thread
+                self._shards.append((threading.current_thread(), *shard))
+            return shard
+
+    def inc(self, name, value=1, labels=()):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds):
+        histograms = self._shard()[1]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = [0] * (self.BUCKETS + 1) + [0.0] # Buckets, +Inf, sum
+
+        histogram[min(int(seconds * 1e6).bit_length(), self.BUCKETS)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self):
+        '''
+            Returns (counters, histograms) summed over all threads. Values recorded while the snapshot is taken may
+            or may not be included.
+        '''
+        with self._lock:
+            live = []
+            for thread, counters, histograms in self._shards:
+                if not thread.is_alive():
+                    _merge(self._retired, (counters, histograms))
+                else:
+                    live.append((thread, counters, histograms))
+            self._shards = live
+
+            total = ({}, {})
+            _merge(total, self._retired)
+            for _, counters, histograms in live:
+                _merge(total, (dict(counters), {name: list(histogram) for name, histogram in list(histograms.items())}))
+
+        return total
+
+    def to_prometheus(self, prefix="server", labels=()):
+        '''
+            Returns the snapshot in the Prometheus text exposition format
+        '''
+        counters, histograms = self.snapshot()
+        lines = []
+
+        for name in sorted(set([name for name, _ in counters])):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (key, key_labels), value in sorted(counters.items()):
+                if key == name:
+                    lines.append(f"{prefix}_{name}_total{_labels(labels + key_labels)} {value}")
+
+        for name, histogram in sorted(histograms.items()):
+            lines.append(f"# TYPE {prefix}_{name}_seconds histogram")
+            count = 0
+            for i, value in enumerate(histogram[:-1]):
+                count += value
+                le = "+Inf" if i == self.BUCKETS else repr(2 ** i / 1e6)
+                lines.append(f"{prefix}_{name}_seconds_bucket{_labels(labels + (('le', le),))} {count}")
+            lines.append(f"{prefix}_{name}_seconds_sum{_labels(labels)} {histogram[-1]!r}")
+            lines.append(f"{prefix}_{name}_seconds_count{_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, file_path, prefix="server", labels=()):
+
+        with open(file_path + ".tmp", "w") as f:
+            f.write(self.to_prometheus(prefix=prefix, labels=labels))
+
+        os.replace(file_path + ".tmp", file_path) # Atomic, scrapers never see a partially written file
+
+def _merge(total, shard):
+    counters, histograms = total
+
+    for key, value in shard[0].items():
+        counters[key] = counters.get(key, 0) + value
+
+    for name, histogram in shard[1].items():
+        merged = histograms.setdefault(name, [0] * (len(histogram) - 1) + [0.0])
+        for i, value in enumerate(histogram):
+            merged[i] += value
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join([f'{key}="{value}"' for key, value in labels]) + "}"
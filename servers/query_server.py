@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from util.rollup import ROLLUP_COLUMNS, read_rollups
+from util.storage import read_csv_rows
+from .server import Server
+
+class QueryServer(Server):
+    '''
+        Answers time-range column reads over the data stored by a DataServer (csv storage), e.g.
+            select:temp,humidity,from:<ts>,to:<ts>
+        "from" and "to" are optional receipt times in epoch seconds. With "shard:<value>", only the rows of that
+        value of the shard key are read, from its shard directories only (see ShardedStorage). The response is
+        streamed as
+            200 ts,temp,humidity
+            <rows, chunk_rows at a time>
+            END
+        so it should be used with newline or length framing.
+
+        With "rollup:<interval>", the rollups of the selected columns in buckets of interval seconds are read
+        instead of the rows (see RollupWriter), "shard:<value>" then selects the rollups of that group:
+            200 ts,group,column,count,min,max,sum,mean
+    '''
+
+    def __init__(self, data_dir, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8", engine="thread", framing="newline", max_frame_size=65536, workers=1, backlog=128, reject_busy=False, max_conn_per_ip=0, metrics_interval=10.0, log_queue=False, log_sample=1, log_rate_limit=0, chunk_rows=1000, handoff_dir=""):
+        super().__init__(
+            timeout,
+            server_name,
+            max_conn=max_conn,
+            logs_dir=logs_dir,
+            logging_level=logging_level,
+            log_console=log_console,
+            encoding=encoding,
+            engine=engine,
+            framing=framing,
+            max_frame_size=max_frame_size,
+            workers=workers,
+            backlog=backlog,
+            reject_busy=reject_busy,
+            max_conn_per_ip=max_conn_per_ip,
+            metrics_interval=metrics_interval,
+            log_queue=log_queue,
+            log_sample=log_sample,
+            log_rate_limit=log_rate_limit,
+            handoff_dir=handoff_dir)
+
+        self.data_dir = data_dir
+        self.chunk_rows = chunk_rows
+        self.blocking_handlers = True # Queries read from disk
+
+        os.makedirs(os.path.dirname(self.data_dir), exist_ok=True) # Recursively create directory if it does not exist yet
+
+    def receive_data(self, data):
+        values = self.parse_data(data)
+        if values is None:
+            logging.debug("Response: 400 Bad Request")
+            return "400"
+
+        logging.debug("Response: 200 OK")
+        return self.process_data(values)
+
+    def parse_data(self, data):
+        values = {"select": [], "from": None, "to": None, "shard": None, "rollup": None}
+
+        try:
+            key = None
+            for x in data.split(","):
+                if ":" in x:
+                    key, value = x.split(":")
+                elif key == "select": # Further columns of the select list
+                    value = x
+                else:
+                    raise ValueError(f"Unexpected token '{x}'")
+
+                if key == "select":
+                    values["select"].append(value)
+                elif key in ("from", "to"):
+                    values[key] = float(value)
+                elif key == "shard":
+                    values[key] = value
+                elif key == "rollup":
+                    values[key] = int(value)
+                else:
+                    raise ValueError(f"Unknown query key '{key}'")
+
+        except ValueError as e:
+            logging.error(f"{e}. Error in parsing data.")
+            return None
+
+        if not values["select"]:
+            logging.error("No column(s) selected. Error in parsing data.")
+            return None
+
+        return values
+
+    def process_data(self, data):
+        '''
+            Returns generator of response chunks, rows are only read from disk as the chunks are sent
+        '''
+        if data["rollup"] is not None:
+            yield from self.process_rollup(data)
+            return
+
+        yield "200 " + ",".join(["ts"] + data["select"])
+
+        try:
+            for rows in read_csv_rows(self.data_dir, data["select"], start=data["from"], end=data["to"], chunk_rows=self.chunk_rows, shard=data["shard"]):
+                yield "\n".join([",".join([repr(received)] + values) for received, values in rows])
+
+        except OSError as e:
+            logging.error(f"{e}. Error in processing data.")
+            yield "500"
+            return
+
+        yield "END"
+
+    def process_rollup(self, data):
+        try:
+            rows = read_rollups(self.data_dir, data["rollup"], columns=data["select"], start=data["from"], end=data["to"], group=data["shard"])
+
+        except (OSError, ValueError) as e:
+            logging.error(f"{e}. Error in processing data.")
+            yield "500"
+            return
+
+        yield "200 " + ",".join(("ts", "group", "column") + ROLLUP_COLUMNS)
+
+        for i in range(0, len(rows), self.chunk_rows):
+            yield "\n".join([",".join([str(value) if isinstance(value, str) else repr(value) for value in row]) for row in rows[i:i + self.chunk_rows]])
+
+        yield "END"
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import asyncio
+import contextvars
 import threading
 import logging
 import multiprocessing
@@ -9,25 +11,107 @@ import signal
 import socket
 import sys
 import time
+from util.data_util import Commit, worker_data_dir
+from .admission import AdmissionControl
+from .binary import HELLO, KEYS, STATUS, BinaryError, BinarySession, encode_status
+from .framing import FRAMERS, create_framer
+from .handoff import HandoffListener, acknowledge, close_held, handoff_path, hold, release, request_sockets
+from .log_pipeline import LogSampler, start_queue_listener
+from .metrics import Metrics
+
+class DeferredResponse:
+    '''
+        Response of receive_data or receive_binary that is only known once a write is durable: respond(ok) returns
+        it once commit (see util.data_util.Commit) is. The thread engine blocks on the commit, the asyncio engine
+        awaits it without holding a thread, so any number of connections wait for the same group commit.
+    '''
+
+    def __init__(self, commit, respond):
+        self.commit = commit
+        self.respond = respond
+
+    def then(self, f):
+        return DeferredResponse(self.commit, lambda ok: f(self.respond(ok)))
+
+    def resolve(self):
+        return self.respond(self.commit.wait())
+
+    async def resolve_async(self):
+        return self.respond(await self.commit.wait_async())
+
+def _join_responses(responses):
+    # Joins framed responses, into a DeferredResponse once all commits are durable if any of them is deferred
+    deferred = [response for response in responses if isinstance(response, DeferredResponse)]
+    if not deferred:
+        return b"".join(responses)
+
+    commit = Commit()
+    for response in deferred:
+        commit.add(response.commit)
+
+    # Resolving does not block once the commits are durable
+    return DeferredResponse(commit, lambda ok: b"".join([response.resolve() if isinstance(response, DeferredResponse) else response for response in responses]))
 
 class Server:
 
-    def __init__(self, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8"):
+    ENGINES = ("thread", "asyncio")
+    BUSY_RESPONSE = "503"
+    LOG_FORMAT = '%(asctime)s -> [%(name)s] %(levelname)s : %(message)s'
+    FRAMINGS = tuple(FRAMERS)
+    RECV_SIZE = 65536
+    UDP_RECV_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8", engine="thread", framing="raw", max_frame_size=65536, workers=1, backlog=128, reject_busy=False, max_conn_per_ip=0, metrics_interval=10.0, log_queue=False, log_sample=1, log_rate_limit=0, udp_port=0, handoff_dir=""):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown connection engine: {engine}")
+
+        if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("Multiple workers require SO_REUSEPORT, which this platform does not support")
+
+        if framing not in self.FRAMINGS:
+            raise ValueError(f"Unknown framing: {framing}")
+
         self.timeout = timeout
         self.server_name = server_name
         self.max_conn = max_conn
         self.logs_path = os.path.join(logs_dir, server_name + ".log")
         self.logging_level = logging_level
         self.log_console = log_console
+        self.log_queue = log_queue # Write log records to disk from a background thread
+        self.log_sample = log_sample # Log "Received data" for one in every log_sample messages
+        self.log_rate_limit = log_rate_limit # At most log_rate_limit "Received data" lines per second, 0 for no limit
         self.encoding = encoding
-
-        self.server_proc = None
+        self.engine = engine
+        self.framing = framing
+        self.max_frame_size = max_frame_size
+        self.workers = workers
+        self.worker_idx = 0
+        self.backlog = backlog
+        self.reject_busy = reject_busy
+        self.max_conn_per_ip = max_conn_per_ip
+        self.udp_port = udp_port # Also serve datagrams on this port (see serve_datagrams), 0 to disable
+        self.metrics_interval = metrics_interval # Seconds between dumps of the metrics file, 0 to only dump on exit
+        self.handoff_dir = handoff_dir # Listening sockets are handed over to a restarted server through a Unix socket here, "" to disable
+
+        self.server_procs = []
+        self.listen_socks = [] # One per worker, created by start() so they can be handed over
+        self._listen_sock = None
+        self._handoff_listener = None
+        self._log_listener = None
+        self.blocking_handlers = False # Set when receive_data may block (e.g. reading from disk), writes return a DeferredResponse instead
 
     def _close_main_sock(self):
 
+        self._stop_udp()
+
         if self.sock is not None:
             logging.info("Closing main socket. All future incoming connections will be refused.")
-            self.sock.close()
+
+            if self._accept_task is not None: # asyncio engine, socket is closed by the accept loop once it is cancelled
+                self._accept_task.cancel()
+            else:
+                self.sock.close()
+
             self.sock = None
 
     def _terminate_all(self):
@@ -37,108 +121,577 @@ class Server:
             if conn is not None:
                 conn.close()
 
+    def _reject_conn(self, conn, host, port):
+        '''
+            Answers a connection that was not admitted with BUSY_RESPONSE and closes it, without blocking
+        '''
+        logging.warning(f"Rejecting connection with {host}:{port}, server or client at its connection limit")
+        self.metrics.inc("rejected")
+
+        try:
+            conn.setblocking(False)
+            conn.send(create_framer(self.framing).frame(self.encode_data(self.BUSY_RESPONSE)))
+        except OSError:
+            pass
+
+        conn.close()
+
     def _start_conn_thread(self, idx, conn, host, port):
 
-        self._conn_count += 1
         self.conn[idx] = conn
+        framer = create_framer(self.framing, max_frame_size=self.max_frame_size)
+        session = BinarySession()
+        self.metrics.inc("connections")
 
         with conn:
-            logging.info(f"Started connection with: {host}:{port} on server {idx}")
+            logging.info("Started connection with: %s:%s on server %s", host, port, idx)
 
             while True:
                 try:
                     ready_to_read, _, _ = select.select([conn,], [], [], self.timeout)
 
                     if len(ready_to_read) <= 0: # Timeout occured
+                        self.metrics.inc("timeouts")
                         break
 
-                    data = conn.recv(4096) # Receive
+                    data = conn.recv(self.RECV_SIZE) # Receive
 
                     if not data: # Empty data stream. Connection terminated.
                         break
 
-                    logging.info(f"Received data: {data}")
-                    data = self.decode_data(data).rstrip()
-                    logging.debug(f"Decoded data: {data}")
+                    received = time.perf_counter()
+                    self.metrics.inc("bytes_received", len(data))
 
-                    response = self.receive_data(data)
+                    for response in self._handle_messages(framer, session, data):
+                        if isinstance(response, DeferredResponse):
+                            response = response.resolve()
 
-                    logging.debug(f"Response code: {response}")
-                    response = self.encode_data(response)
-                    logging.debug(f"Encoded response: {response}")
-                    conn.sendall(response) # Respond
+                        start = time.perf_counter()
+                        conn.sendall(response) # Respond to all pipelined messages at once
+                        self.metrics.observe("write", time.perf_counter() - start)
+                        self.metrics.inc("bytes_sent", len(response))
+
+                    self.metrics.observe("respond", time.perf_counter() - received)
 
                 except UnicodeDecodeError as e: # Catches decoding error
                     logging.error(f"{e}")
+                    self.metrics.inc("errors")
                     conn.close()
                     break
 
                 except (OSError, ValueError, select.error, socket.error) as e: # Catches all socket errors (incl. subclass of OSError) leading to closed socket
                     logging.error(f"{e}")
+                    self.metrics.inc("errors")
                     logging.error("Socket terminated prematurely")
                     break
 
-            logging.info(f"Terminating connection with {host}:{port}")
-            logging.info(f"Connection ended with: {host}:{port}")
+            logging.info("Terminating connection with %s:%s", host, port)
+            logging.info("Connection ended with: %s:%s", host, port)
 
         self.conn[idx] = None
-        self._conn_count -= 1
+        self.admission.release(idx, host)
+        self._conn_threads.discard(threading.current_thread())
 
-        logging.info(f"Server {idx} will terminate now")
+        logging.info("Server %s will terminate now", idx)
 
-    def _run_server(self, host, port):
+    def _handle_message(self, data):
+        '''
+            Decodes a received message, passes it to receive_data and returns the encoded response.
+            receive_data may also return an iterable of strings to stream a response in chunks, which are then
+            returned as a generator of encoded chunks, or a DeferredResponse of a write (see respond_when_durable).
+        '''
+        suppressed = self.log_sampler.sample()
+        if suppressed:
+            logging.info("Received data: %s (%s earlier message(s) not logged)", data, suppressed)
+        elif suppressed is not None:
+            logging.info("Received data: %s", data)
+        self.metrics.inc("messages")
 
-        signal.signal(signal.SIGINT, self._kill_server) # Ignored in child process
-        signal.signal(signal.SIGTERM, self._kill_server)
-        signal.signal(signal.SIGUSR1, self._kill_server)
+        start = time.perf_counter()
+        data = self.decode_data(data).rstrip()
+        decoded = time.perf_counter()
+        self.metrics.observe("decode", decoded - start)
+        logging.debug("Decoded data: %s", data)
+
+        response = self.receive_data(data)
+        self.metrics.observe("handle", time.perf_counter() - decoded)
+
+        if isinstance(response, DeferredResponse):
+            return response.then(self._encode_response)
+
+        if not isinstance(response, str):
+            self.metrics.inc("responses", labels=(("code", "streamed"),))
+            return (self.encode_data(chunk) for chunk in response)
+
+        return self._encode_response(response)
+
+    def _encode_response(self, response):
+
+        self.metrics.inc("responses", labels=(("code", response[:3] if response[:3].isdigit() else "other"),))
+        logging.debug("Response code: %s", response)
+        response = self.encode_data(response)
+        logging.debug("Encoded response: %s", response)
+
+        return response
+
+    def _handle_binary_message(self, session, data):
+        '''
+            Like _handle_message for a connection that negotiated the binary encoding (see servers/binary.py)
+        '''
+        suppressed = self.log_sampler.sample()
+        if suppressed:
+            logging.info("Received binary data: %r (%s earlier message(s) not logged)", data, suppressed)
+        elif suppressed is not None:
+            logging.info("Received binary data: %r", data)
+        self.metrics.inc("messages")
+
+        start = time.perf_counter()
+        try:
+            if not data:
+                raise BinaryError("Empty message")
+
+            if data[0] == KEYS:
+                session.define_keys(memoryview(data)[1:])
+                response = encode_status(200)
+            else:
+                response = self.receive_binary(session, data[0], memoryview(data)[1:])
+
+        except BinaryError as e:
+            logging.error(f"{e}. Error in decoding binary data.")
+            response = encode_status(400)
+
+        self.metrics.observe("handle", time.perf_counter() - start)
+
+        if isinstance(response, DeferredResponse):
+            return response.then(self._count_binary_response)
+
+        return self._count_binary_response(response)
+
+    def _count_binary_response(self, response):
+
+        code, = STATUS.unpack_from(response)
+        self.metrics.inc("responses", labels=(("code", str(code)),))
+        logging.debug("Response code: %s", code)
+
+        return response
+
+    def _handle_messages(self, framer, session, data):
+        '''
+            Reassembles complete messages from received data and yields their framed responses, in order.
+            Consecutive responses are joined into one byte-string so pipelined messages are answered in one write.
+        '''
+        pending = []
+
+        for message in framer.feed(data):
+            if session.active:
+                response = self._handle_binary_message(session, message)
+            elif session.negotiate(message, self.framing):
+                logging.info("Binary encoding negotiated")
+                response = HELLO
+            else:
+                response = self._handle_message(message)
+
+            if isinstance(response, bytes):
+                pending.append(framer.frame(response))
+                continue
+
+            if isinstance(response, DeferredResponse): # Pipelined writes share their group commits
+                pending.append(response.then(framer.frame))
+                continue
+
+            if pending: # Streamed response, send what is pending first to keep responses in order
+                yield _join_responses(pending)
+                pending = []
+
+            for chunk in response:
+                yield framer.frame(chunk)
+
+        if pending:
+            yield _join_responses(pending)
+
+    async def _start_conn_task(self, idx, conn, host, port):
+
+        loop = asyncio.get_running_loop()
+        reader, writer = await asyncio.open_connection(sock=conn)
+        self.conn.add(writer)
+        framer = create_framer(self.framing, max_frame_size=self.max_frame_size)
+        session = BinarySession()
+        self.metrics.inc("connections")
+
+        logging.info("Started connection with: %s:%s", host, port)
+
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(self.RECV_SIZE), self.timeout) # Receive
+
+                except asyncio.TimeoutError: # Timeout occured
+                    self.metrics.inc("timeouts")
+                    break
+
+                if not data: # Empty data stream. Connection terminated.
+                    break
+
+                received = time.perf_counter()
+                self.metrics.inc("bytes_received", len(data))
+                responses = self._handle_messages(framer, session, data)
+
+                while True:
+                    if self.blocking_handlers: # Keep the event loop serving other connections while receive_data waits
+                        response = await loop.run_in_executor(None, contextvars.copy_context().run, next, responses, None) # Keeps log context
+                    else:
+                        response = next(responses, None)
+
+                    if response is None:
+                        break
+
+                    if isinstance(response, DeferredResponse): # Awaits the group commit without holding a thread
+                        response = await response.resolve_async()
+
+                    start = time.perf_counter()
+                    writer.write(response) # Respond to all pipelined messages at once
+                    await writer.drain()
+                    self.metrics.observe("write", time.perf_counter() - start)
+                    self.metrics.inc("bytes_sent", len(response))
+
+                self.metrics.observe("respond", time.perf_counter() - received)
+
+        except UnicodeDecodeError as e: # Catches decoding error
+            logging.error(f"{e}")
+            self.metrics.inc("errors")
+
+        except (OSError, ValueError) as e: # Catches all socket errors (incl. subclass of OSError) leading to closed socket
+            logging.error(f"{e}")
+            self.metrics.inc("errors")
+            logging.error("Socket terminated prematurely")
+
+        finally:
+            logging.info("Terminating connection with %s:%s", host, port)
+            writer.close()
+            logging.info("Connection ended with: %s:%s", host, port)
+
+            self.conn.discard(writer)
+            self.admission.release(idx, host)
+
+            async with self._conn_available:
+                self._conn_available.notify()
+
+    async def _accept_async(self, loop):
+        # Only waits for the socket to be readable, unlike loop.sock_accept, whose connection is lost if the accept
+        # loop is cancelled between accepting it and resuming. Workers sharing a handed over socket race for it.
+        sock = self.sock # Cleared by _close_main_sock
+        while True:
+            try:
+                conn, addr = sock.accept()
+                conn.setblocking(False)
+                return conn, addr
+            except (BlockingIOError, InterruptedError):
+                pass
+
+            readable = loop.create_future()
+            loop.add_reader(sock.fileno(), lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(sock.fileno())
+
+    async def _accept_async_conns(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self.reject_busy:
+                async with self._conn_available: # No new connections should be accepted as long as there are no free slots
+                    await self._conn_available.wait_for(lambda: self.admission.available > 0)
+
+            logging.info("Listening for new connections...")
+            conn, addr = await self._accept_async(loop)
+
+            idx = self.admission.admit(addr[0])
+            if idx is None:
+                self._reject_conn(conn, addr[0], addr[1])
+                continue
+
+            task = asyncio.create_task(self._start_conn_task(idx, conn, addr[0], addr[1]))
+            self._conn_tasks.add(task)
+            task.add_done_callback(self._conn_tasks.discard)
+
+    async def _serve_async(self, host, port, handle_signals=True):
+
+        loop = asyncio.get_running_loop()
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+                loop.add_signal_handler(sig, self._kill_server, sig, None)
+
+        self.conn = set()
+        self._conn_tasks = set()
+        self._conn_available = asyncio.Condition()
+
+        with self._take_listen_sock(host, port) as self.sock:
+
+            self.sock.setblocking(False)
+            logging.info(f"Server started at: {host}:{port}")
+
+            self._accept_task = asyncio.create_task(self._accept_async_conns())
+
+            try:
+                await self._accept_task
+
+            except (OSError, asyncio.CancelledError) as e: # Raised when main socket is closed to prevent future incoming connections
+                logging.info("Main socket closed")
+
+        # Terminate after task completion of the remaining connections
+        await asyncio.gather(*self._conn_tasks)
+
+    def _create_main_sock(self, host, port):
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers > 1: # All workers bind the same port, the kernel balances connections between them
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(self.backlog)
+
+        return sock
+
+    def _take_listen_sock(self, host, port):
+        # Listening socket created by start() before forking, bound here when served without start()
+        sock, self._listen_sock = self._listen_sock, None
+        return sock if sock is not None else self._create_main_sock(host, port)
+
+    def _listen_addresses(self, host, port):
+        '''
+            Returns (server, host, port) of the listening socket of every worker, in order
+        '''
+        return [(self, host, port)] * self.workers
+
+    def _open_listen_socks(self, host, port):
+        '''
+            Creates the listening sockets of the workers, taking over the ones of the running server of the same
+            name (see servers/handoff.py) if there is one. Returns the connection to acknowledge the handoff on.
+        '''
+        conn, taken = None, []
+        if self.handoff_dir:
+            conn, taken = request_sockets(handoff_path(self.handoff_dir, self.server_name))
+
+        self.listen_socks = []
+        adopted = 0
+
+        for server, host, port in self._listen_addresses(host, port):
+            sock = next((sock for sock in taken if sock.getsockname()[1] == port), None) # Ports are only shared by workers
+            if sock is not None:
+                taken.remove(sock)
+                adopted += 1
+            else:
+                sock = server._create_main_sock(host, port)
+
+            hold(sock)
+            self.listen_socks.append(sock)
+
+        for sock in taken: # More workers than this server has, the old process closes them
+            sock.close()
+
+        if conn is not None and not adopted:
+            conn.close()
+            conn = None
+
+        if conn is not None:
+            print(f"{self.server_name} took over {adopted} listening socket(s) through {handoff_path(self.handoff_dir, self.server_name)}")
+
+        return conn
+
+    def _close_listen_socks(self):
+
+        if self._handoff_listener is not None:
+            self._handoff_listener.close()
+            self._handoff_listener = None
+
+        for sock in self.listen_socks:
+            release(sock)
+        self.listen_socks = []
+
+    def _run_server(self, host, port, worker_idx=0):
+
+        self.worker_idx = worker_idx
+        if self.listen_socks:
+            self._listen_sock = self.listen_socks[worker_idx]
+        close_held(keep=(self._listen_sock,)) # Only the parent holds the sockets of the other workers and servers
+
+        if self.workers > 1: # One log file per worker
+            root, ext = os.path.splitext(self.logs_path)
+            self.logs_path = f"{root}-{worker_idx}{ext}"
 
         self.init_logger(log_console=self.log_console)
+        self._init_server_state()
+        self.init_resources()
+
+        try:
+            self._start_udp(host)
+
+            if self.engine == "asyncio":
+                asyncio.run(self._serve_async(host, port))
+            else:
+                self._serve_threaded(host, port)
+
+        finally:
+            self._stop_udp()
+            self.close_resources()
+            self._stop_metrics()
+            self._stop_logging()
+
+    def _init_server_state(self):
 
         self.kill = False
+        self.sock = None
+        self.conn = []
+        self.admission = AdmissionControl(self.max_conn, max_conn_per_ip=self.max_conn_per_ip)
+        self._accept_task = None
+        self._conn_tasks = set()
+        self._conn_threads = set()
+        self.udp_sock = None
+
+        self.log_sampler = LogSampler(self.log_sample, self.log_rate_limit)
+
+        self.metrics = Metrics()
+        self.metrics_path = os.path.splitext(self.logs_path)[0] + ".prom" # Prometheus text format, next to the log
+        self._metrics_stopped = threading.Event()
+        threading.Thread(target=self._dump_metrics_periodically, daemon=True).start()
+
+    def _dump_metrics(self):
+
+        try:
+            self.metrics.dump(self.metrics_path, labels=(("server", self.server_name), ("worker", str(self.worker_idx))))
+        except OSError as e:
+            logging.error(f"{e}. Error writing metrics to {self.metrics_path}.")
+
+    def _dump_metrics_periodically(self):
+
+        while not self._metrics_stopped.wait(self.metrics_interval or None):
+            self._dump_metrics()
+
+    def _stop_metrics(self):
+
+        self._metrics_stopped.set()
+        self._dump_metrics()
+
+    def _start_udp(self, host):
+
+        if self.udp_port <= 0:
+            return
+
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.UDP_RECV_BUFFER) # Capped by the kernel
+        if self.workers > 1: # The kernel balances datagrams between workers by source address
+            self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.udp_sock.bind((host, self.udp_port))
+
+        logging.info("UDP listener started at: %s:%s", host, self.udp_port)
+
+        self._udp_thread = threading.Thread(target=self.serve_datagrams, args=(self.udp_sock,), daemon=True)
+        self._udp_thread.start()
+
+    def _stop_udp(self):
+
+        if self.udp_sock is not None:
+            logging.info("Closing UDP socket")
+            sock, self.udp_sock = self.udp_sock, None
+
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # Wakes serve_datagrams up from receiving
+            except OSError:
+                pass
+
+            self._udp_thread.join()
+            sock.close()
+
+    def _serve_threaded(self, host, port):
+
+        signal.signal(signal.SIGINT, self._kill_server) # Ignored in child process
+        signal.signal(signal.SIGTERM, self._kill_server)
+        signal.signal(signal.SIGUSR1, self._kill_server)
+
         self.conn = [None] * self.max_conn
-        self._conn_count = 0
+        self._conn_threads = set()
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.sock:
+        with self._take_listen_sock(host, port) as self.sock:
 
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.sock.bind((host, port))
-            self.sock.listen(5)
             logging.info(f"Server started at: {host}:{port}")
 
             while True:
-                while self._conn_count >= self.max_conn: # No new connections should be accepted as long as there are no free slots
-                    time.sleep(1)
+                if not self.reject_busy: # No new connections should be accepted as long as there are no free slots
+                    self.admission.wait_for_slot()
 
                 try:
-                    if self.sock is None:
+                    sock = self.sock # Cleared by _close_main_sock
+                    if sock is None:
                         raise ConnectionAbortedError
 
                     logging.info("Listening for new connections...")
-                    conn, addr = self.sock.accept()
+                    if sock.gettimeout() == 0: # Handed over from the asyncio engine, the non-blocking flag is shared
+                        select.select([sock], [], [])
+
+                    conn, addr = sock.accept()
 
-                    threading.Thread(target=self._start_conn_thread, args=(self._next_available_idx(), conn, addr[0], addr[1],)).start()
+                    idx = self.admission.admit(addr[0])
+                    if idx is None:
+                        self._reject_conn(conn, addr[0], addr[1])
+                        continue
+
+                    conn_thread = threading.Thread(target=self._start_conn_thread, args=(idx, conn, addr[0], addr[1],))
+                    self._conn_threads.add(conn_thread)
+                    conn_thread.start()
+
+                except BlockingIOError: # Accepted by another process sharing the handed over socket
+                    continue
 
                 except (OSError, ConnectionAbortedError) as e: # Raised when main socket is closed to prevent future incoming connections
                     logging.info("Main socket closed")
                     break
 
-    def start(self, host, port):
+        # Terminate after task completion of the remaining connections
+        for conn_thread in list(self._conn_threads):
+            conn_thread.join()
 
+    def start(self, host, port):
+        '''
+            Starts the workers. With handoff_dir, a running server of the same name hands its listening sockets
+            over and drains its connections, so restarting refuses none (see servers/handoff.py).
+        '''
         if not self.is_running():
             self._is_stopping = False
-            self.server_proc = multiprocessing.Process(target=self._run_server, args=(host, port,))
-            self.server_proc.daemon = True
-            self.server_proc.start()
+            self.server_procs = []
+
+            handoff_conn = self._open_listen_socks(host, port)
+
+            for worker_idx in range(self.workers):
+                server_proc = multiprocessing.Process(target=self._run_server, args=(host, port, worker_idx,))
+                server_proc.daemon = True
+                server_proc.start()
+                self.server_procs.append(server_proc)
+
+            if handoff_conn is not None: # The old server stops accepting now
+                acknowledge(handoff_conn)
+
+            if self.handoff_dir:
+                self._handoff_listener = HandoffListener(handoff_path(self.handoff_dir, self.server_name), self.listen_socks, self.stop)
 
     def stop(self, kill=False):
 
         if self.is_running():
 
-            if kill:
-                os.kill(self.server_proc.pid, signal.SIGUSR1)
+            for server_proc in self.server_procs:
+                try:
+                    if kill:
+                        os.kill(server_proc.pid, signal.SIGUSR1)
 
-            else:
-                self.server_proc.terminate()
+                    else:
+                        server_proc.terminate()
+
+                except (ProcessLookupError, ValueError): # Worker already exited or closed
+                    pass
+
+            # Connections are refused once the workers closed their sockets, unless they were handed over
+            self._close_listen_socks()
 
             if not self._is_stopping:
                 threading.Thread(target=self._join_without_blocking).start()
@@ -146,11 +699,13 @@ class Server:
 
     def _join_without_blocking(self):
 
-        self.server_proc.join()
-        self.server_proc.close()
-        print(f"{self.server_name} process joined and closed.")
-        self.server_proc = None
-        self.is_stopping = False
+        for server_proc in self.server_procs:
+            server_proc.join()
+            server_proc.close()
+
+        print(f"{self.server_name} process(es) joined and closed.")
+        self.server_procs = []
+        self._is_stopping = False
 
     def _kill_server(self, sig, frame):
 
@@ -176,6 +731,9 @@ class Server:
                 logging.info("No active socket(s)")
 
                 logging.info("Main server will terminate now")
+                if self.engine == "thread": # The accept loop ends on the closed socket, after starting the thread of a connection accepted right before the signal
+                    self.kill = True
+                    return
                 sys.exit(0)
 
             logging.info("Active connection(s) found. Server will terminate after connection(s) timeout or task completion")
@@ -185,42 +743,93 @@ class Server:
 
         os.makedirs(os.path.dirname(self.logs_path), exist_ok=True) # Recursively create directory if it does not exist yet
 
-        logFormatter = logging.Formatter('%(asctime)s -> [%(name)s] %(levelname)s : %(message)s')
+        logFormatter = logging.Formatter(self.LOG_FORMAT)
         rootLogger = logging.getLogger()
         rootLogger.setLevel(self.logging_level)
 
         fileHandler = logging.FileHandler(self.logs_path)
         fileHandler.setFormatter(logFormatter)
-        rootLogger.addHandler(fileHandler)
+        handlers = [fileHandler]
 
         if log_console:
             consoleHandler = logging.StreamHandler(sys.stdout)
             consoleHandler.setFormatter(logFormatter)
-            rootLogger.addHandler(consoleHandler)
+            handlers.append(consoleHandler)
+
+        if self.log_queue: # Connection threads only enqueue records, formatting and disk writes happen in the listener
+            queueHandler, self._log_listener = start_queue_listener(handlers)
+            rootLogger.addHandler(queueHandler)
+        else:
+            for handler in handlers:
+                rootLogger.addHandler(handler)
+
+    def _stop_logging(self):
+
+        if self._log_listener is not None:
+            self._log_listener.stop() # Writes out the records still queued
+            self._log_listener = None
 
     def _is_conn_active(self):
-        # Checks if there is at least one element in self.conn is not None
-        return any([conn for conn in self.conn if conn is not None])
+        # Checks if there is at least one element in self.conn is not None, or an accepted connection whose task or
+        # thread has not added it yet
+        return any([conn for conn in self.conn if conn is not None]) or bool(self._conn_tasks or self._conn_threads)
 
-    def _next_available_idx(self):
-        # Finds the first element index in self.conn that is None, else return -1
-        try:
-            return self.conn.index(None)
-        except ValueError:
-            return -1
+    def init_resources(self):
+        '''
+            Called in the server process before it starts serving. Override to open long-lived resources (e.g. writers).
+        '''
+        pass
+
+    def close_resources(self):
+        '''
+            Called in the server process once it stops serving, including on kill
+        '''
+        pass
 
     def is_running(self):
-        if self.server_proc is not None:
+        for server_proc in self.server_procs:
             try:
-                return self.server_proc.is_alive()
+                if server_proc.is_alive():
+                    return True
             except ValueError: # Server process is already closed
-                return False
+                pass
 
         return False
 
+    def worker_dir(self, directory):
+        '''
+            Returns the directory the current worker should write to, so workers never share files
+        '''
+        return worker_data_dir(directory, self.worker_idx) if self.workers > 1 else directory
+
+    def serve_datagrams(self, sock):
+        '''
+            Called in a thread of the server process with the bound UDP socket if udp_port is set. Should return
+            once self.udp_sock is None, receiving then returns no data or raises OSError.
+        '''
+        raise NotImplementedError(f"{type(self).__name__} does not serve UDP")
+
     def receive_data(self, data):
         return data
 
+    def receive_binary(self, session, message_type, body):
+        '''
+            Handles a binary message other than KEYS (see servers/binary.py) and returns the encoded response,
+            raises BinaryError if it is malformed
+        '''
+        logging.debug("Binary message type %s not served", message_type)
+        return encode_status(400)
+
+    def respond_when_durable(self, commit, respond):
+        '''
+            Returns respond(ok) of a write whose commit (see util.data_util.Commit) is already durable, otherwise a
+            DeferredResponse of it to return from receive_data or receive_binary
+        '''
+        if commit.done:
+            return respond(commit.wait())
+
+        return DeferredResponse(commit, respond)
+
     def encode_data(self, data):
         '''
             Returns byte-string
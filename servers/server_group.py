@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextvars
+import logging
+import signal
+import sys
+from .handoff import close_held
+from .server import Server
+
+_server_name = contextvars.ContextVar("server_name", default=None)
+
+class _ServerNameFilter(logging.Filter):
+    '''
+        Tags records with the name of the server whose connection task logged them, or the group's name
+    '''
+
+    def __init__(self, default):
+        super().__init__()
+        self.default = default
+
+    def filter(self, record):
+        record.server_name = _server_name.get() or self.default
+        return True
+
+class ServerGroup(Server):
+    '''
+        Hosts several servers in one process, e.g.
+            ServerGroup([(data_server, HOST, DATA_SERVER_PORT), (time_server, HOST, TIME_SERVER_PORT)], "all_servers")
+        All listeners share one asyncio event loop (whatever engine the servers were created with), one log file
+        and one shutdown: SIGTERM stops every listener and exits once the connections of all servers have ended,
+        SIGUSR1 kills all of them at once. Started, stopped and polled like a single server.
+    '''
+
+    LOG_FORMAT = '%(asctime)s -> [%(server_name)s] %(levelname)s : %(message)s'
+
+    def __init__(self, servers, server_name, logs_dir="logs/", logging_level=logging.INFO, log_console=False, log_queue=False, handoff_dir=""):
+        for server, _, _ in servers:
+            if server.workers > 1:
+                raise ValueError(f"{server.server_name} has {server.workers} workers, grouped servers run as one")
+
+        super().__init__(None, server_name, logs_dir=logs_dir, logging_level=logging_level, log_console=log_console, engine="asyncio", log_queue=log_queue, handoff_dir=handoff_dir)
+
+        self.servers = servers
+
+    def start(self):
+        super().start(None, None)
+
+    def _listen_addresses(self, host, port):
+        return self.servers
+
+    def _run_server(self, host, port, worker_idx=0):
+
+        for (server, _, _), sock in zip(self.servers, self.listen_socks):
+            server._listen_sock = sock
+        close_held(keep=self.listen_socks)
+
+        self.init_logger(log_console=self.log_console)
+        name_filter = _ServerNameFilter(self.server_name)
+        for handler in logging.getLogger().handlers: # Logger filters would skip records of child loggers
+            handler.addFilter(name_filter)
+
+        self.kill = False
+        for server, _, _ in self.servers:
+            server._init_server_state()
+
+        started = []
+
+        try:
+            for server, host, _ in self.servers:
+                server.init_resources()
+                started.append(server)
+                server._start_udp(host)
+
+            asyncio.run(self._serve_all())
+
+        finally:
+            for server in started:
+                server._stop_udp()
+                server.close_resources()
+
+            for server, _, _ in self.servers:
+                server._stop_metrics()
+
+            self._stop_logging()
+
+    async def _serve_all(self):
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+            loop.add_signal_handler(sig, self._kill_server, sig, None)
+
+        await asyncio.gather(*[self._serve_one(server, host, port) for server, host, port in self.servers])
+
+    async def _serve_one(self, server, host, port):
+        # Runs in its own task, so the name only applies to this server's log records
+        _server_name.set(server.server_name)
+        await server._serve_async(host, port, handle_signals=False)
+
+    def _close_main_sock(self):
+
+        for server, _, _ in self.servers:
+            server._close_main_sock()
+
+    def _terminate_all(self):
+
+        for server, _, _ in self.servers:
+            if server._is_conn_active():
+                server._terminate_all()
+
+    def _is_conn_active(self):
+        return any([server._is_conn_active() for server, _, _ in self.servers])
+
+    def _kill_server(self, sig, frame):
+
+        super()._kill_server(sig, frame)
+
+        if self.kill: # Each server returns once its own connections have ended
+            for server, _, _ in self.servers:
+                server.kill = True
@@ -1,12 +1,88 @@
 #!/usr/bin/env python3
 
 import logging
+import socket
+import struct
+import time
 from datetime import datetime, timezone, timedelta
+from .binary import TIME, TIMES, TRANSMIT_TIME, BinaryError, encode_status
 from .server import Server
 
+'''
+    UDP time protocol, all integers big-endian:
+        request  - TIME_MAGIC, client transmit time (any uint64, echoed as is)
+        response - TIME_MAGIC, client transmit time, server receive time, server transmit time
+    Server times are in ns since the epoch (UTC). Requests of any other size or magic are dropped.
+'''
+
+TIME_MAGIC = b"BTP1"
+TIME_REQUEST = struct.Struct("!4sQ")
+TIME_RESPONSE = struct.Struct("!4sQQQ")
+_SERVER_TIMES = struct.Struct("!QQ")
+
+class AnchoredClock:
+    '''
+        Wall clock time in ns read from the monotonic clock, so readings between anchors never jump. Re-anchored
+        to the wall clock every anchor_interval seconds to follow its (e.g. NTP) corrections.
+    '''
+
+    def __init__(self, anchor_interval=60.0):
+        self.anchor_interval_ns = int(anchor_interval * 1e9)
+        self.anchor()
+
+    def anchor(self):
+        best = None
+        for _ in range(5): # Keep the wall clock reading taken in the shortest monotonic interval
+            before = time.monotonic_ns()
+            wall = time.time_ns()
+            after = time.monotonic_ns()
+            if best is None or after - before < best[0]:
+                best = (after - before, wall, (before + after) // 2)
+
+        _, self._wall, self._monotonic = best
+        self._next_anchor = self._monotonic + self.anchor_interval_ns
+
+    def time_ns(self):
+        monotonic = time.monotonic_ns()
+        if monotonic >= self._next_anchor:
+            self.anchor()
+            monotonic = time.monotonic_ns()
+
+        return self._wall + monotonic - self._monotonic
+
+def query_time(host, port, timeout=1.0):
+    '''
+        Sends one UDP time request, returns (clock offset, round-trip delay) in seconds as in NTP: the server clock
+        is ahead of the local one by offset
+    '''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+
+        sent = time.time_ns()
+        sock.sendto(TIME_REQUEST.pack(TIME_MAGIC, sent), (host, port))
+        response = sock.recv(TIME_RESPONSE.size + 1)
+        received = time.time_ns()
+
+    if len(response) != TIME_RESPONSE.size:
+        raise ValueError(f"Invalid time response of {len(response)} bytes")
+
+    magic, echoed, server_received, server_sent = TIME_RESPONSE.unpack(response)
+    if magic != TIME_MAGIC or echoed != sent:
+        raise ValueError("Time response does not match the request")
+
+    offset = ((server_received - sent) + (server_sent - received)) / 2e9
+    delay = ((received - sent) - (server_sent - server_received)) / 1e9
+
+    return offset, delay
+
 class TimeServer(Server):
+    '''
+        Answers "timezone:<local|utc>,offset_seconds:<N>" with "200 <epoch seconds>" over TCP and, with udp_port,
+        the binary UDP time protocol above for clients that measure offset and delay. Connections that negotiated
+        the binary encoding send TIME messages, answered with the same times as over UDP, see servers/binary.py.
+    '''
 
-    def __init__(self, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8"):
+    def __init__(self, timeout, server_name, max_conn=10, logs_dir="logs/", logging_level=logging.INFO, log_console=False, encoding="utf-8", engine="thread", framing="raw", max_frame_size=65536, workers=1, backlog=128, reject_busy=False, max_conn_per_ip=0, metrics_interval=10.0, log_queue=False, log_sample=1, log_rate_limit=0, udp_port=0, handoff_dir=""):
         super().__init__(
             timeout, 
             server_name, 
@@ -14,10 +90,70 @@ class TimeServer(Server):
             logs_dir=logs_dir, 
             logging_level=logging_level, 
             log_console=log_console, 
-            encoding=encoding)
+            encoding=encoding,
+            engine=engine,
+            framing=framing,
+            max_frame_size=max_frame_size,
+            workers=workers,
+            backlog=backlog,
+            reject_busy=reject_busy,
+            max_conn_per_ip=max_conn_per_ip,
+            metrics_interval=metrics_interval,
+            log_queue=log_queue,
+            log_sample=log_sample,
+            log_rate_limit=log_rate_limit,
+            udp_port=udp_port,
+            handoff_dir=handoff_dir)
 
         self.timezones = set(["local", "utc"])
 
+    def init_resources(self):
+        self.clock = AnchoredClock()
+
+    def receive_binary(self, session, message_type, body):
+        if message_type != TIME:
+            return super().receive_binary(session, message_type, body)
+
+        received = self.clock.time_ns()
+        if len(body) != TRANSMIT_TIME.size:
+            raise BinaryError(f"Time request of {len(body)} bytes")
+
+        sent, = TRANSMIT_TIME.unpack(body)
+        return encode_status(200, TIMES.pack(sent, received, self.clock.time_ns()))
+
+    def serve_datagrams(self, sock):
+        clock = AnchoredClock()
+        request = bytearray(TIME_REQUEST.size + 1) # One spare byte to tell oversized requests apart
+        response = bytearray(TIME_RESPONSE.size)
+        magic_size = len(TIME_MAGIC)
+
+        # Bound once, this loop runs for every datagram
+        recvfrom_into = sock.recvfrom_into
+        sendto = sock.sendto
+        pack_into = _SERVER_TIMES.pack_into
+        inc = self.metrics.inc
+
+        while True:
+            try:
+                size, addr = recvfrom_into(request)
+                received = clock.time_ns()
+
+                if size != TIME_REQUEST.size or request[:magic_size] != TIME_MAGIC:
+                    if self.udp_sock is None: # Shut down
+                        return
+                    inc("datagrams_invalid")
+                    continue
+
+                response[:TIME_REQUEST.size] = request[:TIME_REQUEST.size] # Magic and client transmit time
+                pack_into(response, TIME_REQUEST.size, received, clock.time_ns())
+                sendto(response, addr)
+                inc("datagrams")
+
+            except OSError as e:
+                if self.udp_sock is None:
+                    return
+                logging.error("%s. Error answering time datagram.", e)
+
     def receive_data(self, data):
         values = self.parse_data(data)
         if values is None:
@@ -7,22 +7,32 @@ import time
 import threading
 from argparse import ArgumentParser
 from config import *
-from servers import DataServer, LogServer, TimeServer
+from util.data_util import BufferedFileWriter
+from util.storage import STORAGES
+from servers import Server, ServerGroup, DataServer, LogServer, TimeServer, QueryServer
 
 data_server = None
 log_server = None
 time_server = None
+query_server = None
+all_servers = None
 terminate = False
 
 def signal_handler(sig, frame):
     global data_server
     global log_server
     global time_server
+    global query_server
+    global all_servers
     global terminate
 
-    data_server.stop(kill=terminate)
-    log_server.stop(kill=terminate)
-    time_server.stop(kill=terminate)
+    if all_servers is not None:
+        all_servers.stop(kill=terminate)
+    else:
+        data_server.stop(kill=terminate)
+        log_server.stop(kill=terminate)
+        time_server.stop(kill=terminate)
+        query_server.stop(kill=terminate)
 
     if not terminate:
         print("Terminating after task completion")
@@ -35,6 +45,16 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--log-console", action="store_true")
     parser.add_argument("--max-conn", default=10, type=int)
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="raw", choices=Server.FRAMINGS)
+    parser.add_argument("--max-frame-size", default=65536, type=int)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--backlog", default=128, type=int)
+    parser.add_argument("--reject-busy", action="store_true")
+    parser.add_argument("--max-conn-per-ip", default=0, type=int)
+    parser.add_argument("--durability", choices=BufferedFileWriter.DURABILITIES)
+    parser.add_argument("--storage", default=DATA_SERVER_STORAGE, choices=STORAGES)
+    parser.add_argument("--single-process", action="store_true", help="Host all servers in one process on one event loop")
     args = parser.parse_args()
 
     if args.debug:
@@ -52,7 +72,35 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console, 
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=DATA_SERVER_UDP_PORT,
+        udp_queue_size=DATA_SERVER_UDP_QUEUE_SIZE,
+        flush_size=DATA_SERVER_FLUSH_SIZE,
+        flush_interval=DATA_SERVER_FLUSH_INTERVAL,
+        durability=args.durability or DATA_SERVER_DURABILITY,
+        storage=args.storage,
+        partition=DATA_SERVER_PARTITION,
+        partition_size=DATA_SERVER_PARTITION_SIZE,
+        retention=DATA_SERVER_RETENTION,
+        shard_key=DATA_SERVER_SHARD_KEY,
+        shards=DATA_SERVER_SHARDS,
+        rollups=DATA_SERVER_ROLLUPS,
+        rollup_key=DATA_SERVER_ROLLUP_KEY,
+        latest_history=DATA_SERVER_LATEST_HISTORY,
+        latest_key=DATA_SERVER_LATEST_KEY,
+        latest_size=DATA_SERVER_LATEST_SIZE,
+        handoff_dir=HANDOFF_DIR)
 
     log_server = LogServer(
         LOG_DATA_DIR, 
@@ -62,7 +110,30 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console, 
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=LOG_SERVER_UDP_PORT,
+        udp_queue_size=LOG_SERVER_UDP_QUEUE_SIZE,
+        flush_size=LOG_SERVER_FLUSH_SIZE,
+        flush_interval=LOG_SERVER_FLUSH_INTERVAL,
+        durability=args.durability or LOG_SERVER_DURABILITY,
+        partition=LOG_SERVER_PARTITION,
+        partition_size=LOG_SERVER_PARTITION_SIZE,
+        retention=LOG_SERVER_RETENTION,
+        retention_size=LOG_SERVER_RETENTION_SIZE,
+        compress=LOG_SERVER_COMPRESS,
+        token_index=LOG_SERVER_TOKEN_INDEX,
+        handoff_dir=HANDOFF_DIR)
 
     time_server = TimeServer(
         TIME_SERVER_SOCKET_TIMEOUT, 
@@ -71,15 +142,72 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console, 
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=TIME_SERVER_UDP_PORT,
+        handoff_dir=HANDOFF_DIR)
+
+    query_server = QueryServer(
+        DATA_DIR,
+        QUERY_SERVER_SOCKET_TIMEOUT,
+        "query_server",
+        max_conn=args.max_conn,
+        logs_dir=LOGS_DIR,
+        logging_level=logging_level,
+        log_console=args.log_console,
+        encoding=ENCODING,
+        engine=args.engine,
+        framing="newline" if args.framing == "raw" else args.framing, # Streamed responses need framing
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        chunk_rows=QUERY_SERVER_CHUNK_ROWS,
+        handoff_dir=HANDOFF_DIR)
+
+    if args.single_process:
+        all_servers = ServerGroup(
+            [
+                (data_server, HOST, DATA_SERVER_PORT),
+                (log_server, HOST, LOG_SERVER_PORT),
+                (time_server, HOST, TIME_SERVER_PORT),
+                (query_server, HOST, QUERY_SERVER_PORT),
+            ],
+            "all_servers",
+            logs_dir=LOGS_DIR,
+            logging_level=logging_level,
+            log_console=args.log_console,
+            log_queue=LOG_QUEUE,
+            handoff_dir=HANDOFF_DIR)
+
+        all_servers.start()
+        servers = [all_servers]
 
-    data_server.start(HOST, DATA_SERVER_PORT)
-    log_server.start(HOST, LOG_SERVER_PORT)
-    time_server.start(HOST, TIME_SERVER_PORT)
+    else:
+        data_server.start(HOST, DATA_SERVER_PORT)
+        log_server.start(HOST, LOG_SERVER_PORT)
+        time_server.start(HOST, TIME_SERVER_PORT)
+        query_server.start(HOST, QUERY_SERVER_PORT)
+        servers = [data_server, log_server, time_server, query_server]
 
     print("All servers started")
 
     signal.signal(signal.SIGINT, signal_handler)
 
-    while any([data_server.is_running(), log_server.is_running(), time_server.is_running()]):
+    while any([server.is_running() for server in servers]):
         time.sleep(0.5)
@@ -6,7 +6,9 @@ import logging
 import time
 from argparse import ArgumentParser
 from config import *
-from servers import DataServer
+from util.data_util import BufferedFileWriter
+from util.storage import STORAGES
+from servers import Server, DataServer
 
 data_server = None
 terminate = False
@@ -28,6 +30,15 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--log-console", action="store_true")
     parser.add_argument("--max-conn", default=10, type=int)
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="raw", choices=Server.FRAMINGS)
+    parser.add_argument("--max-frame-size", default=65536, type=int)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--backlog", default=128, type=int)
+    parser.add_argument("--reject-busy", action="store_true")
+    parser.add_argument("--max-conn-per-ip", default=0, type=int)
+    parser.add_argument("--durability", choices=BufferedFileWriter.DURABILITIES)
+    parser.add_argument("--storage", default=DATA_SERVER_STORAGE, choices=STORAGES)
     args = parser.parse_args()
 
     if args.debug:
@@ -45,7 +56,35 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console, 
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=DATA_SERVER_UDP_PORT,
+        udp_queue_size=DATA_SERVER_UDP_QUEUE_SIZE,
+        flush_size=DATA_SERVER_FLUSH_SIZE,
+        flush_interval=DATA_SERVER_FLUSH_INTERVAL,
+        durability=args.durability or DATA_SERVER_DURABILITY,
+        storage=args.storage,
+        partition=DATA_SERVER_PARTITION,
+        partition_size=DATA_SERVER_PARTITION_SIZE,
+        retention=DATA_SERVER_RETENTION,
+        shard_key=DATA_SERVER_SHARD_KEY,
+        shards=DATA_SERVER_SHARDS,
+        rollups=DATA_SERVER_ROLLUPS,
+        rollup_key=DATA_SERVER_ROLLUP_KEY,
+        latest_history=DATA_SERVER_LATEST_HISTORY,
+        latest_key=DATA_SERVER_LATEST_KEY,
+        latest_size=DATA_SERVER_LATEST_SIZE,
+        handoff_dir=HANDOFF_DIR)
 
     data_server.start(HOST, DATA_SERVER_PORT)
 
@@ -6,7 +6,8 @@ import logging
 import time
 from argparse import ArgumentParser
 from config import *
-from servers import LogServer
+from util.data_util import BufferedFileWriter
+from servers import Server, LogServer
 
 log_server = None
 terminate = False
@@ -28,6 +29,14 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--log-console", action="store_true")
     parser.add_argument("--max-conn", default=10, type=int)
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="raw", choices=Server.FRAMINGS)
+    parser.add_argument("--max-frame-size", default=65536, type=int)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--backlog", default=128, type=int)
+    parser.add_argument("--reject-busy", action="store_true")
+    parser.add_argument("--max-conn-per-ip", default=0, type=int)
+    parser.add_argument("--durability", choices=BufferedFileWriter.DURABILITIES)
     args = parser.parse_args()
 
     if args.debug:
@@ -45,7 +54,30 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console,
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=LOG_SERVER_UDP_PORT,
+        udp_queue_size=LOG_SERVER_UDP_QUEUE_SIZE,
+        flush_size=LOG_SERVER_FLUSH_SIZE,
+        flush_interval=LOG_SERVER_FLUSH_INTERVAL,
+        durability=args.durability or LOG_SERVER_DURABILITY,
+        partition=LOG_SERVER_PARTITION,
+        partition_size=LOG_SERVER_PARTITION_SIZE,
+        retention=LOG_SERVER_RETENTION,
+        retention_size=LOG_SERVER_RETENTION_SIZE,
+        compress=LOG_SERVER_COMPRESS,
+        token_index=LOG_SERVER_TOKEN_INDEX,
+        handoff_dir=HANDOFF_DIR)
 
     log_server.start(HOST, LOG_SERVER_PORT)
 
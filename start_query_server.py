@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import signal
+import os
+import logging
+import time
+from argparse import ArgumentParser
+from config import *
+from servers import Server, QueryServer
+
+query_server = None
+terminate = False
+
+def signal_handler(sig, frame):
+    global query_server
+    global terminate
+
+    query_server.stop(kill=terminate)
+
+    if not terminate:
+        print("Terminating after task completion")
+        terminate = True
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--log-console", action="store_true")
+    parser.add_argument("--max-conn", default=10, type=int)
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="newline", choices=("newline", "length")) # Streamed responses need framing
+    parser.add_argument("--max-frame-size", default=65536, type=int)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--backlog", default=128, type=int)
+    parser.add_argument("--reject-busy", action="store_true")
+    parser.add_argument("--max-conn-per-ip", default=0, type=int)
+    args = parser.parse_args()
+
+    if args.debug:
+        print("Starting query server in DEBUG mode")
+        logging_level = logging.DEBUG
+    else:
+        print("Starting query server in NORMAL mode")
+        logging_level = logging.INFO
+
+    query_server = QueryServer(
+        DATA_DIR,
+        QUERY_SERVER_SOCKET_TIMEOUT,
+        "query_server",
+        max_conn=args.max_conn,
+        logs_dir=LOGS_DIR,
+        logging_level=logging_level,
+        log_console=args.log_console,
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        chunk_rows=QUERY_SERVER_CHUNK_ROWS,
+        handoff_dir=HANDOFF_DIR)
+
+    query_server.start(HOST, QUERY_SERVER_PORT)
+
+    signal.signal(signal.SIGINT, signal_handler)
+
+    while query_server.is_running():
+        time.sleep(0.5)
@@ -6,7 +6,7 @@ import logging
 import time
 from argparse import ArgumentParser
 from config import *
-from servers import TimeServer
+from servers import Server, TimeServer
 
 time_server = None
 terminate = False
@@ -28,6 +28,13 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--log-console", action="store_true")
     parser.add_argument("--max-conn", default=10, type=int)
+    parser.add_argument("--engine", default="thread", choices=Server.ENGINES)
+    parser.add_argument("--framing", default="raw", choices=Server.FRAMINGS)
+    parser.add_argument("--max-frame-size", default=65536, type=int)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--backlog", default=128, type=int)
+    parser.add_argument("--reject-busy", action="store_true")
+    parser.add_argument("--max-conn-per-ip", default=0, type=int)
     args = parser.parse_args()
 
     if args.debug:
@@ -44,7 +51,20 @@ if __name__ == "__main__":
         logs_dir=LOGS_DIR, 
         logging_level=logging_level, 
         log_console=args.log_console,
-        encoding=ENCODING)
+        encoding=ENCODING,
+        engine=args.engine,
+        framing=args.framing,
+        max_frame_size=args.max_frame_size,
+        workers=args.workers,
+        backlog=args.backlog,
+        reject_busy=args.reject_busy,
+        max_conn_per_ip=args.max_conn_per_ip,
+        metrics_interval=METRICS_INTERVAL,
+        log_queue=LOG_QUEUE,
+        log_sample=LOG_SAMPLE,
+        log_rate_limit=LOG_RATE_LIMIT,
+        udp_port=TIME_SERVER_UDP_PORT,
+        handoff_dir=HANDOFF_DIR)
 
     time_server.start(HOST, TIME_SERVER_PORT)
 
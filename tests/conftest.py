@@ -0,0 +1,69 @@
+import socket
+import time
+import pytest
+
+@pytest.fixture
+def start_server(tmp_path):
+    '''
+        Starts a server of server_class on an ephemeral port of localhost, returns (server, port). Servers are
+        stopped after the test.
+    '''
+    started = []
+
+    def start(server_class, *args, **kwargs):
+        server = server_class(*args, logs_dir=str(tmp_path / "logs") + "/", metrics_interval=0, **kwargs)
+        server.start("127.0.0.1", 0)
+        started.append(server)
+        return server, server.listen_socks[0].getsockname()[1]
+
+    yield start
+
+    for server in started:
+        server.stop()
+        deadline = time.monotonic() + 10
+        while server.is_running() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+def connect(port, timeout=5.0):
+    return socket.create_connection(("127.0.0.1", port), timeout=timeout)
+
+def receive_lines(conn, count):
+    '''
+        Returns the next count newline framed responses of conn
+    '''
+    data = b""
+    while data.count(b"\n") < count:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return data.decode("utf-8").split("\n")[:count]
+
+def free_udp_port():
+    # The UDP socket is bound by the server process, so the port is picked here and released first
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def udp_port_bound(port):
+    # True once the server process bound port, datagrams sent earlier are lost
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+        except OSError:
+            return True
+
+    return False
+
+def wait_for(condition, timeout=10.0):
+    '''
+        Returns True once condition() is, False if it is still not after timeout seconds
+    '''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+
+    return True
@@ -0,0 +1,56 @@
+import threading
+import time
+import pytest
+from conftest import connect, receive_lines
+from servers.admission import AdmissionControl
+from servers.server import Server
+
+def test_slots_and_per_ip_limit():
+    admission = AdmissionControl(3, max_conn_per_ip=2)
+    slots = [admission.admit("a"), admission.admit("a")]
+
+    assert sorted(slots) == [0, 1]
+    assert admission.admit("a") is None # Host at its limit
+    assert admission.admit("b") == 2
+    assert admission.admit("c") is None # Server at its limit
+    assert admission.active == 3 and admission.available == 0
+
+    admission.release(slots[0], "a")
+    assert admission.admit("c") == slots[0]
+    assert admission.admit("a") is None
+
+def test_waiting_for_a_slot():
+    admission = AdmissionControl(1)
+    slot = admission.admit("a")
+    assert not admission.wait_for_slot(timeout=0.01)
+
+    threading.Timer(0.05, admission.release, args=(slot, "a")).start()
+    assert admission.wait_for_slot(timeout=5)
+    assert admission.admit("a") == slot
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+@pytest.mark.parametrize("limits", [{"max_conn": 1, "reject_busy": True}, {"max_conn": 2, "max_conn_per_ip": 1}])
+def test_busy_connections_are_answered_503(start_server, engine, limits):
+    _, port = start_server(Server, 5, "echo_server", engine=engine, framing="newline", **limits)
+
+    with connect(port) as conn:
+        conn.sendall(b"first\n")
+        assert receive_lines(conn, 1) == ["first"]
+
+        with connect(port) as rejected:
+            assert receive_lines(rejected, 1) == [Server.BUSY_RESPONSE]
+            assert rejected.recv(1024) == b""
+
+        conn.sendall(b"still served\n")
+        assert receive_lines(conn, 1) == ["still served"]
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline: # Until the server notices the close and releases the slot
+        with connect(port) as conn:
+            conn.sendall(b"again\n")
+            response = receive_lines(conn, 1)
+        if response != [Server.BUSY_RESPONSE]:
+            break
+        time.sleep(0.01)
+
+    assert response == ["again"]
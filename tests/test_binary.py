@@ -0,0 +1,43 @@
+import pytest
+from servers.binary import BinaryError, BinarySession, HELLO, encode_keys, encode_records
+
+def session(key_ids):
+    binary = BinarySession()
+    assert binary.negotiate(HELLO, "length")
+    binary.define_keys(encode_keys(key_ids)[1:])
+    return binary
+
+def test_records_round_trip():
+    key_ids = {"id": 1, "temp": 2, "note": 3}
+    binary = session(key_ids)
+    records = [{"id": 7, "temp": 21.5}, {"id": 8, "temp": 22.0}, {"id": 9, "note": "é ok"}]
+
+    assert binary.decode_records(encode_records(records, key_ids)[1:]) == records
+
+def test_invalid_records_are_none():
+    key_ids = {"id": 1, "note": 2}
+    binary = session(key_ids)
+    records = [{"id": 1, "note": "a,b"}, {"id": 2, "note": "a\nb"}, {"id": 3, "note": "fine"}]
+
+    assert binary.decode_records(encode_records(records, key_ids)[1:]) == [None, None, records[2]]
+    assert binary.decode_records(encode_records([{"undefined": 1}], {"undefined": 9})[1:]) == [None]
+
+def test_truncated_records():
+    key_ids = {"id": 1}
+    binary = session(key_ids)
+    message = encode_records([{"id": 1}], key_ids)[1:]
+
+    with pytest.raises(BinaryError):
+        binary.decode_records(message[:-1])
+    with pytest.raises(BinaryError):
+        binary.decode_records(message + b"\x00")
+
+@pytest.mark.parametrize("key", ["", "a,b", "a:b", "a;b", "te\nmp", "te\rmp"])
+def test_invalid_keys(key):
+    with pytest.raises(BinaryError):
+        session({key: 1})
+
+def test_text_framing_is_not_binary():
+    binary = BinarySession()
+    assert not binary.negotiate(HELLO, "newline")
+    assert not binary.negotiate(HELLO, "length") # Only the first message negotiates
@@ -0,0 +1,95 @@
+import math
+import os
+import pytest
+from os import path
+from util.columnar import INT_NULL, ColumnarStorage, columns_dir, load_column, load_columns, read_manifest
+
+np = pytest.importorskip("numpy")
+
+def store(data_dir, records, **kwargs):
+    storage = ColumnarStorage(data_dir, **kwargs)
+    try:
+        assert storage.store(records)
+    finally:
+        storage.close()
+
+def test_round_trip(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [{"id": "1", "temp": "20"}, {"id": "2", "temp": "21.5", "note": "ok"}])
+    store(data_dir, [{"id": "3", "note": "é, fine"}])
+
+    manifest = read_manifest(data_dir)
+    assert manifest["rows"] == 3
+    assert manifest["schema_version"] == 1 # Columns of one flush are added at once
+
+    columns = load_columns(data_dir)
+    assert columns["id"].tolist() == [1, 2, 3]
+    assert columns["temp"][:2].tolist() == [20.0, 21.5] and math.isnan(columns["temp"][2])
+    assert columns["note"].tolist() == ["", "ok", "é, fine"]
+
+def test_promotion_keeps_earlier_segments(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [{"value": "1"}, {"value": ""}])
+    store(data_dir, [{"value": "2.5"}])
+    store(data_dir, [{"value": "x"}])
+
+    segments = read_manifest(data_dir)["columns"]["value"]["segments"]
+    assert [segment["dtype"] for segment in segments] == ["i8", "f8", "str"]
+    assert load_column(data_dir, "value").tolist() == ["1", "", "2.5", "x"]
+
+def test_single_segment_is_memory_mapped(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [{"value": str(i)} for i in range(100)] + [{"other": "1"}])
+
+    column = load_column(data_dir, "value")
+    assert isinstance(column, np.memmap)
+    assert column[-1] == INT_NULL
+
+def test_crash_truncation(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [{"id": "1", "name": "a"}, {"id": "2", "name": "b"}])
+
+    # Appended after the last manifest update, as if the process died in the middle of a flush
+    manifest = read_manifest(data_dir)
+    for column in manifest["columns"].values():
+        segment_path = path.join(columns_dir(data_dir), column["segments"][-1]["file"])
+        for file_path in (segment_path, segment_path + ".off", segment_path + ".str"):
+            if path.exists(file_path):
+                with open(file_path, "ab") as f:
+                    f.write(b"\x01" * 11)
+
+    assert load_column(data_dir, "id").tolist() == [1, 2] # Readers only map the rows of the manifest
+
+    store(data_dir, [{"id": "3", "name": "c"}])
+
+    assert load_column(data_dir, "id").tolist() == [1, 2, 3]
+    assert load_column(data_dir, "name").tolist() == ["a", "b", "c"]
+    assert os.path.getsize(path.join(columns_dir(data_dir), manifest["columns"]["id"]["segments"][-1]["file"])) == 3 * 8
+
+def test_integers_outside_int64_are_promoted(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [{"big": "99999999999999999999", "null": str(INT_NULL), "max": str(2 ** 63 - 1)}])
+
+    manifest = read_manifest(data_dir)
+    assert [manifest["columns"][key]["segments"][0]["dtype"] for key in ("big", "null", "max")] == ["f8", "f8", "i8"]
+    assert load_column(data_dir, "big").tolist() == [1e20]
+    assert load_column(data_dir, "null").tolist() == [float(INT_NULL)] # Not null
+    assert load_column(data_dir, "max").tolist() == [2 ** 63 - 1]
+
+def test_failed_flush_does_not_stop_the_writer(tmp_path, monkeypatch):
+    data_dir = str(tmp_path) + "/"
+    storage = ColumnarStorage(data_dir, flush_interval=0.01, durability="flush")
+
+    def overflow(*args):
+        raise OverflowError("int too big to convert")
+
+    try:
+        assert storage.store([{"id": "1"}])
+        monkeypatch.setattr(storage, "_append_column", overflow)
+        assert not storage.store([{"id": "2"}])
+        monkeypatch.undo()
+        assert storage.store([{"id": "3"}])
+    finally:
+        storage.close()
+
+    assert load_column(data_dir, "id").tolist() == [1, 3]
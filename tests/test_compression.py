@@ -0,0 +1,83 @@
+import os
+import time
+from os import path
+from util import data_util
+from util.data_util import (
+    COMPRESSED_EXT, TS_INDEX_RECORD, compress_file, create_file_writer, read_compressed_lines, read_indexed_lines,
+    read_partitions, ts_index_path
+)
+from util.token_index import read_rows, search_lines
+
+def compress_closed_partitions(directory, timeout=10.0, **kwargs):
+    # Returns the partitions once a writer opened again compressed those close() left queued
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily", compress=True, **kwargs)
+    deadline = time.monotonic() + timeout
+
+    try:
+        while time.monotonic() < deadline:
+            partitions = read_partitions(directory, "log")["partitions"]
+            if all([partition["file"].endswith(COMPRESSED_EXT) for partition in partitions[:-1]]):
+                break
+            time.sleep(0.01)
+    finally:
+        writer.close()
+
+    return partitions
+
+def test_compressed_round_trip(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    writer = create_file_writer(str(tmp_path) + "/", "log", "txt", ts_index=True)
+    for batch in range(50):
+        writer.write([f"batch {batch} line {i}" for i in range(100)])
+    writer.close()
+
+    with open(ts_index_path(file_path), "ab") as f: # Index ahead of the data
+        f.write(TS_INDEX_RECORD.pack(time.time(), path.getsize(file_path)))
+
+    compress_file(file_path, file_path + COMPRESSED_EXT, block_size=4096)
+
+    lines = [line for lines in read_indexed_lines(file_path) for line in lines]
+    compressed = [line for lines in read_compressed_lines(file_path + COMPRESSED_EXT) for line in lines]
+    assert compressed == lines
+    assert len(compressed) == 5000
+
+    middle = lines[2500][0]
+    assert [line for lines in read_compressed_lines(file_path + COMPRESSED_EXT, start=middle, end=middle) for line in lines] == [line for line in lines if line[0] == middle]
+    assert [line for _, _, line in read_rows(file_path + COMPRESSED_EXT, [0, 1234, 4999, 5000])] == ["batch 0 line 0", "batch 12 line 34", "batch 49 line 99"]
+
+def test_compressed_partitions_are_searched(tmp_path):
+    directory = str(tmp_path) + "/"
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily", partition_size=2000, compress=True, token_index=True)
+    for batch in range(20):
+        writer.write([f"batch {batch} line {i} " + ("needle" if i == 7 else "hay") for i in range(20)])
+    writer.close()
+
+    partitions = compress_closed_partitions(directory, partition_size=2000, token_index=True)
+    assert len(partitions) > 1 and all([partition["file"].endswith(COMPRESSED_EXT) for partition in partitions[:-1]])
+    assert not any([name.endswith(".tmp") for name in os.listdir(path.join(directory, "partitions"))])
+
+    assert [line for _, line in search_lines(directory, "log", "txt", "needle")] == [f"batch {batch} line 7 needle" for batch in range(20)]
+
+def test_queued_partitions_are_compressed_on_the_next_start(tmp_path, monkeypatch):
+    directory = str(tmp_path) + "/"
+
+    def slow_compress(file_path, out_path, **kwargs):
+        time.sleep(0.2)
+        return compress_file(file_path, out_path, **kwargs)
+
+    monkeypatch.setattr(data_util, "compress_file", slow_compress)
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily", partition_size=100, compress=True)
+    for batch in range(20):
+        writer.write([f"batch {batch} line {i}" for i in range(5)])
+
+    start = time.monotonic()
+    writer.close()
+    assert time.monotonic() - start < 1.0 # Not 19 partitions of 0.2s
+
+    partitions = read_partitions(directory, "log")["partitions"]
+    assert not all([partition["file"].endswith(COMPRESSED_EXT) for partition in partitions[:-1]])
+
+    monkeypatch.undo()
+    partitions = compress_closed_partitions(directory, partition_size=100)
+    assert all([partition["file"].endswith(COMPRESSED_EXT) for partition in partitions[:-1]])
+    assert [line for _, line in search_lines(directory, "log", "txt", "batch")] == [f"batch {batch} line {i}" for batch in range(20) for i in range(5)]
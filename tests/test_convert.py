@@ -0,0 +1,80 @@
+import math
+import os
+import pytest
+from util.columnar import INT_NULL, load_columns, load_timestamps, read_manifest
+from util.data_util import TS_INDEX_RECORD, ts_index_path, worker_data_dir
+from util.storage import CsvStorage, read_csv_records
+
+np = pytest.importorskip("numpy")
+from util.convert import convert_csv
+
+def store(data_dir, batches):
+    os.makedirs(data_dir, exist_ok=True)
+    storage = CsvStorage(data_dir)
+    try:
+        for records in batches:
+            assert storage.store(records)
+    finally:
+        storage.close()
+
+def as_text(value):
+    # Values of the columns as the text they were stored as, "" for nulls
+    if isinstance(value, (bytes, str)):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+    if isinstance(value, float):
+        return "" if math.isnan(value) else repr(value)
+    return "" if value == INT_NULL else str(value)
+
+def converted_records(out_dir):
+    columns = load_columns(out_dir)
+    rows = read_manifest(out_dir)["rows"]
+    return [{key: as_text(column[row]) for key, column in columns.items() if as_text(column[row]) != ""} for row in range(rows)]
+
+@pytest.mark.parametrize("chunk_size", [32, 1 << 20])
+def test_round_trip(tmp_path, chunk_size):
+    data_dir = str(tmp_path / "csv") + "/"
+    out_dir = str(tmp_path / "columns") + "/"
+    store(data_dir, [
+        [{"id": str(i), "temp": str(20 + i)} for i in range(50)],
+        [{"id": "50", "temp": "20.5", "note": "ok"}, {"id": "51"}], # temp promoted to f8, schema grows
+        [{"id": str(i), "temp": "21", "note": "é" * (i % 3)} for i in range(52, 100)],
+        [{"id": "100", "temp": "warm"}], # temp promoted to str
+    ])
+
+    rows, size = convert_csv(data_dir, out_dir, chunk_size=chunk_size)
+    assert rows == 101 and size > 0
+
+    records = list(read_csv_records(data_dir))
+    converted = converted_records(out_dir)
+    assert len(converted) == len(records)
+
+    for record, original in zip(converted, records):
+        assert record.keys() == original.keys()
+        for key, value in original.items(): # Numbers promoted to strings keep their value, not their text
+            assert record[key] == value or float(record[key]) == float(value)
+
+    with open(ts_index_path(data_dir + "data.csv"), "rb") as f:
+        times = [received for received, _ in TS_INDEX_RECORD.iter_unpack(f.read())]
+    assert load_timestamps(out_dir).tolist() == times
+
+def test_integers_outside_int64(tmp_path):
+    data_dir = str(tmp_path / "csv") + "/"
+    out_dir = str(tmp_path / "columns") + "/"
+    store(data_dir, [[{"big": "1", "null": "1"}, {"big": "99999999999999999999", "null": str(INT_NULL)}]])
+
+    convert_csv(data_dir, out_dir)
+    columns = load_columns(out_dir)
+    assert columns["big"].tolist() == [1.0, 1e20]
+    assert columns["null"].tolist() == [1.0, float(INT_NULL)]
+    assert [column["segments"][0]["dtype"] for column in read_manifest(out_dir)["columns"].values()] == ["f8", "f8"] # INT_NULL would read as null in i8
+
+def test_workers_are_converted_in_place(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(worker_data_dir(data_dir, 0), [[{"id": "1"}]])
+    store(worker_data_dir(data_dir, 1), [[{"id": "2", "temp": "3.5"}]])
+
+    assert convert_csv(data_dir, data_dir)[0] == 2
+    assert load_columns(worker_data_dir(data_dir, 1))["temp"].tolist() == [3.5]
+
+    with pytest.raises(ValueError): # Already converted
+        convert_csv(data_dir, data_dir)
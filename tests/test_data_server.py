@@ -0,0 +1,65 @@
+import pytest
+from conftest import connect, receive_lines
+from servers.data_server import DataServer
+
+@pytest.fixture
+def server(tmp_path):
+    return DataServer(str(tmp_path / "data") + "/", 1, "data_server", logs_dir=str(tmp_path / "logs") + "/")
+
+def test_parse_records(server):
+    assert server.parse_data("id:1,temp:20.5") == {"id": "1", "temp": "20.5"}
+    assert server.parse_data("id:1,note:") == {"id": "1", "note": ""}
+    assert server.parse_data("id:1,id:2") == {"id": "2"}
+    assert server.parse_data("clé:été") == {"clé": "été"}
+
+@pytest.mark.parametrize("data", [
+    "",
+    "id",
+    "id:1,",
+    ",id:1",
+    "id:1,,temp:2",
+    ":1",
+    "id:1,:2",
+    "id:1:2",
+    "id:1,temp",
+    "id:1;temp:2",
+    "id:1\ntemp:2",
+    "id:1\r",
+])
+def test_malformed_records_are_rejected(server, data):
+    assert server.parse_data(data) is None
+
+def test_batch_codes(server):
+    records = [server.parse_data(x) for x in "id:1;id;id:3".split(";")]
+    assert server._batch_response(records, True) == "400 200,400,200"
+    assert server._batch_response(records, False) == "500 500,400,500"
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_responses_wait_for_the_group_commit(start_server, tmp_path, engine):
+    data_dir = str(tmp_path / "data") + "/"
+    _, port = start_server(DataServer, data_dir, 5, "data_server", engine=engine, framing="newline", durability="flush", flush_interval=0.2)
+
+    conns = [connect(port) for _ in range(5)]
+    try:
+        for i, conn in enumerate(conns):
+            conn.sendall(f"id:{i}\nbad\nbatch;id:{i};x\n".encode("utf-8"))
+
+        for i, conn in enumerate(conns):
+            assert receive_lines(conn, 3) == ["200", "400", "400 200,400"]
+            with open(data_dir + "data.csv", "r") as f: # Answered once written
+                assert f.read().count(f"{i}\n") == 2
+    finally:
+        for conn in conns:
+            conn.close()
+
+def test_batch_messages(start_server, tmp_path):
+    data_dir = str(tmp_path / "data") + "/"
+    _, port = start_server(DataServer, data_dir, 5, "data_server", framing="newline", durability="flush", flush_interval=0.05)
+
+    with connect(port) as conn:
+        conn.sendall(b"batch;id:1,temp:2;id:2\n")
+        conn.sendall(b"batch;id:3;bad;;id:4,hum:5\n")
+        assert receive_lines(conn, 2) == ["200 200,200", "400 200,400,400,200"]
+
+    with open(data_dir + "data.csv", "r") as f:
+        assert f.read().splitlines() == ["1,2", "2,", "3,", "4,,5"]
@@ -0,0 +1,104 @@
+import os
+import socket
+import threading
+from conftest import free_udp_port, udp_port_bound, wait_for
+from servers.data_server import DataServer
+from servers.datagram_ingest import DatagramIngest
+from servers.log_server import LogServer
+from servers.metrics import Metrics
+
+def serve(ingest):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    stopped = threading.Event()
+    thread = threading.Thread(target=ingest.serve, args=(sock, stopped.is_set))
+    thread.start()
+
+    def stop():
+        stopped.set()
+        try:
+            sock.shutdown(socket.SHUT_RDWR) # Wakes the receiver up, even if it raises as the socket is not connected
+        except OSError:
+            pass
+        thread.join()
+        sock.close()
+
+    return sock.getsockname(), stop
+
+def counters(metrics):
+    return {name: value for (name, _), value in metrics.snapshot()[0].items()}
+
+def test_datagrams_are_handled_in_order():
+    handled = []
+    metrics = Metrics()
+    address, stop = serve(DatagramIngest(handled.extend, metrics))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for i in range(100):
+            sender.sendto(str(i).encode("utf-8"), address)
+
+    assert wait_for(lambda: len(handled) == 100)
+    stop()
+
+    assert handled == [str(i).encode("utf-8") for i in range(100)]
+    assert counters(metrics)["datagrams"] == 100
+
+def test_datagrams_past_the_queue_are_dropped():
+    handled = []
+    release = threading.Event()
+
+    def handle(payloads):
+        release.wait()
+        handled.extend(payloads)
+
+    metrics = Metrics()
+    address, stop = serve(DatagramIngest(handle, metrics, queue_size=10))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for i in range(200):
+            sender.sendto(b"x", address)
+
+    assert wait_for(lambda: sum(counters(metrics).values()) == 200) # Received, queued or dropped, never blocking
+    release.set()
+    stop()
+
+    assert counters(metrics)["datagrams_dropped"] > 0
+    assert len(handled) == counters(metrics)["datagrams"] <= 10 + DatagramIngest.BURST_SIZE # Queued, and the burst being handled
+
+def test_data_server_ingest(start_server, tmp_path):
+    data_dir = str(tmp_path / "data") + "/"
+    port = free_udp_port()
+    start_server(DataServer, data_dir, 5, "data_server", udp_port=port, flush_interval=0.05)
+    assert wait_for(lambda: udp_port_bound(port))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b"id:1,temp:20", ("127.0.0.1", port))
+        sender.sendto(b"batch;id:2;bad;id:3,temp:22", ("127.0.0.1", port))
+
+    def rows():
+        if not os.path.exists(data_dir + "data.csv"):
+            return []
+        with open(data_dir + "data.csv", "r") as f:
+            return f.read().splitlines()
+
+    assert wait_for(lambda: len(rows()) == 3)
+    assert rows() == ["1,20", "2,", "3,22"]
+
+def test_log_server_ingest(start_server, tmp_path):
+    log_dir = str(tmp_path / "log_data") + "/"
+    port = free_udp_port()
+    start_server(LogServer, log_dir, 5, "log_server", udp_port=port, flush_interval=0.05)
+    assert wait_for(lambda: udp_port_bound(port))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b"first line\nsecond line\n", ("127.0.0.1", port))
+        sender.sendto(b"third line", ("127.0.0.1", port))
+
+    def lines():
+        if not os.path.exists(log_dir + "data.log"):
+            return []
+        with open(log_dir + "data.log", "r") as f:
+            return f.read().splitlines()
+
+    assert wait_for(lambda: len(lines()) == 3)
+    assert lines() == ["first line", "second line", "third line"]
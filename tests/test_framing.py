@@ -0,0 +1,55 @@
+import pytest
+from servers.binary import BinarySession
+from servers.framing import FrameError, LengthPrefixFramer, NewlineFramer, create_framer
+from servers.server import Server
+
+def test_newline_messages_are_reassembled():
+    framer = NewlineFramer()
+    assert framer.feed(b"id:1,te") == []
+    assert framer.feed(b"mp:2\nid:2\n\nid:") == [b"id:1,temp:2", b"id:2"]
+    assert framer.feed(b"3\n") == [b"id:3"]
+    assert framer.frame(b"200") == b"200\n"
+
+def test_length_messages_are_reassembled():
+    framer = LengthPrefixFramer()
+    data = framer.frame(b"a\nb") + framer.frame(b"") + framer.frame(b"c" * 300)
+
+    assert framer.feed(data[:3]) == []
+    assert framer.feed(data[3:11]) == [b"a\nb", b""]
+    assert framer.feed(data[11:]) == [b"c" * 300]
+
+@pytest.mark.parametrize("chunks", [
+    [b"x" * 11],
+    [b"x" * 11 + b"\n"],
+    [b"ok\n" + b"x" * 11],
+    [b"x" * 6, b"x" * 6],
+])
+def test_oversize_newline_messages(chunks):
+    framer = NewlineFramer(max_frame_size=10)
+    with pytest.raises(FrameError):
+        for chunk in chunks:
+            framer.feed(chunk)
+
+def test_oversize_length_messages():
+    framer = LengthPrefixFramer(max_frame_size=10)
+    assert framer.feed(LengthPrefixFramer().frame(b"x" * 10)) == [b"x" * 10]
+    with pytest.raises(FrameError):
+        framer.feed(LengthPrefixFramer.HEADER.pack(11)) # Rejected before the body is received
+
+def test_unknown_framing():
+    with pytest.raises(ValueError):
+        create_framer("xml")
+
+@pytest.mark.parametrize("framing", ["newline", "length"])
+def test_pipelined_messages_are_answered_in_one_write(tmp_path, framing):
+    server = Server(1, "echo_server", logs_dir=str(tmp_path) + "/", framing=framing, metrics_interval=0)
+    server._init_server_state()
+    try:
+        framer = create_framer(framing)
+        data = b"".join([framer.frame(message) for message in (b"a", b"b", b"c")])
+
+        responses = list(server._handle_messages(create_framer(framing), BinarySession(), data))
+        assert responses == [data]
+        assert server.metrics.snapshot()[0][("messages", ())] == 3
+    finally:
+        server._stop_metrics()
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from util.data_util import BufferedFileWriter, Commit, GroupCommitWriter
+
+class ListWriter(GroupCommitWriter):
+    def __init__(self, fail=None, **kwargs):
+        self.batches = []
+        self.fail = fail # Exception raised by the next write, if any
+        super().__init__(**kwargs)
+
+    def _write_batch(self, items):
+        if self.fail is not None:
+            fail, self.fail = self.fail, None
+            raise fail
+        self.batches.append(list(items))
+        return True
+
+def test_appends_are_group_committed():
+    writer = ListWriter(flush_interval=60, durability="flush")
+    try:
+        batches = [writer.append([f"item {i}"]) for i in range(10)]
+        assert batches[0] is batches[-1] and not batches[0].done
+
+        assert writer.flush()
+        assert all([writer.wait(batch) for batch in batches])
+        assert writer.batches == [[f"item {i}" for i in range(10)]]
+    finally:
+        writer.close()
+
+def test_flush_size_wakes_the_flusher():
+    writer = ListWriter(flush_size=10, flush_interval=60, durability="flush")
+    try:
+        assert writer.write(["x" * 10]) # Returns once flushed in the background, long before flush_interval
+    finally:
+        writer.close()
+
+def test_record_durability_flushes_right_away():
+    writer = ListWriter(flush_interval=60, durability="record")
+    try:
+        assert writer.write(["a"]) and writer.write(["b"])
+        assert writer.batches == [["a"], ["b"]]
+    finally:
+        writer.close()
+
+@pytest.mark.parametrize("durability", ["flush", "record"])
+def test_failed_write_keeps_the_flusher_running(durability):
+    writer = ListWriter(fail=RuntimeError("bug"), flush_interval=0.01, durability=durability)
+    try:
+        assert not writer.write(["lost"])
+        assert writer.write(["kept"])
+        assert writer._flusher.is_alive()
+    finally:
+        writer.close()
+
+    assert writer.batches == [["kept"]]
+
+def test_failed_write_resolves_async_waiters():
+    writer = ListWriter(fail=KeyError("bug"), flush_interval=0.01, durability="flush")
+
+    async def write(items):
+        return await Commit([(writer, writer.append(items))]).wait_async()
+
+    async def main():
+        failed = await asyncio.wait_for(write(["lost"]), 5)
+        stored = await asyncio.wait_for(write(["kept"]), 5)
+        return failed, stored
+
+    try:
+        assert asyncio.run(main()) == (False, True)
+    finally:
+        writer.close()
+
+def test_closed_writer_rejects_appends(tmp_path):
+    writer = BufferedFileWriter(str(tmp_path / "data.csv"))
+    writer.write(["a", "b"])
+    writer.close()
+
+    with pytest.raises(ValueError):
+        writer.append(["c"])
+    assert (tmp_path / "data.csv").read_text() == "a\nb\n"
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import pytest
+from util.latest import LatestValues, SharedLatestValues
+
+def test_latest_values():
+    table = LatestValues(device_key="id", history=2)
+    table.update([{"id": "a", "temp": "1"}], received=1.0)
+    table.update([{"id": "a", "temp": "2", "hum": "3"}], received=2.0)
+
+    assert table.latest("a") == {"temp": (2.0, "2"), "hum": (2.0, "3")}
+    assert table.readings("a", "temp") == [(1.0, "1"), (2.0, "2")]
+    assert table.latest("b") == {}
+
+def _update(table, worker, updates):
+    for i in range(updates):
+        table.update([{"id": f"d{worker}", "temp": str(i), "hum": str(i)}, {"id": "shared", f"k{worker}": str(i)}], received=float(i + 1))
+    os._exit(0)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Shared tables are inherited by forked workers")
+def test_shared_across_fork():
+    table = SharedLatestValues(device_key="id", history=3, size=1024)
+    context = multiprocessing.get_context("fork")
+
+    workers = [context.Process(target=_update, args=(table, worker, 500)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    for worker in range(4):
+        assert table.latest(f"d{worker}") == {"temp": (500.0, "499"), "hum": (500.0, "499")}
+        assert table.readings(f"d{worker}", "temp") == [(498.0, "497"), (499.0, "498"), (500.0, "499")]
+
+    assert table.latest("shared") == {f"k{worker}": (500.0, "499") for worker in range(4)}
+    assert sorted(table.latest("shared")) == ["k0", "k1", "k2", "k3"]
+
+def test_shared_table_full():
+    table = SharedLatestValues(device_key="id", size=3) # 4 slots
+    assert table.update([{"id": "a", "x": "1", "y": "2"}]) == 0
+
+    # One free slot left, which a new device's head and key cannot both take
+    assert table.update([{"id": "b", "z": "1"}]) == 1
+    assert table.latest("b") == {}
+    assert table.update([{"id": "a", "x": "3"}]) == 0
+    assert table.latest("a")["x"][1] == "3"
+
+def test_shared_values_too_long():
+    table = SharedLatestValues(size=16)
+    assert table.update([{"key": "x" * (SharedLatestValues.VALUE_SIZE + 1), "other": "1"}]) == 1
+    assert list(table.latest("")) == ["other"]
@@ -0,0 +1,42 @@
+import time
+from os import path
+from util.data_util import TS_INDEX_RECORD, create_file_writer, data_files, read_indexed_lines, read_partitions, ts_index_path
+
+def read_lines(directory, name="log", ext="txt", start=None, end=None):
+    return [line for file_path in data_files(directory, name, ext, start=start, end=end) for lines in read_indexed_lines(file_path, start=start, end=end) for _, line in lines]
+
+def test_round_trip(tmp_path):
+    directory = str(tmp_path) + "/"
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily", partition_size=1000)
+    for batch in range(20):
+        writer.write([f"batch {batch} line {i} é" for i in range(10)])
+    writer.close()
+
+    partitions = read_partitions(directory, "log")["partitions"]
+    assert len(partitions) > 1
+    assert all([partition["bytes"] <= 1000 for partition in partitions])
+    assert sum([partition["rows"] for partition in partitions]) == 200
+    assert read_lines(directory) == [f"batch {batch} line {i} é" for batch in range(20) for i in range(10)]
+
+def test_crash_truncation(tmp_path):
+    directory = str(tmp_path) + "/"
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily")
+    writer.write(["first", "second"])
+    writer.close()
+
+    # Written after the last manifest update, as if the process died in the middle of a flush
+    partition = read_partitions(directory, "log")["partitions"][-1]
+    file_path = path.join(directory, partition["file"])
+    with open(file_path, "ab") as f:
+        f.write(b"torn li")
+    with open(ts_index_path(file_path), "ab") as f:
+        f.write(TS_INDEX_RECORD.pack(time.time(), partition["bytes"])[:5])
+
+    assert read_lines(directory) == ["first", "second"]
+
+    writer = create_file_writer(directory, "log", "txt", ts_index=True, partition="daily")
+    writer.write(["third"])
+    writer.close()
+
+    assert read_lines(directory) == ["first", "second", "third"]
+    assert path.getsize(ts_index_path(file_path)) == 3 * TS_INDEX_RECORD.size
@@ -0,0 +1,55 @@
+import itertools
+import threading
+import time
+from util.data_util import BufferedFileWriter, TS_INDEX_RECORD, read_indexed_lines, ts_index_path
+from util.storage import CsvStorage, read_csv_rows
+
+def test_concurrent_appends_index_increasing_times(tmp_path, monkeypatch):
+    file_path = str(tmp_path / "data.csv")
+    writer = BufferedFileWriter(file_path, flush_interval=0.01, ts_index=True)
+    clock = itertools.count()
+
+    def now(): # Lets other threads run between reading the clock and buffering
+        received = float(next(clock))
+        time.sleep(0.0001)
+        return received
+
+    monkeypatch.setattr(time, "time", now)
+
+    def append(worker):
+        for i in range(100):
+            writer.append([f"{worker},{i}"])
+
+    threads = [threading.Thread(target=append, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    monkeypatch.undo()
+
+    with open(ts_index_path(file_path), "rb") as f:
+        times = [received for received, _ in TS_INDEX_RECORD.iter_unpack(f.read())]
+
+    assert len(times) == 8 * 100
+    assert times == sorted(times)
+
+def test_time_range_reads(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    storage = CsvStorage(data_dir)
+    try:
+        storage.store([{"id": "1", "temp": "20"}])
+        middle = time.time()
+        time.sleep(0.01)
+        storage.store([{"id": "2", "hum": "50"}, {"id": "3", "temp": "22"}])
+    finally:
+        storage.close()
+
+    rows = [values for chunk in read_csv_rows(data_dir, ["temp", "hum"], chunk_rows=2) for _, values in chunk]
+    assert rows == [["20", ""], ["", "50"], ["22", ""]]
+
+    rows = [values for chunk in read_csv_rows(data_dir, ["id"], start=middle) for _, values in chunk]
+    assert rows == [["2"], ["3"]]
+
+    lines = [line for chunk in read_indexed_lines(data_dir + "data.csv", end=middle) for _, line in chunk]
+    assert lines == ["1,20"]
@@ -0,0 +1,38 @@
+from util.rollup import RollupWriter, read_rollups
+
+def add(data_dir, batches, **kwargs):
+    writer = RollupWriter(data_dir, intervals=(10,), flush_interval=60, **kwargs)
+    try:
+        for received, records in batches:
+            writer.add(records, received=received)
+    finally:
+        writer.close()
+
+def test_buckets_by_receipt_time(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    add(data_dir, [(100.5, [{"temp": "20", "note": "x"}, {"temp": "22"}]), (109.9, [{"temp": "18"}]), (110.0, [{"temp": "1e400"}, {"temp": "nan"}, {"temp": "5"}])])
+
+    assert read_rollups(data_dir, 10) == [(100, "", "temp", 3, 18.0, 22.0, 60.0, 20.0), (110, "", "temp", 1, 5.0, 5.0, 5.0, 5.0)]
+    assert read_rollups(data_dir, 10, start=110) == [(110, "", "temp", 1, 5.0, 5.0, 5.0, 5.0)]
+    assert read_rollups(data_dir, 10, columns=["hum"]) == []
+
+def test_rows_of_a_bucket_are_merged(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    add(data_dir, [(100, [{"id": "a", "temp": "20"}, {"id": "b", "temp": "30"}])], group_key="id")
+    add(data_dir, [(105, [{"id": "a", "temp": "10"}])], group_key="id") # After a restart
+
+    assert read_rollups(data_dir, 10) == [(100, "a", "temp", 2, 10.0, 20.0, 30.0, 15.0), (100, "b", "temp", 1, 30.0, 30.0, 30.0, 30.0)]
+    assert read_rollups(data_dir, 10, group="b") == [(100, "b", "temp", 1, 30.0, 30.0, 30.0, 30.0)]
+
+def test_late_records_count_in_the_oldest_open_bucket(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    writer = RollupWriter(data_dir, intervals=(10,), flush_interval=60)
+    try:
+        writer.add([{"temp": "1"}], received=100)
+        assert writer.flush() # Bucket 100 is long closed
+        writer.add([{"temp": "2"}], received=101)
+        writer.add([{"temp": "3"}], received=125)
+    finally:
+        writer.close()
+
+    assert [row[:4] for row in read_rollups(data_dir, 10)] == [(100, "", "temp", 1), (110, "", "temp", 1), (120, "", "temp", 1)]
@@ -0,0 +1,43 @@
+import pytest
+from util.schema import SCHEMA_FILE, SchemaRegistry
+from util.storage import CsvStorage, read_csv_records, read_csv_rows
+
+def test_versions_survive_reload(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    schema = SchemaRegistry(data_dir)
+    assert schema.add_columns(["id", "temp"]) == 1
+    assert schema.add_columns(["temp", "hum"]) == 2
+
+    schema = SchemaRegistry(data_dir)
+    assert schema.columns == ["id", "temp", "hum"]
+    assert schema.to_record(["1", "20"]) == {"id": "1", "temp": "20"}
+
+@pytest.mark.parametrize("key", ["a,b", "te\nmp", "te\rmp"])
+def test_invalid_keys_are_not_written(tmp_path, key):
+    data_dir = str(tmp_path) + "/"
+    schema = SchemaRegistry(data_dir)
+    schema.add_columns(["id"])
+
+    with pytest.raises(ValueError):
+        schema.add_columns(["ok", key])
+
+    assert SchemaRegistry(data_dir).columns == ["id"]
+
+def test_storage_rejects_invalid_keys(tmp_path):
+    storage = CsvStorage(str(tmp_path) + "/")
+    try:
+        assert not storage.store([{"te\nmp": "1"}])
+        assert storage.store([{"temp": "1"}])
+    finally:
+        storage.close()
+
+def test_reads_do_not_write_the_schema(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    with open(data_dir + "header.csv", "w") as f:
+        f.write("id,temp\n")
+    with open(data_dir + "data.csv", "w") as f:
+        f.write("1,20\n")
+
+    assert list(read_csv_records(data_dir)) == [{"id": "1", "temp": "20"}]
+    assert list(read_csv_rows(data_dir, ["temp"])) == []
+    assert not (tmp_path / SCHEMA_FILE).exists()
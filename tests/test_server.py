@@ -0,0 +1,33 @@
+import time
+import pytest
+from conftest import connect, receive_lines
+from servers.server import Server
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_pipelined_messages_are_answered_in_order(start_server, engine):
+    _, port = start_server(Server, 5, "echo_server", engine=engine, framing="newline")
+
+    with connect(port) as conn:
+        conn.sendall(b"a\nb\n")
+        conn.sendall(b"c\nd")
+        conn.sendall(b"\n")
+        assert receive_lines(conn, 4) == ["a", "b", "c", "d"]
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_idle_connections_are_closed(start_server, engine):
+    _, port = start_server(Server, 0.2, "echo_server", engine=engine, framing="newline")
+
+    with connect(port) as conn:
+        start = time.monotonic()
+        assert conn.recv(1024) == b""
+        assert time.monotonic() - start < 4.0
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_oversize_messages_close_the_connection(start_server, engine):
+    _, port = start_server(Server, 5, "echo_server", engine=engine, framing="newline", max_frame_size=16)
+
+    with connect(port) as conn:
+        conn.sendall(b"ok\n")
+        assert receive_lines(conn, 1) == ["ok"]
+        conn.sendall(b"x" * 17 + b"\n")
+        assert conn.recv(1024) == b""
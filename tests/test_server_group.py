@@ -0,0 +1,41 @@
+import time
+from conftest import connect, receive_lines
+from servers.data_server import DataServer
+from servers.query_server import QueryServer
+from servers.server_group import ServerGroup
+from servers.server import Server
+
+def test_servers_share_one_process(tmp_path):
+    logs_dir = str(tmp_path / "logs") + "/"
+    data_dir = str(tmp_path / "data") + "/"
+    servers = [
+        (DataServer(data_dir, 5, "data_server", logs_dir=logs_dir, framing="newline", durability="flush", flush_interval=0.05), "127.0.0.1", 0),
+        (QueryServer(data_dir, 5, "query_server", logs_dir=logs_dir, framing="newline"), "127.0.0.1", 0),
+        (Server(5, "echo_server", logs_dir=logs_dir, engine="thread", framing="newline"), "127.0.0.1", 0),
+    ]
+    group = ServerGroup(servers, "all_servers", logs_dir=logs_dir)
+    group.start()
+
+    try:
+        data_port, query_port, echo_port = [sock.getsockname()[1] for sock in group.listen_socks]
+        assert len(group.server_procs) == 1
+
+        with connect(data_port) as conn:
+            conn.sendall(b"id:1,temp:20\nid:2,temp:21\n")
+            assert receive_lines(conn, 2) == ["200", "200"]
+
+        with connect(query_port) as conn:
+            conn.sendall(b"select:temp\n")
+            lines = receive_lines(conn, 4)
+            assert lines[0] == "200 ts,temp" and lines[-1] == "END"
+            assert [line.split(",")[1] for line in lines[1:3]] == ["20", "21"]
+
+        with connect(echo_port) as conn: # Served on the shared event loop whatever its engine
+            conn.sendall(b"ping\n")
+            assert receive_lines(conn, 1) == ["ping"]
+
+    finally:
+        group.stop()
+        deadline = time.monotonic() + 10
+        while group.is_running() and time.monotonic() < deadline:
+            time.sleep(0.01)
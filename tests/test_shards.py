@@ -0,0 +1,60 @@
+import os
+import time
+import pytest
+from util.data_util import read_shards, shard_dir_name, shard_data_dirs, worker_data_dir
+from util.storage import create_storage, read_csv_records, read_csv_rows
+
+def store(data_dir, batches, **kwargs):
+    storage = create_storage("csv", data_dir, shard_key="id", **kwargs)
+    try:
+        for records in batches:
+            assert storage.store(records)
+            time.sleep(0.002) # Distinct receipt times, so the merged order is known
+    finally:
+        storage.close()
+
+def rows(data_dir, columns, **kwargs):
+    return [values for chunk in read_csv_rows(data_dir, columns, **kwargs) for _, values in chunk]
+
+def test_records_are_routed_by_shard_key(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [[{"id": "a/1", "temp": "1"}, {"id": "b", "hum": "2"}], [{"temp": "3"}], [{"id": "a/1", "temp": "4"}]])
+
+    manifest = read_shards(data_dir)
+    assert manifest["shard_key"] == "id"
+    assert sorted(manifest["directories"]) == sorted([shard_dir_name(value) for value in ("a/1", "b", "")])
+    assert all([os.path.dirname(directory.rstrip("/")) == str(tmp_path) for directory in shard_data_dirs(data_dir)]) # Values are quoted
+
+    # Shards have their own schema
+    assert [record for record in read_csv_records(shard_data_dirs(data_dir, "b")[0])] == [{"id": "b", "hum": "2"}]
+
+def test_reads_merge_shards_in_receipt_order(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [[{"id": "a", "temp": "1"}], [{"id": "b", "temp": "2"}], [{"id": "a", "temp": "3"}], [{"id": "c", "temp": "4"}]])
+
+    assert rows(data_dir, ["id", "temp"], chunk_rows=3) == [["a", "1"], ["b", "2"], ["a", "3"], ["c", "4"]]
+    assert rows(data_dir, ["temp"], shard="a") == [["1"], ["3"]]
+    assert rows(data_dir, ["temp"], shard="missing") == []
+
+def test_hashed_shards_filter_by_value(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    values = [str(i) for i in range(20)]
+    store(data_dir, [[{"id": value, "temp": value} for value in values]], shards=2)
+
+    assert len(read_shards(data_dir)["directories"]) == 2
+    assert rows(data_dir, ["temp"], shard="7") == [["7"]]
+    assert sorted([row[0] for row in rows(data_dir, ["temp"])], key=int) == values
+
+def test_workers_are_merged(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(worker_data_dir(data_dir, 0), [[{"id": "a", "temp": "1"}], [{"id": "a", "temp": "3"}]])
+    store(worker_data_dir(data_dir, 1), [[{"id": "a", "temp": "2"}]])
+
+    assert sorted(rows(data_dir, ["temp"], shard="a")) == [["1"], ["2"], ["3"]]
+
+def test_sharding_cannot_change(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    store(data_dir, [[{"id": "a"}]])
+
+    with pytest.raises(ValueError):
+        create_storage("csv", data_dir, shard_key="device")
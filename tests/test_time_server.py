@@ -0,0 +1,46 @@
+import socket
+import time
+import pytest
+from conftest import connect, free_udp_port, udp_port_bound, wait_for
+from servers.binary import HELLO, TIMES, decode_status, encode_time
+from servers.framing import LengthPrefixFramer
+from servers.time_server import TIME_MAGIC, TIME_REQUEST, TIME_RESPONSE, AnchoredClock, TimeServer, query_time
+
+def test_anchored_clock_follows_the_wall_clock():
+    clock = AnchoredClock(anchor_interval=0)
+    readings = [clock.time_ns() for _ in range(100)]
+
+    assert abs(readings[-1] - time.time_ns()) < 50e6
+    assert readings == sorted(readings)
+
+def test_udp_time_protocol(start_server):
+    port = free_udp_port()
+    start_server(TimeServer, 5, "time_server", udp_port=port)
+    assert wait_for(lambda: udp_port_bound(port))
+
+    offset, delay = query_time("127.0.0.1", port)
+    assert abs(offset) < 0.05 and 0 <= delay < 1.0 # Same clock
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock: # Invalid requests are dropped
+        sock.settimeout(0.2)
+        sock.sendto(b"XXXX" + bytes(8), ("127.0.0.1", port))
+        sock.sendto(TIME_REQUEST.pack(TIME_MAGIC, 1) + b"x", ("127.0.0.1", port))
+        with pytest.raises(socket.timeout):
+            sock.recv(TIME_RESPONSE.size)
+
+def test_binary_time_messages(start_server):
+    _, port = start_server(TimeServer, 5, "time_server", framing="length")
+    framer = LengthPrefixFramer()
+
+    with connect(port) as conn:
+        conn.sendall(framer.frame(HELLO) + framer.frame(encode_time(42)))
+
+        messages = []
+        while len(messages) < 2:
+            messages += framer.feed(conn.recv(1024))
+
+        assert messages[0] == HELLO
+        code, body = decode_status(messages[1])
+        sent, received, transmitted = TIMES.unpack(body)
+        assert code == 200 and sent == 42 and received <= transmitted
+        assert abs(received - time.time_ns()) < 1e9
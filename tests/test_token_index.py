@@ -0,0 +1,89 @@
+import os
+import time
+from os import path
+from util.data_util import BufferedFileWriter, token_index_path
+from util.token_index import RUN_HEADER, TokenIndexWriter, covered_ranges, live_runs, read_runs, search_file
+
+def write_lines(file_path, batches):
+    writer = BufferedFileWriter(file_path, ts_index=True, token_index=True)
+    for lines in batches:
+        writer.write(lines)
+        writer.flush()
+    writer.close()
+
+def search(file_path, query):
+    return [line for _, line in search_file(file_path, query)]
+
+def index_again(file_path, rows, timeout=10.0):
+    # Returns the ranges covered once a writer opened with rows indexed them again, which close() abandons
+    writer = TokenIndexWriter(file_path, rows=rows)
+    deadline = time.monotonic() + timeout
+
+    try:
+        while time.monotonic() < deadline:
+            covered = covered_ranges(live_runs(read_runs(token_index_path(file_path))))
+            if covered == [(0, rows)]:
+                break
+            time.sleep(0.01)
+    finally:
+        writer.close()
+
+    return covered
+
+def test_round_trip(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    write_lines(file_path, [[f"line {i} " + ("needle" if i % 7 == 0 else "hay") for i in range(j, j + 10)] for j in range(0, 100, 10)])
+
+    assert search(file_path, "needle") == [f"line {i} needle" for i in range(0, 100, 7)]
+    assert search(file_path, "LINE 41 hay") == ["line 41 hay"]
+    assert search(file_path, "missing") == []
+
+    assert covered_ranges(live_runs(read_runs(token_index_path(file_path)))) == [(0, 100)]
+
+def test_merged_runs_supersede_their_inputs(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    write_lines(file_path, [[f"line {i}"] for i in range(200)])
+
+    live = live_runs(read_runs(token_index_path(file_path)))
+    assert [first_row for _, first_row, _, _ in live] == [0] + [first_row + rows for _, first_row, rows, _ in live[:-1]] # No overlaps
+    assert covered_ranges(live) == [(0, 200)]
+    assert search(file_path, "line 123") == ["line 123"]
+
+def test_interrupted_run_is_ignored_and_rows_scanned(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    write_lines(file_path, [[f"line {i} " + ("needle" if i == 3 else "hay")] for i in range(5)])
+
+    index_path = token_index_path(file_path)
+    last = read_runs(index_path)[-1]
+    os.truncate(index_path, last[0] + 5) # Crash in the middle of the last run
+
+    assert read_runs(index_path)[-1] != last
+    assert search(file_path, "needle") == ["line 3 needle"]
+    assert search(file_path, "line 4") == ["line 4 hay"]
+
+def test_lost_run_is_scanned_and_indexed_again(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    write_lines(file_path, [[f"line {i} " + ("needle" if i == 3 else "hay")] for i in range(5)])
+
+    index_path = token_index_path(file_path)
+    runs = read_runs(index_path)
+    row_3 = [run for run in live_runs(runs) if run[1] <= 3 < run[1] + run[2]][0]
+    os.truncate(index_path, row_3[0] - RUN_HEADER.size) # Lose the run of row 3 and everything after it
+
+    assert search(file_path, "needle") == ["line 3 needle"]
+
+    write_lines(file_path, [["line 5 needle"]])
+    assert search(file_path, "needle") == ["line 3 needle", "line 5 needle"]
+
+    assert index_again(file_path, 6) == [(0, 6)]
+    assert search(file_path, "needle") == ["line 3 needle", "line 5 needle"]
+
+def test_runs_past_the_rows_are_dropped(tmp_path):
+    file_path = str(tmp_path / "log.txt")
+    write_lines(file_path, [[f"line {i}"] for i in range(4)])
+
+    assert index_again(file_path, 2) == [(0, 2)] # As if the file had been truncated to 2 rows since
+
+    runs = read_runs(token_index_path(file_path))
+    assert all([first_row + rows <= 2 for _, first_row, rows, _ in runs]) # Compacted
+    assert not path.exists(token_index_path(file_path) + ".tmp")
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import sys
+from array import array
+from os import path
+from util.data_util import Commit, GroupCommitWriter, worker_data_dirs
+from util.schema import SchemaRegistry
+
+try:
+    import numpy as np
+except ImportError: # Only needed to load columns
+    np = None
+
+'''
+    Column segments are raw little/big-endian (see manifest "byteorder") arrays that can be memory-mapped as is:
+        i8  - int64, null is INT_NULL
+        f8  - float64, null is NaN
+        str - utf-8 bytes in <file>.str with int64 end offsets in <file>.off, null is the empty string
+'''
+
+INT_NULL = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+DTYPES = ("i8", "f8", "str") # In order of promotion
+
+MANIFEST_FILE = "manifest.json"
+TIMESTAMPS_FILE = "received.f8" # Receipt times of the rows converted from CSV, see util/convert.py
+
+def columns_dir(data_dir):
+    return path.join(data_dir, "columns")
+
+def read_manifest(data_dir):
+    try:
+        with open(path.join(columns_dir(data_dir), MANIFEST_FILE), "r") as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return {"rows": 0, "byteorder": sys.byteorder, "schema_version": 0, "columns": {}}
+
+def write_manifest(data_dir, manifest, fsync=False):
+    manifest_path = path.join(columns_dir(data_dir), MANIFEST_FILE)
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+    os.replace(manifest_path + ".tmp", manifest_path) # Atomic, readers never see a partially written manifest
+
+def infer_dtype(value, dtype=None):
+    '''
+        Returns the narrowest dtype at least as wide as dtype that can hold value. Integers outside of int64 (or
+        equal to INT_NULL, which would read back as null) need f8.
+    '''
+    if value == "" or dtype == "str":
+        return dtype
+
+    if dtype in (None, "i8"):
+        try:
+            if INT_NULL < int(value) <= INT_MAX:
+                return "i8"
+        except ValueError:
+            pass
+
+    try:
+        float(value)
+        return "f8"
+    except ValueError:
+        return "str"
+
+class ColumnarStorage(GroupCommitWriter):
+    '''
+        Stores records as typed, append-only column segments under <data_dir>/columns/.
+
+        Every row has a value (or null) in every column. A column's dtype is inferred from its values and
+        promoted (i8 -> f8 -> str) by starting a new segment, earlier segments are never rewritten. Columns are
+        numbered by the data directory's SchemaRegistry and every segment records the schema version it was
+        started with, a column added later simply starts at a later row.
+    '''
+
+    def __init__(self, data_dir, flush_size=65536, flush_interval=1.0, durability="none", segment_rows=1000000):
+        self.data_dir = data_dir
+        self.segment_rows = segment_rows
+
+        os.makedirs(columns_dir(self.data_dir), exist_ok=True)
+        self.schema = SchemaRegistry(self.data_dir)
+        self.manifest = read_manifest(self.data_dir)
+
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Columns in {self.data_dir} were written with {self.manifest['byteorder']} byte order")
+
+        self._truncate_segments()
+
+        super().__init__(flush_size=flush_size, flush_interval=flush_interval, durability=durability)
+
+    def store(self, records):
+        '''
+            Returns True if all records (dicts of column name to value) were stored
+        '''
+        return self.write(records)
+
+    def append_records(self, records):
+        '''
+            Buffers records, returns their Commit
+        '''
+        return Commit([(self, self.append(records))])
+
+    def _item_size(self, item):
+        return sum([len(key) + len(str(value)) for key, value in item.items()])
+
+    def _truncate_segments(self):
+        # Drop anything written after the last manifest update (e.g. on crash), so appends stay aligned
+        for column in self.manifest["columns"].values():
+            if not column["segments"]:
+                continue
+
+            segment = column["segments"][-1]
+            segment_path = path.join(columns_dir(self.data_dir), segment["file"])
+
+            if segment["dtype"] == "str":
+                _truncate(segment_path + ".off", segment["rows"] * 8)
+                _truncate(segment_path + ".str", _last_offset(segment_path + ".off", segment["rows"]))
+            else:
+                _truncate(segment_path, segment["rows"] * 8)
+
+    def _write_batch(self, items):
+        columns = self.manifest["columns"]
+        start_row = self.manifest["rows"]
+
+        try:
+            new_keys = [key for data in items for key in data if key not in columns]
+            if new_keys:
+                self.schema.add_columns(new_keys)
+                for key in new_keys:
+                    columns.setdefault(key, {"index": self.schema.index[key], "start_row": start_row, "segments": []})
+
+            for key, column in columns.items():
+                values = [str(data[key]) if key in data else "" for data in items]
+                self._append_column(column, values, start_row)
+
+            self.manifest["rows"] = start_row + len(items)
+            self.manifest["schema_version"] = self.schema.version
+            write_manifest(self.data_dir, self.manifest, fsync=self.durability != "none")
+
+        except (OSError, ValueError, OverflowError) as e:
+            logging.error(f"{e}. Error flushing {len(items)} row(s) to columns in {self.data_dir}.")
+            self.manifest = read_manifest(self.data_dir)
+            self._truncate_segments()
+            return False
+
+        return True
+
+    def _append_column(self, column, values, start_row):
+        segments = column["segments"]
+        segment = segments[-1] if segments else None
+
+        dtype = segment["dtype"] if segment is not None else None
+        for value in values:
+            dtype = infer_dtype(value, dtype)
+        dtype = dtype or "i8" # Column only holds nulls so far
+
+        if segment is None or segment["dtype"] != dtype or segment["rows"] + len(values) > self.segment_rows:
+            segment = {
+                "file": f"c{column['index']}_{len(segments)}" + ("" if dtype == "str" else f".{dtype}"),
+                "dtype": dtype,
+                "start_row": start_row,
+                "rows": 0,
+                "schema_version": self.schema.version,
+            }
+            segments.append(segment)
+            _remove_segment_files(path.join(columns_dir(self.data_dir), segment["file"])) # Left over from a failed flush
+
+        segment_path = path.join(columns_dir(self.data_dir), segment["file"])
+
+        if dtype == "str":
+            encoded = [value.encode("utf-8") for value in values]
+            offsets = array("q")
+            offset = _last_offset(segment_path + ".off", segment["rows"])
+            for value in encoded:
+                offset += len(value)
+                offsets.append(offset)
+
+            self._append_file(segment_path + ".str", b"".join(encoded))
+            self._append_file(segment_path + ".off", offsets.tobytes())
+
+        elif dtype == "f8":
+            self._append_file(segment_path, array("d", [float(value) if value != "" else float("nan") for value in values]).tobytes())
+
+        else:
+            self._append_file(segment_path, array("q", [int(value) if value != "" else INT_NULL for value in values]).tobytes())
+
+        segment["rows"] += len(values)
+
+    def _append_file(self, file_path, data):
+        with open(file_path, "ab") as f:
+            f.write(data)
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+
+def _truncate(file_path, size):
+    if path.exists(file_path) and path.getsize(file_path) > size:
+        os.truncate(file_path, size)
+
+def _remove_segment_files(segment_path):
+    for file_path in (segment_path, segment_path + ".str", segment_path + ".off"):
+        if path.exists(file_path):
+            os.remove(file_path)
+
+def _last_offset(offsets_path, rows):
+    if rows <= 0:
+        return 0
+
+    with open(offsets_path, "rb") as f:
+        f.seek((rows - 1) * 8)
+        offsets = array("q")
+        offsets.frombytes(f.read(8))
+
+    return offsets[0]
+
+def _map_segment(data_dir, segment, byteorder):
+    '''
+        Returns the segment as a read-only array backed by the file, without copying (except for strings)
+    '''
+    segment_path = path.join(columns_dir(data_dir), segment["file"])
+    endian = "<" if byteorder == "little" else ">"
+
+    if segment["rows"] == 0:
+        return np.empty(0, dtype=object if segment["dtype"] == "str" else endian + segment["dtype"])
+
+    if segment["dtype"] != "str":
+        return np.memmap(segment_path, dtype=endian + segment["dtype"], mode="r", shape=(segment["rows"],))
+
+    offsets = np.memmap(segment_path + ".off", dtype=endian + "i8", mode="r", shape=(segment["rows"],))
+    data = np.memmap(segment_path + ".str", dtype=np.uint8, mode="r", shape=(int(offsets[-1]),)) if offsets[-1] > 0 else b""
+    starts = np.concatenate(([0], offsets[:-1]))
+
+    return np.array([bytes(data[start:end]).decode("utf-8") for start, end in zip(starts, offsets)], dtype=object)
+
+def load_column(data_dir, key, manifest=None):
+    '''
+        Returns the column as a NumPy array. A column held in a single segment is memory-mapped without copying,
+        otherwise segments are promoted to the column's widest dtype and concatenated, with missing rows as null.
+        Columns of per-worker directories are concatenated after the ones in data_dir.
+    '''
+    if np is None:
+        raise ImportError("numpy is required to load columns")
+
+    if manifest is not None:
+        manifests = [(data_dir, manifest)]
+    else:
+        manifests = [(directory, read_manifest(directory)) for directory in worker_data_dirs(data_dir)]
+        manifests = [(directory, manifest) for directory, manifest in manifests if manifest["rows"] > 0]
+
+    parts = [_load_dir_column(directory, key, manifest) for directory, manifest in manifests]
+    if not parts or all([part is None for part in parts]):
+        raise KeyError(key)
+
+    if len(parts) == 1:
+        return parts[0]
+
+    dtype = max([_array_dtype(part) for part in parts if part is not None], key=DTYPES.index)
+    parts = [_nulls(manifest["rows"], dtype) if part is None else _promote(part, dtype) for part, (_, manifest) in zip(parts, manifests)]
+
+    return np.concatenate(parts)
+
+def _load_dir_column(data_dir, key, manifest):
+    if key not in manifest["columns"]:
+        return None
+
+    segments = manifest["columns"][key]["segments"]
+
+    if len(segments) == 1 and segments[0]["start_row"] == 0 and segments[0]["rows"] == manifest["rows"]:
+        return _map_segment(data_dir, segments[0], manifest["byteorder"])
+
+    dtype = max([segment["dtype"] for segment in segments], key=DTYPES.index, default="i8")
+    out = _nulls(manifest["rows"], dtype)
+
+    for segment in segments:
+        values = _promote(_map_segment(data_dir, segment, manifest["byteorder"]), dtype)
+        out[segment["start_row"]:segment["start_row"] + segment["rows"]] = values
+
+    return out
+
+def load_columns(data_dir, keys=None):
+    '''
+        Returns dict of column name to NumPy array, for all columns if keys is None
+    '''
+    if keys is None:
+        keys = list(dict.fromkeys([key for directory in worker_data_dirs(data_dir) for key in read_manifest(directory)["columns"]]))
+
+    return {key: load_column(data_dir, key) for key in keys}
+
+def load_timestamps(data_dir):
+    '''
+        Returns the receipt times (epoch seconds, NaN if unknown) of the rows converted from CSV as a float64 NumPy
+        array, memory-mapped without copying for a single directory. Rows stored after the conversion have none.
+    '''
+    if np is None:
+        raise ImportError("numpy is required to load columns")
+
+    manifests = [(directory, read_manifest(directory)) for directory in worker_data_dirs(data_dir)]
+    manifests = [(directory, manifest) for directory, manifest in manifests if manifest["rows"] > 0]
+
+    parts = []
+    for directory, manifest in manifests:
+        timestamps = manifest.get("timestamps", {"file": TIMESTAMPS_FILE, "rows": 0})
+        endian = "<" if manifest["byteorder"] == "little" else ">"
+
+        if timestamps["rows"] == 0:
+            parts.append(np.full(manifest["rows"], np.nan))
+            continue
+
+        part = np.memmap(path.join(columns_dir(directory), timestamps["file"]), dtype=endian + "f8", mode="r", shape=(timestamps["rows"],))
+        if timestamps["rows"] < manifest["rows"]:
+            part = np.concatenate((part, np.full(manifest["rows"] - timestamps["rows"], np.nan)))
+        parts.append(part)
+
+    if len(parts) == 1:
+        return parts[0]
+
+    return np.concatenate(parts) if parts else np.empty(0)
+
+def _array_dtype(values):
+    return {"i": "i8", "f": "f8"}.get(values.dtype.kind, "str")
+
+def _nulls(rows, dtype):
+    if dtype == "str":
+        return np.full(rows, "", dtype=object)
+
+    if dtype == "f8":
+        return np.full(rows, np.nan, dtype=np.float64)
+
+    return np.full(rows, INT_NULL, dtype=np.int64)
+
+def _promote(values, dtype):
+    from_dtype = _array_dtype(values)
+
+    if from_dtype == dtype:
+        return values
+
+    if dtype == "str":
+        if from_dtype == "f8":
+            return np.array(["" if np.isnan(value) else repr(float(value)) for value in values], dtype=object)
+        return np.array(["" if value == INT_NULL else str(int(value)) for value in values], dtype=object)
+
+    return np.where(values == INT_NULL, np.nan, values) # i8 -> f8
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+import io
+import logging
+import os
+import shutil
+import sys
+import zlib
+from bisect import bisect_right
+from os import path
+from util.columnar import INT_NULL, MANIFEST_FILE, TIMESTAMPS_FILE, columns_dir, write_manifest
+from util.data_util import *
+from util.schema import SCHEMA_FILE, SchemaRegistry
+
+try:
+    import numpy as np
+except ImportError: # Only needed to convert
+    np = None
+
+'''
+    Bulk conversion of the data.csv history of a CSV data directory (see CsvStorage) into the column format of
+    util/columnar.py, with one segment per column so load_columns() memory-maps every column without copying.
+    The receipt time of every row (from the timestamp index, NaN for rows without one) is kept alongside, see
+    load_timestamps().
+
+    Files are streamed in chunks of complete lines and every chunk is parsed with NumPy, never per value in Python:
+    chunks of rows of the same width and numeric columns go through numpy.loadtxt's C parser, others are split on
+    the separator positions and every column is converted at once, which also fills the columns missing from rows
+    written before the schema grew with nulls. Column dtypes are inferred as by ColumnarStorage, a column promoted
+    by a later chunk (i8 -> f8 -> str) has what was already written rewritten once.
+'''
+
+CHUNK_SIZE = 32 * 1024 * 1024 # In bytes
+MAX_NUMBER_LENGTH = 64 # Longer fields are never parsed as numbers
+
+NEWLINE = ord("\n")
+COMMA = ord(",")
+
+TS_INDEX_DTYPE = "<f8,<i8" # TS_INDEX_RECORD, receipt time and byte offset of the line
+
+def convert_csv(data_dir, out_dir, chunk_size=CHUNK_SIZE):
+    '''
+        Converts the data.csv files (or partitions) of data_dir and of its per-worker and shard directories into
+        columns under the same directories of out_dir, which may be data_dir itself. Returns (rows, bytes) read.
+    '''
+    if np is None:
+        raise ImportError("numpy is required to convert data")
+
+    rows, size = 0, 0
+
+    for directory in worker_data_dirs(data_dir):
+        out = path.join(out_dir, path.relpath(directory, data_dir))
+        os.makedirs(out, exist_ok=True)
+
+        has_schema = any([path.exists(path.join(directory, name)) for name in (SCHEMA_FILE, "header.csv")])
+        converter = _DirectoryConverter(directory, out) if has_schema else None
+
+        # Readers of the columns find the per-worker and shard directories and the column names as in data_dir
+        for name in (SHARDS_FILE, SCHEMA_FILE, "header.csv"):
+            if path.exists(path.join(directory, name)) and not path.samefile(directory, out):
+                shutil.copyfile(path.join(directory, name), path.join(out, name))
+
+        if converter is None:
+            continue
+
+        try:
+            for file_path in data_files(directory, "data", "csv"):
+                logging.info(f"Converting {file_path}")
+                size += path.getsize(file_path)
+
+                chunks = _read_compressed_chunks(file_path, chunk_size) if file_path.endswith(COMPRESSED_EXT) else _read_chunks(file_path, chunk_size)
+                for chunk, received in chunks:
+                    converter.convert(chunk, received)
+
+            rows += converter.finish()
+
+        finally:
+            converter.close()
+
+    return rows, size
+
+def _read_chunks(file_path, chunk_size):
+    # Yields (complete lines, receipt time of every line) of a data file, in chunks of about chunk_size bytes
+    index_path = ts_index_path(file_path)
+    index_rows = path.getsize(index_path) // TS_INDEX_RECORD.size if path.exists(index_path) else 0
+    index = np.memmap(index_path, dtype=TS_INDEX_DTYPE, mode="r", shape=(index_rows,)) if index_rows else None
+
+    with open(file_path, "rb") as f:
+        offset = 0
+        rest = b""
+
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+
+            chunk = rest + data
+            end = chunk.rfind(b"\n") + 1
+            chunk, rest = chunk[:end], chunk[end:]
+            if not chunk: # Line longer than chunk_size
+                continue
+
+            yield chunk, _receipt_times(index, offset, chunk)
+            offset += len(chunk)
+
+    if rest:
+        logging.warning(f"Skipped incomplete last line of {file_path}")
+
+def _receipt_times(index, offset, chunk):
+    # Lines are matched to their index records by byte offset, lines without one (e.g. written before the
+    # timestamp index existed) get NaN
+    starts = offset + np.concatenate(([0], np.flatnonzero(np.frombuffer(chunk, np.uint8) == NEWLINE)[:-1] + 1))
+    received = np.full(len(starts), np.nan)
+
+    if index is not None:
+        offsets = index["f1"]
+        positions = np.minimum(np.searchsorted(offsets, starts), len(offsets) - 1)
+        found = offsets[positions] == starts
+        received[found] = index["f0"][positions[found]]
+
+    return received
+
+def _read_compressed_chunks(file_path, chunk_size):
+    # Compressed partitions hold the receipt times of every block's lines in the block itself, see compress_file
+    with open(block_index_path(file_path), "rb") as f:
+        blocks = list(BLOCK_INDEX_RECORD.iter_unpack(f.read()))
+
+    with open(file_path, "rb") as f:
+        lines, times, size = [], [], 0
+
+        for _, _, offset, block_size, rows in blocks:
+            f.seek(offset)
+            block = zlib.decompress(f.read(block_size))
+            times.append(np.frombuffer(block, dtype="<f8", count=rows))
+            lines.append(block[rows * 8:])
+            size += len(block)
+
+            if size >= chunk_size:
+                yield b"".join(lines), np.concatenate(times)
+                lines, times, size = [], [], 0
+
+        if lines:
+            yield b"".join(lines), np.concatenate(times)
+
+class _DirectoryConverter:
+    '''
+        Writes the columns of one data directory's rows, as chunks of them are converted
+    '''
+
+    def __init__(self, data_dir, out_dir):
+        self.out_dir = out_dir
+        self.schema = SchemaRegistry(data_dir, read_only=True) # Never writes to the source directory
+
+        directory = columns_dir(out_dir)
+        if path.exists(path.join(directory, MANIFEST_FILE)):
+            raise ValueError(f"{directory} already holds columns")
+        os.makedirs(directory, exist_ok=True)
+
+        self.columns = [_ColumnFile(directory, i) for i in range(len(self.schema.columns))]
+        self.timestamps = open(path.join(directory, TIMESTAMPS_FILE), "wb")
+        self.rows = 0
+        self.wide_rows = 0
+
+    def convert(self, chunk, received):
+        '''
+            Appends the rows of chunk (bytes of complete lines) and their receipt times
+        '''
+        rows = chunk.count(b"\n")
+
+        if not self._convert_uniform(chunk, rows):
+            self._convert_fields(chunk, rows)
+
+        received.tofile(self.timestamps)
+        self.rows += rows
+
+    def _convert_uniform(self, chunk, rows):
+        # Rows of the same width with only numbers, the common case once the schema settles, are parsed by
+        # loadtxt at once. Returns False (without writing anything) for anything it cannot parse, e.g. nulls or
+        # rows of another width.
+        width = chunk.count(b",", 0, chunk.index(b"\n")) + 1
+        if width > len(self.columns):
+            return False
+
+        columns = self.columns[:width]
+        if any([column.dtype == "str" for column in columns]):
+            return False
+
+        dtype = np.dtype([(f"c{i}", column.dtype) for i, column in enumerate(columns)])
+        try:
+            parsed = np.loadtxt(io.BytesIO(chunk), dtype=dtype, delimiter=",", comments=None, ndmin=1)
+        except (ValueError, UnicodeDecodeError):
+            return False
+
+        if len(parsed) != rows: # Blank lines (single empty fields) are skipped by loadtxt
+            return False
+
+        if any([column.dtype == "i8" and (parsed[f"c{i}"] == INT_NULL).any() for i, column in enumerate(columns)]): # Would read back as null
+            return False
+
+        for i, column in enumerate(self.columns):
+            column.append(parsed[f"c{i}"] if i < width else _nulls(rows, column.dtype))
+
+        return True
+
+    def _convert_fields(self, chunk, rows):
+        buf = np.frombuffer(chunk, np.uint8)
+        is_newline = buf == NEWLINE
+        separators = np.flatnonzero(is_newline | (buf == COMMA))
+
+        # Field i of the chunk spans field_starts[i]:separators[i], a row spans its first field to its newline
+        field_starts = np.concatenate(([0], separators[:-1] + 1))
+        last_fields = np.flatnonzero(is_newline[separators])
+        first_fields = np.concatenate(([0], last_fields[:-1] + 1))
+        widths = last_fields - first_fields + 1
+
+        self.wide_rows += int(np.count_nonzero(widths > len(self.columns)))
+
+        padded = np.frombuffer(chunk + bytes(MAX_NUMBER_LENGTH), np.uint8) # Numbers are read MAX_NUMBER_LENGTH bytes at a time
+
+        for i, column in enumerate(self.columns):
+            has_field = widths > i
+            if has_field.all():
+                has_field = None
+                fields = first_fields + i
+            else:
+                fields = first_fields[has_field] + i
+
+            starts = field_starts[fields]
+            column.append_fields(padded, starts, separators[fields] - starts, has_field, rows)
+
+    def finish(self):
+        '''
+            Writes the manifest of the converted columns, returns the number of rows
+        '''
+        if self.wide_rows:
+            logging.error(f"{self.wide_rows} row(s) in {self.out_dir} had more fields than the schema has columns, the extra fields were skipped.")
+
+        for column in self.columns:
+            column.flush()
+        self.timestamps.flush()
+
+        manifest = {
+            "rows": self.rows,
+            "byteorder": sys.byteorder,
+            "schema_version": self.schema.version,
+            "columns": {},
+            "timestamps": {"file": TIMESTAMPS_FILE, "rows": self.rows},
+        }
+        for key, column in zip(self.schema.columns, self.columns):
+            version = bisect_right(self.schema.widths, column.index) # Version that added the column
+            manifest["columns"][key] = {
+                "index": column.index,
+                "start_row": 0,
+                "segments": [{"file": column.file, "dtype": column.dtype, "start_row": 0, "rows": column.rows, "schema_version": version}],
+            }
+
+        write_manifest(self.out_dir, manifest, fsync=True)
+        return self.rows
+
+    def close(self):
+        for column in self.columns:
+            column.close()
+        self.timestamps.close()
+
+class _ColumnFile:
+    '''
+        Single segment of a column being converted, rewritten when the column is promoted
+    '''
+
+    REWRITE_ROWS = 1000000 # Rows converted at a time when promoting
+
+    def __init__(self, directory, index):
+        self.directory = directory
+        self.index = index
+        self.dtype = "i8" # Until a value says otherwise, nulls only are stored as i8 like ColumnarStorage does
+        self.rows = 0
+        self.offset = 0 # Of the end of the strings so far
+        self._open()
+
+    @property
+    def file(self):
+        return f"c{self.index}_0" + ("" if self.dtype == "str" else f".{self.dtype}")
+
+    def _open(self):
+        segment_path = path.join(self.directory, self.file)
+        if self.dtype == "str":
+            self._files = (open(segment_path + ".str", "wb"), open(segment_path + ".off", "wb"))
+        else:
+            self._files = (open(segment_path, "wb"),)
+
+    def append(self, values):
+        '''
+            Appends an array of values of the column's (numeric) dtype, nulls included
+        '''
+        np.ascontiguousarray(values, dtype=self.dtype).tofile(self._files[0])
+        self.rows += len(values)
+
+    def append_strings(self, data, lengths):
+        '''
+            Appends strings given as their concatenated utf-8 bytes and the length of every string
+        '''
+        self._files[0].write(data)
+        (self.offset + np.cumsum(lengths, dtype=np.int64)).tofile(self._files[1])
+        self.offset += len(data)
+        self.rows += len(lengths)
+
+    def append_fields(self, padded, starts, lengths, has_field, rows):
+        '''
+            Appends rows values, parsed from the fields of padded (chunk bytes) at starts, of lengths. Rows without
+            the field (has_field False, None if all have it) are null.
+        '''
+        dtype, values = _parse_fields(padded, starts, lengths, self.dtype)
+        if dtype != self.dtype:
+            self.promote(dtype)
+
+        if dtype == "str":
+            if has_field is not None:
+                all_lengths = np.zeros(rows, dtype=np.int64)
+                all_lengths[has_field] = lengths
+                lengths = all_lengths
+            self.append_strings(values, lengths)
+
+        elif has_field is not None:
+            all_values = _nulls(rows, dtype)
+            all_values[has_field] = values
+            self.append(all_values)
+
+        else:
+            self.append(values)
+
+    def promote(self, dtype):
+        '''
+            Rewrites the values appended so far as dtype
+        '''
+        logging.debug(f"Promoting column {self.index} from {self.dtype} to {dtype} after {self.rows} row(s)")
+
+        self.flush()
+        self.close()
+        old_path, old_dtype, rows = path.join(self.directory, self.file), self.dtype, self.rows
+
+        self.dtype, self.rows, self.offset = dtype, 0, 0
+        self._open()
+
+        if rows:
+            old = np.memmap(old_path, dtype=old_dtype, mode="r", shape=(rows,))
+            for start in range(0, rows, self.REWRITE_ROWS):
+                values = old[start:start + self.REWRITE_ROWS]
+                nulls = values == INT_NULL if old_dtype == "i8" else np.isnan(values)
+
+                if dtype == "str":
+                    texts = np.where(nulls, b"", values.astype("S"))
+                    lengths = np.strings.str_len(texts)
+                    data = texts.view(np.uint8).reshape(len(texts), -1)[np.arange(texts.itemsize) < lengths[:, None]]
+                    self.append_strings(data.tobytes(), lengths)
+                else:
+                    self.append(np.where(nulls, np.nan, values))
+            del old
+
+        os.remove(old_path)
+
+    def flush(self):
+        for f in self._files:
+            f.flush()
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+def _parse_fields(padded, starts, lengths, dtype):
+    '''
+        Returns (dtype at least as wide as dtype that holds all fields, values), values an array of the fields as
+        numbers (empty fields as nulls) or for strings the concatenated bytes of the fields
+    '''
+    present = lengths > 0
+    parsed = None
+
+    if dtype != "str" and present.any():
+        longest = int(lengths.max())
+        if longest > MAX_NUMBER_LENGTH:
+            dtype = "str"
+        else:
+            texts = _gather(padded, starts[present], lengths[present], longest)
+
+            if dtype == "i8":
+                try:
+                    parsed = texts.astype(np.int64)
+                except (ValueError, OverflowError):
+                    dtype = "f8"
+                else:
+                    if (parsed == INT_NULL).any(): # Would read back as null, as in ColumnarStorage
+                        dtype = "f8"
+
+            if dtype == "f8":
+                try:
+                    parsed = texts.astype(np.float64)
+                except ValueError:
+                    dtype = "str"
+
+    if dtype != "str":
+        values = _nulls(len(lengths), dtype)
+        if parsed is not None:
+            values[present] = parsed
+        return dtype, values
+
+    # Concatenation of the byte ranges of the fields
+    total = int(lengths.sum())
+    ends = np.cumsum(lengths)
+    positions = np.arange(total) + np.repeat(starts - (ends - lengths), lengths)
+    return dtype, padded[positions].tobytes()
+
+def _gather(padded, starts, lengths, width):
+    # Returns the fields as a fixed width bytes array, which NumPy parses as Python's int() and float() do
+    texts = padded[starts[:, None] + np.arange(width)]
+    texts[np.arange(width) >= lengths[:, None]] = 0
+    return texts.view(f"S{width}").ravel()
+
+def _nulls(rows, dtype):
+    return np.full(rows, INT_NULL if dtype == "i8" else np.nan, dtype=dtype)
@@ -1,8 +1,88 @@
 #!/usr/bin/env python3
 
+import asyncio
+import bisect
+import json
 import logging
+import os
+import queue
+import struct
+import threading
+import time
+import urllib.parse
+import zlib
 from os import path
 
+WORKER_DIR_PREFIX = "worker-"
+SHARD_DIR_PREFIX = "shard-"
+SHARDS_FILE = "shards.json"
+
+def worker_data_dir(data_dir, worker_idx):
+    return path.join(data_dir, f"{WORKER_DIR_PREFIX}{worker_idx}/")
+
+def worker_data_dirs(data_dir):
+    '''
+        Returns data_dir followed by the per-worker directories under it, each followed by its shard directories
+        (see read_shards), which readers merge
+    '''
+    if not path.isdir(data_dir):
+        return [data_dir]
+
+    directories = [data_dir] + [
+        path.join(data_dir, name + "/") for name in sorted(os.listdir(data_dir))
+        if name.startswith(WORKER_DIR_PREFIX) and path.isdir(path.join(data_dir, name))
+    ]
+
+    return [shard_dir for directory in directories for shard_dir in [directory] + shard_data_dirs(directory)]
+
+def shard_dir_name(value, shards=0):
+    '''
+        Returns the name of the shard directory of records whose shard key is value: one directory per value, or
+        one of shards directories by hash of the value
+    '''
+    if shards > 0:
+        return f"{SHARD_DIR_PREFIX}{zlib.crc32(value.encode('utf-8')) % shards}"
+
+    return SHARD_DIR_PREFIX + urllib.parse.quote(value, safe="")
+
+def read_shards(data_dir):
+    '''
+        Returns the shard manifest of data_dir, dict of shard_key, shards (0 for one directory per value) and
+        directories (names of the shard directories under data_dir), or None if data_dir is not sharded
+    '''
+    try:
+        with open(path.join(data_dir, SHARDS_FILE), "r") as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return None
+
+def write_shards(data_dir, manifest, fsync=False):
+    manifest_path = path.join(data_dir, SHARDS_FILE)
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+    os.replace(manifest_path + ".tmp", manifest_path) # Atomic, readers never see a partially written manifest
+
+def shard_data_dirs(data_dir, value=None):
+    '''
+        Returns the shard directories under data_dir, or only the one that holds the records of shard key value
+    '''
+    manifest = read_shards(data_dir)
+    if manifest is None:
+        return []
+
+    names = manifest["directories"]
+    if value is not None:
+        name = shard_dir_name(value, manifest["shards"])
+        names = [name] if name in names else []
+
+    return [path.join(data_dir, name + "/") for name in names]
+
 def read_header_file(data_dir):
     if not path.exists(path.join(data_dir, "header.csv")):
         write_header_file(data_dir, []) # Create header file first if it does not exist
@@ -27,6 +107,27 @@ def write_header_file(data_dir, header):
 
     return True
 
+def extend_header_file(data_dir, keys):
+    '''
+        Appends columns to the header file in place, without rewriting it
+    '''
+    header_path = path.join(data_dir, "header.csv")
+    if not path.exists(header_path) or path.getsize(header_path) <= 1: # Missing or empty header
+        return write_header_file(data_dir, keys)
+
+    try:
+        with open(header_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                f.seek(-1, os.SEEK_END)
+            f.write(("," + ",".join(keys) + "\n").encode("utf-8"))
+
+    except OSError as e:
+        logging.error(f"{e}. Error extending header file.")
+        return False
+
+    return True
+
 def append_data_file(data_dir, data):
     try:
         with open(path.join(data_dir, f"data.csv"), "a+") as f:
@@ -50,3 +151,774 @@ def append_log_data_file(log_data_dir, log_data):
         return False
 
     return True
+
+class _WriteBatch:
+
+    __slots__ = ("items", "size", "done", "ok", "waiters")
+
+    def __init__(self):
+        self.items = []
+        self.size = 0
+        self.done = False
+        self.ok = False
+        self.waiters = [] # (event loop, future) of wait_async
+
+def _set_result(future, result):
+    if not future.done(): # Cancelled, e.g. its connection was closed
+        future.set_result(result)
+
+class Commit:
+    '''
+        The batches of the GroupCommitWriters a write was appended to, durable once all of them are written. ok is
+        False if the write could not even be appended.
+    '''
+
+    def __init__(self, batches=(), ok=True):
+        self.batches = list(batches) # (writer, batch)
+        self.ok = ok
+
+    @property
+    def done(self):
+        return all([writer.durability == "none" or batch.done for writer, batch in self.batches])
+
+    def add(self, commit):
+        self.batches.extend(commit.batches)
+        self.ok = self.ok and commit.ok
+        return self
+
+    def wait(self):
+        '''
+            Blocks until all batches are durable, returns True if the write was stored
+        '''
+        ok = self.ok
+        for writer, batch in self.batches:
+            ok = writer.wait(batch) and ok
+        return ok
+
+    async def wait_async(self):
+        '''
+            Like wait, in an event loop without holding a thread
+        '''
+        results = await asyncio.gather(*[writer.wait_async(batch) for writer, batch in self.batches])
+        return self.ok and all(results)
+
+class GroupCommitWriter:
+    '''
+        Buffers items in memory and group-commits them from a background thread.
+
+        Items are flushed once flush_size bytes are buffered or every flush_interval seconds. The durability
+        level decides when a write is acknowledged:
+            none   - as soon as the item is buffered, no fsync
+            flush  - once the batch containing the item is written and fsynced
+            record - the item is written and fsynced right away (concurrent writers share the fsync)
+
+        Subclasses implement _write_batch(items), which is never called concurrently.
+    '''
+
+    DURABILITIES = ("none", "flush", "record")
+
+    def __init__(self, flush_size=65536, flush_interval=1.0, durability="none"):
+        if durability not in self.DURABILITIES:
+            raise ValueError(f"Unknown durability level: {durability}")
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+
+        self._batch = _WriteBatch()
+        self._lock = threading.RLock() # Reentrant so subclasses can prepare items under it, see BufferedFileWriter.append
+        self._io_lock = threading.Lock() # Serializes flushes, held without self._lock so writers can keep buffering
+        self._flushed = threading.Condition(self._lock)
+        self._flush_requested = threading.Event()
+        self._closed = False
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def append(self, items):
+        '''
+            Buffers items, returns the batch to pass to wait() or wait_async()
+        '''
+        if not items: # Nothing to flush, so it would not be marked done before the next write
+            batch = _WriteBatch()
+            batch.done = batch.ok = True
+            return batch
+
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"{type(self).__name__} is closed")
+
+            batch = self._batch
+            batch.items.extend(items)
+            batch.size += sum([self._item_size(item) for item in items])
+
+            if batch.size >= self.flush_size:
+                self._flush_requested.set()
+
+        return batch
+
+    def wait(self, batch):
+        '''
+            Blocks until batch is durable according to the durability level, returns True if it was written successfully
+        '''
+        if self.durability == "none":
+            return True
+
+        if self.durability == "record" and not batch.done:
+            self.flush()
+
+        with self._flushed:
+            while not batch.done:
+                self._flushed.wait()
+
+        return batch.ok
+
+    def wait_async(self, batch):
+        '''
+            Returns a future of the running event loop, resolved from the flushing thread with what wait(batch) would
+            return once batch is durable. No thread waits for it meanwhile.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        with self._flushed:
+            if self.durability == "none" or batch.done:
+                future.set_result(self.durability == "none" or batch.ok)
+                return future
+
+            batch.waiters.append((loop, future))
+
+        if self.durability == "record": # Flushed right away by the flushing thread, concurrent writers share the fsync
+            self._flush_requested.set()
+
+        return future
+
+    def write(self, items):
+        return self.wait(self.append(items))
+
+    def flush(self):
+
+        with self._io_lock:
+            with self._lock:
+                batch = self._batch
+                if not batch.items:
+                    return True
+                self._batch = _WriteBatch()
+
+            ok = False
+            try:
+                ok = self._write_batch(batch.items)
+            except Exception as e: # A bug of _write_batch must neither stop the flushing thread nor leave waiters hanging
+                logging.error(f"{e}. Error flushing {len(batch.items)} item(s) with {type(self).__name__}.")
+            finally:
+                with self._flushed:
+                    batch.ok = ok
+                    batch.done = True
+                    self._flushed.notify_all()
+
+                for loop, future in batch.waiters:
+                    try:
+                        loop.call_soon_threadsafe(_set_result, future, ok)
+                    except RuntimeError: # Event loop closed
+                        pass
+
+        return ok
+
+    def close(self):
+
+        with self._lock:
+            self._closed = True
+
+        self._flush_requested.set()
+        self._flusher.join()
+        self.flush()
+
+    def _item_size(self, item):
+        return len(item)
+
+    def _write_batch(self, items):
+        '''
+            Returns True if all items were written
+        '''
+        raise NotImplementedError
+
+    def _flush_periodically(self):
+
+        while not self._closed:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+TS_INDEX_RECORD = struct.Struct("<dq") # Receipt time, byte offset of the row in the data file
+
+def ts_index_path(file_path):
+    return file_path + ".tsidx"
+
+def token_index_path(file_path):
+    return file_path + ".tokidx"
+
+class BufferedFileWriter(GroupCommitWriter):
+    '''
+        Long-lived appender that keeps its file open and group-commits buffered lines (without trailing newline).
+
+        With ts_index, every line's receipt time and byte offset are appended to <file>.tsidx as fixed-size records,
+        so readers can binary search the index for a time and seek straight to the row. With token_index (requires
+        ts_index), the tokens of every line are also indexed in <file>.tokidx, see util.token_index.
+    '''
+
+    def __init__(self, file_path, flush_size=65536, flush_interval=1.0, durability="none", ts_index=False, token_index=False):
+        if token_index and not ts_index:
+            raise ValueError("A token index requires a timestamp index")
+
+        self.file_path = file_path
+        self.ts_index = ts_index
+        self.token_index = token_index
+        self._file = None
+        self._index_file = None
+        self._token_index = None
+        self._rows = 0
+        self._last_received = 0.0
+
+        super().__init__(flush_size=flush_size, flush_interval=flush_interval, durability=durability)
+
+    def append(self, lines, received=None):
+        '''
+            Buffers lines indexed at receipt time received (now if None), which must not decrease between calls
+        '''
+        if received is not None:
+            return super().append([(received, line) for line in lines])
+
+        with self._lock: # Stamped in the order lines are buffered, so concurrent appends never index decreasing times
+            received = self._last_received = max(time.time(), self._last_received)
+            return super().append([(received, line) for line in lines])
+
+    def close(self):
+        super().close()
+        self._close_file()
+
+    def _item_size(self, item):
+        return len(item[1]) + 1
+
+    def _write_batch(self, items):
+        try:
+            self._write_items(items)
+            self._sync()
+
+        except OSError as e:
+            logging.error(f"{e}. Error flushing {len(items)} line(s) to {self.file_path}.")
+            self._close_file()
+            return False
+
+        return True
+
+    def _write_items(self, items):
+        '''
+            Writes items to the current file (and index), returns the number of bytes written
+        '''
+        if self._file is None:
+            self._file = open(self.file_path, "ab") # Positioned at the end of the file
+            if self.ts_index:
+                self._index_file = open(ts_index_path(self.file_path), "ab")
+                self._rows = self._index_file.tell() // TS_INDEX_RECORD.size
+            if self.token_index:
+                from util.token_index import TokenIndexWriter
+                self._token_index = TokenIndexWriter(self.file_path, rows=self._rows)
+
+        lines = [(line + "\n").encode("utf-8") for _, line in items]
+
+        if self.ts_index:
+            offset = self._file.tell()
+            index = bytearray()
+            for (received, _), line in zip(items, lines):
+                index += TS_INDEX_RECORD.pack(received, offset)
+                offset += len(line)
+            self._index_file.write(index)
+
+        if self._token_index is not None: # Rows are numbered by their position in the timestamp index
+            self._token_index.add(self._rows, [line for _, line in items])
+        self._rows += len(items)
+
+        data = b"".join(lines)
+        self._file.write(data)
+
+        return len(data)
+
+    def _sync(self):
+        for f in (self._file, self._index_file):
+            if f is not None:
+                f.flush()
+                if self.durability != "none":
+                    os.fsync(f.fileno())
+
+    def _close_file(self):
+        for f in (self._file, self._index_file, self._token_index):
+            try:
+                if f is not None:
+                    f.close()
+            except OSError:
+                pass
+
+        self._file = None
+        self._index_file = None
+        self._token_index = None
+
+def find_ts_index(index_path, timestamp):
+    '''
+        Returns the position of the first index record received at or after timestamp, by binary search on the file
+    '''
+    with open(index_path, "rb") as f:
+        low, high = 0, path.getsize(index_path) // TS_INDEX_RECORD.size
+
+        while low < high:
+            mid = (low + high) // 2
+            f.seek(mid * TS_INDEX_RECORD.size)
+            received, _ = TS_INDEX_RECORD.unpack(f.read(TS_INDEX_RECORD.size))
+
+            if received < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+
+    return low
+
+def read_indexed_lines(file_path, start=None, end=None, chunk_rows=1000):
+    '''
+        Yields lists of (receipt time, line) received between start and end, at most chunk_rows at a time.
+        Seeks to start through <file>.tsidx, lines without an index record are skipped. Compressed files are read
+        through their block index instead, see read_compressed_lines.
+    '''
+    if file_path.endswith(COMPRESSED_EXT):
+        yield from read_compressed_lines(file_path, start=start, end=end, chunk_rows=chunk_rows)
+        return
+
+    index_path = ts_index_path(file_path)
+    if not path.exists(index_path):
+        logging.debug(f"No timestamp index for {file_path}")
+        return
+
+    position = find_ts_index(index_path, start) if start is not None else 0
+
+    with open(index_path, "rb") as index_file, open(file_path, "rb") as data_file:
+        index_file.seek(position * TS_INDEX_RECORD.size)
+
+        first = True
+        while True:
+            index = index_file.read(chunk_rows * TS_INDEX_RECORD.size)
+            index = index[:len(index) - len(index) % TS_INDEX_RECORD.size]
+            if not index:
+                return
+
+            chunk = []
+            for received, offset in TS_INDEX_RECORD.iter_unpack(index):
+                if end is not None and received > end:
+                    if chunk:
+                        yield chunk
+                    return
+
+                if first: # Rows are contiguous from here on, only seek once
+                    data_file.seek(offset)
+                    first = False
+
+                line = data_file.readline()
+                if not line.endswith(b"\n"): # Index is ahead of the data (e.g. interrupted flush)
+                    if chunk:
+                        yield chunk
+                    return
+
+                chunk.append((received, line[:-1].decode("utf-8")))
+
+            yield chunk
+
+COMPRESSED_EXT = ".z"
+BLOCK_INDEX_RECORD = struct.Struct("<ddqqq") # First and last receipt time, byte offset and size of the block, rows
+
+def block_index_path(file_path):
+    return file_path + ".blkidx"
+
+def compress_file(file_path, out_path, block_size=65536, level=6):
+    '''
+        Compresses a file written with ts_index into independent zlib blocks of about block_size bytes of lines.
+        A block holds the receipt times of its rows (little-endian float64) followed by the rows. <out>.blkidx
+        holds one BLOCK_INDEX_RECORD per block, so readers only decompress the blocks of the time range they need.
+        Returns the compressed size in bytes. The index and the data are both read as they are compressed.
+    '''
+    with open(ts_index_path(file_path), "rb") as index_file, open(file_path, "rb") as data_file, open(out_path + ".tmp", "wb") as out_file, open(block_index_path(out_path) + ".tmp", "wb") as block_index_file:
+        times = []
+        lines = []
+        size = 0
+
+        for received, _ in _iter_index(index_file):
+            line = data_file.readline()
+            if not line.endswith(b"\n"): # Index is ahead of the data (e.g. interrupted flush)
+                break
+
+            times.append(received)
+            lines.append(line)
+            size += len(line)
+
+            if size >= block_size:
+                _write_block(out_file, block_index_file, times, lines, level)
+                times, lines, size = [], [], 0
+
+        if lines:
+            _write_block(out_file, block_index_file, times, lines, level)
+
+        compressed_size = out_file.tell()
+
+    os.replace(block_index_path(out_path) + ".tmp", block_index_path(out_path))
+    os.replace(out_path + ".tmp", out_path)
+
+    return compressed_size
+
+def _iter_index(index_file, chunk_records=65536):
+    # Yields the TS_INDEX_RECORDs of index_file, reading chunk_records of them at a time
+    while True:
+        index = index_file.read(chunk_records * TS_INDEX_RECORD.size)
+        index = index[:len(index) - len(index) % TS_INDEX_RECORD.size] # Partial record at the end of the file
+        if not index:
+            return
+
+        yield from TS_INDEX_RECORD.iter_unpack(index)
+
+def _write_block(out_file, block_index_file, times, lines, level):
+    block = zlib.compress(struct.pack(f"<{len(times)}d", *times) + b"".join(lines), level)
+    block_index_file.write(BLOCK_INDEX_RECORD.pack(times[0], times[-1], out_file.tell(), len(block), len(times)))
+    out_file.write(block)
+
+def read_compressed_lines(file_path, start=None, end=None, chunk_rows=1000):
+    '''
+        Yields lists of (receipt time, line) of a compress_file() output received between start and end, at most
+        chunk_rows at a time. Binary searches the block index for start and only decompresses the blocks in range.
+    '''
+    with open(block_index_path(file_path), "rb") as f:
+        blocks = list(BLOCK_INDEX_RECORD.iter_unpack(f.read())) # One record per block, small enough to load
+
+    position = bisect.bisect_left([last for _, last, _, _, _ in blocks], start) if start is not None else 0
+
+    with open(file_path, "rb") as f:
+        chunk = []
+
+        for first, _, offset, size, rows in blocks[position:]:
+            if end is not None and first > end:
+                break
+
+            f.seek(offset)
+            block = zlib.decompress(f.read(size))
+            times = struct.unpack_from(f"<{rows}d", block)
+            lines = block[rows * 8:].split(b"\n")
+
+            for received, line in zip(times, lines):
+                if start is not None and received < start:
+                    continue
+
+                if end is not None and received > end:
+                    if chunk:
+                        yield chunk
+                    return
+
+                chunk.append((received, line.decode("utf-8")))
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+
+        if chunk:
+            yield chunk
+
+PARTITION_SECONDS = {"none": 0, "hourly": 3600, "daily": 86400}
+
+def partitions_path(directory, name):
+    return path.join(directory, f"{name}.partitions.json")
+
+def read_partitions(directory, name):
+    '''
+        Returns the partition manifest, partitions are dicts of id, file, start, end (receipt times), rows and bytes,
+        plus compressed_bytes once compressed
+    '''
+    try:
+        with open(partitions_path(directory, name), "r") as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return {"next_id": 0, "partitions": []}
+
+def write_partitions(directory, name, manifest, fsync=False):
+    manifest_path = partitions_path(directory, name)
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+    os.replace(manifest_path + ".tmp", manifest_path) # Atomic, readers never see a partially written manifest
+
+def select_partitions(directory, name, start=None, end=None):
+    '''
+        Returns paths of the partitions holding data received between start and end (epoch seconds), oldest first
+    '''
+    return [
+        path.join(directory, partition["file"]) for partition in read_partitions(directory, name)["partitions"]
+        if (start is None or partition["end"] >= start) and (end is None or partition["start"] <= end)
+    ]
+
+class PartitionedFileWriter(BufferedFileWriter):
+    '''
+        BufferedFileWriter that splits <name>.<ext> into partitions/<name>-<id>-<start time>.<ext> files.
+
+        A new partition is started every hour/day (UTC, by receipt time) and/or before the current one would
+        exceed partition_size bytes (a longer line gets a partition of its own). <name>.partitions.json records each partition's time range, row and byte count.
+        With a retention (in seconds), partitions whose newest row is older than that are deleted whole. With a
+        retention_size (in bytes), the oldest partitions are deleted while all of them take more than that on disk.
+
+        With compress (requires ts_index), partitions are compressed by a background thread once closed, see
+        compress_file. The compressed file replaces the partition's file in the manifest.
+    '''
+
+    def __init__(self, directory, name, ext, flush_size=65536, flush_interval=1.0, durability="none", ts_index=False, partition="daily", partition_size=0, retention=0, retention_size=0, compress=False, token_index=False):
+        if partition not in PARTITION_SECONDS:
+            raise ValueError(f"Unknown partitioning: {partition}")
+
+        if compress and not ts_index:
+            raise ValueError("Compressed partitions require a timestamp index")
+
+        self.directory = directory
+        self.name = name
+        self.ext = ext
+        self.partition_seconds = PARTITION_SECONDS[partition]
+        self.partition_size = partition_size
+        self.retention = retention
+        self.retention_size = retention_size
+        self.compress = compress
+
+        os.makedirs(path.join(self.directory, "partitions"), exist_ok=True)
+        self.manifest = read_partitions(self.directory, self.name)
+        self._partition = None
+
+        if self.manifest["partitions"]: # Resume the newest partition, dropping anything written after its last manifest update
+            self._partition = self.manifest["partitions"][-1]
+            file_path = path.join(self.directory, self._partition["file"])
+            _truncate(file_path, self._partition["bytes"])
+            _truncate(ts_index_path(file_path), self._partition["rows"] * TS_INDEX_RECORD.size)
+
+        super().__init__(None, flush_size=flush_size, flush_interval=flush_interval, durability=durability, ts_index=ts_index, token_index=token_index)
+
+        if self._drop_expired(time.time()): # Otherwise recorded with the next flush
+            write_partitions(self.directory, self.name, self.manifest)
+
+        if self.compress:
+            self._compress_queue = queue.SimpleQueue()
+            self._compressor = threading.Thread(target=self._compress_partitions, daemon=True)
+            self._compressor.start()
+
+            for partition in self.manifest["partitions"][:-1]: # Closed but not compressed yet (e.g. on crash)
+                if "compressed_bytes" not in partition:
+                    self._compress_queue.put(partition)
+
+    def close(self):
+        super().close()
+
+        if self.compress: # Only the partition being compressed is waited for, those still queued are compressed on the next start
+            while True:
+                try:
+                    self._compress_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            self._compress_queue.put(None)
+            self._compressor.join()
+
+    def _partition_key(self, timestamp):
+        return int(timestamp // self.partition_seconds) if self.partition_seconds else 0
+
+    def _needs_rotation(self, timestamp, size=0):
+        # size is the number of bytes about to be written, a partition holds at least one line whatever its size
+        if self._partition is None:
+            return True
+
+        if self._partition_key(timestamp) != self._partition_key(self._partition["start"]):
+            return True
+
+        return self.partition_size > 0 and self._partition["bytes"] > 0 and self._partition["bytes"] + size > self.partition_size
+
+    def _line_bytes(self, item):
+        return len(item[1].encode("utf-8")) + 1 if self.partition_size > 0 else 0
+
+    def _rotate(self, timestamp):
+        self._close_file()
+
+        if self.compress and self._partition is not None:
+            self._compress_queue.put(self._partition)
+
+        partition_id = self.manifest["next_id"]
+        self._partition = {
+            "id": partition_id,
+            "file": path.join("partitions", f"{self.name}-{partition_id:06d}-{time.strftime('%Y%m%dT%H%M%S', time.gmtime(timestamp))}.{self.ext}"),
+            "start": timestamp,
+            "end": timestamp,
+            "rows": 0,
+            "bytes": 0,
+        }
+        self.manifest["next_id"] = partition_id + 1
+        self.manifest["partitions"].append(self._partition)
+
+        self._drop_expired(timestamp)
+
+    def _drop_expired(self, now):
+        '''
+            Returns True if any partition was dropped
+        '''
+        partitions = self.manifest["partitions"]
+        count = len(partitions)
+
+        if self.retention > 0:
+            while len(partitions) > 1 and partitions[0]["end"] < now - self.retention: # Never drops the current partition
+                self._drop_partition(partitions.pop(0))
+
+        if self.retention_size > 0:
+            total = sum([_partition_size(partition) for partition in partitions])
+            while len(partitions) > 1 and total > self.retention_size:
+                total -= _partition_size(partitions[0])
+                self._drop_partition(partitions.pop(0))
+
+        return len(partitions) < count
+
+    def _drop_partition(self, partition):
+        logging.info(f"Dropping partition {partition['file']} past retention")
+        _remove_files(_partition_files(self.directory, partition))
+
+    def _compress_partitions(self):
+
+        while True:
+            partition = self._compress_queue.get()
+            if partition is None:
+                return
+
+            file_path = path.join(self.directory, partition["file"])
+
+            try:
+                compressed_bytes = compress_file(file_path, file_path + COMPRESSED_EXT)
+            except OSError as e:
+                logging.error(f"{e}. Error compressing partition {partition['file']}.")
+                continue
+
+            with self._io_lock: # The manifest is only changed while flushing
+                if partition not in self.manifest["partitions"]: # Dropped by retention meanwhile
+                    _remove_files([file_path + COMPRESSED_EXT, block_index_path(file_path + COMPRESSED_EXT)])
+                    continue
+
+                uncompressed_files = _partition_files(self.directory, partition)
+                uncompressed_files.remove(token_index_path(file_path))
+                partition["file"] += COMPRESSED_EXT
+                partition["compressed_bytes"] = compressed_bytes
+
+                try:
+                    write_partitions(self.directory, self.name, self.manifest, fsync=self.durability != "none")
+                except OSError as e:
+                    logging.error(f"{e}. Error recording compressed partition {partition['file']}.")
+                    partition["file"] = partition["file"][:-len(COMPRESSED_EXT)]
+                    del partition["compressed_bytes"]
+                    continue
+
+            if path.exists(token_index_path(file_path)): # Rows are the same in the compressed file
+                os.replace(token_index_path(file_path), token_index_path(file_path + COMPRESSED_EXT))
+
+            _remove_files(uncompressed_files)
+            logging.debug(f"Compressed partition {partition['file']} from {partition['bytes']} to {compressed_bytes} bytes")
+
+    def _write_batch(self, items):
+        try:
+            start = 0
+            while start < len(items):
+                size = self._line_bytes(items[start])
+                if self._needs_rotation(items[start][0], size):
+                    self._rotate(items[start][0])
+
+                # Write the run of items that belongs to the current partition and fits in partition_size
+                key = self._partition_key(self._partition["start"])
+                size += self._partition["bytes"]
+                end = start + 1
+                while end < len(items) and self._partition_key(items[end][0]) == key:
+                    if self.partition_size > 0:
+                        size += self._line_bytes(items[end])
+                        if size > self.partition_size:
+                            break
+                    end += 1
+
+                self.file_path = path.join(self.directory, self._partition["file"])
+                written = self._write_items(items[start:end])
+
+                self._partition["rows"] += end - start
+                self._partition["bytes"] += written
+                self._partition["end"] = items[end - 1][0]
+                start = end
+
+            self._sync()
+            write_partitions(self.directory, self.name, self.manifest, fsync=self.durability != "none")
+
+        except OSError as e:
+            logging.error(f"{e}. Error flushing {len(items)} line(s) to {self.name} partitions in {self.directory}.")
+            self._close_file()
+            return False
+
+        return True
+
+def _truncate(file_path, size):
+    if path.exists(file_path) and path.getsize(file_path) > size:
+        os.truncate(file_path, size)
+
+def _partition_size(partition):
+    return partition.get("compressed_bytes", partition["bytes"])
+
+def _partition_files(directory, partition):
+    file_path = path.join(directory, partition["file"])
+    if "compressed_bytes" in partition:
+        return [file_path, block_index_path(file_path), token_index_path(file_path)]
+    return [file_path, ts_index_path(file_path), token_index_path(file_path)]
+
+def _remove_files(file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+def create_file_writer(directory, name, ext, flush_size=65536, flush_interval=1.0, durability="none", ts_index=False, partition="none", partition_size=0, retention=0, retention_size=0, compress=False, token_index=False):
+    '''
+        Returns a writer for <directory>/<name>.<ext>, partitioned if partition or partition_size is set.
+        Retention and compression only apply to partitions.
+    '''
+    if partition == "none" and partition_size <= 0:
+        return BufferedFileWriter(
+            path.join(directory, f"{name}.{ext}"),
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            durability=durability,
+            ts_index=ts_index,
+            token_index=token_index)
+
+    return PartitionedFileWriter(
+        directory,
+        name,
+        ext,
+        flush_size=flush_size,
+        flush_interval=flush_interval,
+        durability=durability,
+        ts_index=ts_index,
+        partition=partition,
+        partition_size=partition_size,
+        retention=retention,
+        retention_size=retention_size,
+        compress=compress,
+        token_index=token_index)
+
+def data_files(directory, name, ext, start=None, end=None):
+    '''
+        Returns paths of the files holding <name>.<ext> data received between start and end, oldest first
+    '''
+    files = select_partitions(directory, name, start=start, end=end)
+
+    legacy_path = path.join(directory, f"{name}.{ext}") # Written before partitioning was enabled, time range unknown
+    if path.exists(legacy_path):
+        files.insert(0, legacy_path)
+
+    return files
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import collections
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+
+'''
+    Latest values of every key of every device with their receipt times, kept in memory so the current state of
+    a device never has to be read back from disk. A device is the value of device_key in its records ("" for all
+    records without device_key). With history > 1 the last history values of every key are kept, oldest first.
+'''
+
+class LatestValues:
+    '''
+        Table of the latest values of the process, updated from any of its threads
+    '''
+
+    def __init__(self, device_key="", history=1):
+        self.device_key = device_key
+        self.history = history
+
+        self._latest = {} # Device -> {key: (receipt time, value)}
+        self._history = {} # (device, key) -> deque of (receipt time, value), only with history > 1
+        self._lock = threading.Lock() # Readers see all values of a record or none of them
+
+    def update(self, records, received=None):
+        '''
+            Sets the values of records received at epoch seconds received (now if None) as their devices' latest,
+            returns the number of values that could not be kept (always 0 here)
+        '''
+        received = time.time() if received is None else received
+        device_key = self.device_key
+
+        with self._lock:
+            for data in records:
+                device = str(data.get(device_key, "")) if device_key else ""
+
+                latest = self._latest.get(device)
+                if latest is None:
+                    latest = self._latest[device] = {}
+
+                values = {key: (received, value) for key, value in data.items() if key != device_key}
+                latest.update(values)
+
+                if self.history > 1:
+                    for key, value in values.items():
+                        readings = self._history.get((device, key))
+                        if readings is None:
+                            readings = self._history[(device, key)] = collections.deque(maxlen=self.history)
+                        readings.append(value)
+
+        return 0
+
+    def latest(self, device, keys=None):
+        '''
+            Returns dict of key to (receipt time, value) of the latest values of device, for keys (all if None)
+        '''
+        with self._lock:
+            latest = self._latest.get(device, {})
+            if keys is None:
+                return dict(latest)
+
+            return {key: latest[key] for key in keys if key in latest}
+
+    def readings(self, device, key):
+        '''
+            Returns list of (receipt time, value) of the last history values of key of device, oldest first
+        '''
+        with self._lock:
+            if self.history > 1:
+                return list(self._history.get((device, key), ()))
+
+            latest = self._latest.get(device, {})
+            return [latest[key]] if key in latest else []
+
+    def close(self):
+        pass
+
+class SharedLatestValues:
+    '''
+        Table of the latest values in an anonymous shared memory mapping, so all worker processes forked after it
+        is created update and read the same table. It holds at most size (device, key) pairs and names (device
+        and key) and values of up to NAME_SIZE and VALUE_SIZE UTF-8 bytes, about size * (73 + 41 * history) bytes.
+
+        The table is an open addressing hash table of fixed-size slots that are never removed, one per (device,
+        key) with a ring of its last history values, and one per device that starts the chain of its keys' slots.
+        The values and the chain of a device are guarded by one of LOCK_STRIPES locks shared by the processes,
+        picked by the device, so processes only wait for each other on devices of the same stripe (readers see all
+        values of a record or none of them). Slots are added under a lock of their own, taken before the stripe.
+        Every process caches the slot of the pairs it has seen, and of the keys of the records of every device, so
+        updates and lookups are a dict get and a struct pack or unpack per value.
+    '''
+
+    NAME_SIZE = 64
+    VALUE_SIZE = 32
+
+    SLOT_HEADER = struct.Struct(f"<B{NAME_SIZE}siI") # Length of the name, name, next slot of the device's chain, writes
+    ENTRY = struct.Struct(f"<dB{VALUE_SIZE}s") # Receipt time, length of the value, value
+    NO_SLOT = -1
+    MAX_RECORDS = 1024 # Distinct (device, key sequence) pairs whose slots are cached
+    LOCK_STRIPES = 64
+
+    def __init__(self, device_key="", history=1, size=65536):
+        self.device_key = device_key
+        self.history = max(1, history)
+        self.capacity = 1 << max(size - 1, 1).bit_length() # Power of two, so probing wraps with a mask
+
+        self._slot_size = self.SLOT_HEADER.size + self.history * self.ENTRY.size
+        self._buf = mmap.mmap(-1, self.capacity * self._slot_size) # MAP_SHARED, inherited by forked processes
+        self._lock = multiprocessing.Lock() # Adding slots
+        self._stripes = [multiprocessing.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._slots = {} # (device, key) -> slot of this process's lookups, key "" for a device's chain
+        self._records = {} # (device, key sequence) -> (stripe, offsets of the slots of the keys)
+
+    def update(self, records, received=None):
+        '''
+            Sets the values of records received at epoch seconds received (now if None) as their devices' latest,
+            returns the number of values that could not be kept (table full, name or value too long)
+        '''
+        received = time.time() if received is None else received
+        device_key = self.device_key
+        dropped = 0
+
+        # Bound once, the loop runs for every value
+        buf, history, max_size = self._buf, self.history, self.VALUE_SIZE
+        entry_size, header_size = self.ENTRY.size, self.SLOT_HEADER.size
+        pack_entry, pack_header, unpack_header = self.ENTRY.pack_into, self.SLOT_HEADER.pack_into, self.SLOT_HEADER.unpack_from
+
+        for data in records:
+            device = str(data.get(device_key, "")) if device_key else ""
+
+            cached = self._records.get((device, tuple(data)))
+            if cached is None:
+                cached = self._add_record(device, tuple(data))
+            stripe, offsets = cached
+
+            with stripe:
+                for offset, value in zip(offsets, data.values()):
+                    if offset is None: # Device key, or a key that cannot be added
+                        continue
+
+                    encoded = value.encode("utf-8") if isinstance(value, str) else str(value).encode("utf-8")
+                    if len(encoded) > max_size:
+                        dropped += 1
+                        continue
+
+                    if history > 1:
+                        length, name, next_slot, writes = unpack_header(buf, offset)
+                        pack_header(buf, offset, length, name, next_slot, writes + 1)
+                        offset += writes % history * entry_size
+
+                    pack_entry(buf, offset + header_size, received, len(encoded), encoded)
+
+            if None in offsets:
+                dropped += offsets.count(None) - (device_key in data)
+
+        return dropped
+
+    def _add_record(self, device, keys):
+        # Returns the stripe of device and the offset of the slot of every key of the records of device with keys,
+        # None for the device key and keys that cannot be added. Cached, as devices send the same keys.
+        stripe = self._stripe(device)
+        offsets = []
+
+        with self._lock, stripe:
+            for key in keys:
+                slot = self._add_slot(device, key) if key != self.device_key else None
+                offsets.append(None if slot is None else slot * self._slot_size)
+
+        if len(self._records) >= self.MAX_RECORDS:
+            self._records.clear()
+        self._records[(device, keys)] = (stripe, offsets)
+
+        return stripe, offsets
+
+    def _stripe(self, device):
+        return self._stripes[zlib.crc32(device.encode("utf-8")) % self.LOCK_STRIPES]
+
+    def latest(self, device, keys=None):
+        '''
+            Returns dict of key to (receipt time, value) of the latest values of device, for keys (all if None)
+        '''
+        with self._stripe(device):
+            slots = self._chain(device) if keys is None else [(key, self._find_slot(device, key)) for key in keys]
+
+            latest = {}
+            for key, slot in slots:
+                readings = self._read(slot, 1)
+                if readings:
+                    latest[key] = readings[0]
+
+            return latest
+
+    def readings(self, device, key):
+        '''
+            Returns list of (receipt time, value) of the last history values of key of device, oldest first
+        '''
+        with self._stripe(device):
+            return self._read(self._find_slot(device, key), self.history)
+
+    def close(self):
+        # Only this process's mapping, the table lives on in the processes still mapping it
+        self._buf.close()
+
+    def _read(self, slot, count):
+        # Returns the last count readings of slot (None for none), oldest first. Called with the stripe held.
+        if slot is None:
+            return []
+
+        offset = slot * self._slot_size
+        _, _, _, writes = self.SLOT_HEADER.unpack_from(self._buf, offset)
+        if self.history == 1:
+            writes = 1 # Not counted
+
+        readings = []
+        for i in range(max(0, writes - min(count, self.history)), writes):
+            received, length, value = self.ENTRY.unpack_from(self._buf, offset + self.SLOT_HEADER.size + (i % self.history) * self.ENTRY.size)
+            if received: # Slots are added before their first value is written, which may be too long to keep
+                readings.append((received, value[:length].decode("utf-8")))
+
+        return readings
+
+    def _chain(self, device):
+        # Returns list of (key, slot) of the keys of device, in the order they were added. Called with the stripe held.
+        keys = []
+
+        slot = self._find_slot(device, "")
+        if slot is not None:
+            _, _, slot, _ = self.SLOT_HEADER.unpack_from(self._buf, slot * self._slot_size)
+
+        while slot is not None and slot != self.NO_SLOT:
+            length, name, next_slot, _ = self.SLOT_HEADER.unpack_from(self._buf, slot * self._slot_size)
+            keys.append((name[:length].decode("utf-8").split(",", 1)[1], slot))
+            slot = next_slot
+
+        return keys[::-1] # The chain starts with the most recently added key
+
+    def _find_slot(self, device, key):
+        # Returns the slot of (device, key), None if the table does not hold it. Called with the stripe held, slots
+        # being added to other devices never change the name of a slot that was already added.
+        slot = self._slots.get((device, key))
+        if slot is None:
+            slot, exists = self._probe(device, key)
+            if not exists:
+                return None
+            self._slots[(device, key)] = slot
+
+        return slot
+
+    def _add_slot(self, device, key):
+        # Returns the slot of (device, key), added to the table and to the chain of the device if it is new, None
+        # if it cannot be added. Called with the lock and the device's stripe held.
+        head, head_exists = self._probe(device, "") # No key is empty, so this is never a key's slot
+        if head is None:
+            return None
+
+        # A new head is only written once the key has a slot too, which must not be the one the head takes
+        slot, exists = self._probe(device, key, taken=None if head_exists else head)
+        if slot is None:
+            return None
+
+        if not exists:
+            next_slot = self.SLOT_HEADER.unpack_from(self._buf, head * self._slot_size)[2] if head_exists else self.NO_SLOT
+            self._write_header(slot, device, key, next_slot)
+            self._write_header(head, device, "", slot)
+
+        self._slots[(device, key)] = slot
+        return slot
+
+    def _write_header(self, slot, device, key, next_slot):
+        name = f"{device},{key}".encode("utf-8")
+        _, _, _, writes = self.SLOT_HEADER.unpack_from(self._buf, slot * self._slot_size)
+        self.SLOT_HEADER.pack_into(self._buf, slot * self._slot_size, len(name), name, next_slot, writes)
+
+    def _probe(self, device, key, taken=None):
+        # Returns (slot, True) of (device, key), or (free slot other than taken it would take, False), or
+        # (None, False) if it cannot be added
+        name = f"{device},{key}".encode("utf-8") # Neither devices (values) nor keys hold ','
+        if len(name) > self.NAME_SIZE:
+            return None, False
+
+        mask = self.capacity - 1
+        slot = zlib.crc32(name) & mask
+
+        for _ in range(self.capacity):
+            length, stored, _, _ = self.SLOT_HEADER.unpack_from(self._buf, slot * self._slot_size)
+            if length == 0 and slot != taken: # Free, the pair was never added
+                return slot, False
+            if stored[:length] == name:
+                return slot, True
+
+            slot = (slot + 1) & mask
+
+        return None, False
+
+def create_latest_values(device_key="", history=1, size=65536, shared=False):
+    '''
+        Returns the latest values table, in shared memory with shared (create it before forking the processes)
+    '''
+    if shared:
+        return SharedLatestValues(device_key=device_key, history=history, size=size)
+
+    return LatestValues(device_key=device_key, history=history)
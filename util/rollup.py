@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import os
+import threading
+import time
+from os import path
+from util.data_util import create_file_writer, data_files, read_indexed_lines, worker_data_dirs
+
+'''
+    Rollups of the numeric values of records, kept in <data_dir>/rollups/rollup-<interval>.csv as rows of
+        <bucket start>,<group>,<column>,<count>,<min>,<max>,<sum>
+    for buckets of interval seconds by receipt time. Rows are written once their bucket is closed, indexed at their
+    bucket start, which only increases as buckets close in order: records added once their bucket was written are
+    counted in the oldest bucket still open. Rows of the same bucket, group and column (e.g.
+    written by several workers, or before and after a restart) are merged when read.
+'''
+
+ROLLUP_DIR = "rollups"
+ROLLUP_COLUMNS = ("count", "min", "max", "sum", "mean")
+
+def rollup_dir(data_dir):
+    return path.join(data_dir, ROLLUP_DIR + "/")
+
+class RollupWriter:
+    '''
+        Aggregates count, min, max and sum of every numeric column of the records added, per bucket of each of
+        intervals (seconds) and, with group_key, per value of that key (e.g. per device). Closed buckets are
+        written every flush_interval seconds, open ones on close. A bucket is closed flush_interval seconds after
+        its end, as records are only added once stored, up to a group commit after they were received.
+    '''
+
+    def __init__(self, data_dir, intervals=(60, 3600), group_key="", flush_interval=1.0, durability="none"):
+        self.directory = rollup_dir(data_dir)
+        self.intervals = [int(interval) for interval in intervals]
+        self.group_key = group_key
+        self.flush_interval = flush_interval
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.writers = {
+            interval: create_file_writer(self.directory, f"rollup-{interval}", "csv", flush_interval=flush_interval, durability=durability, ts_index=True)
+            for interval in self.intervals
+        }
+
+        self._buckets = {interval: {} for interval in self.intervals} # (bucket start, group) -> {column: [count, min, max, sum]}
+        self._written = {interval: 0 for interval in self.intervals} # End of the newest bucket written
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def add(self, records, received=None):
+        '''
+            Aggregates the values of records that parse as finite numbers, received at epoch seconds received
+            (now if None)
+        '''
+        group_key = self.group_key
+
+        # Parsed once per record rather than once per interval
+        parsed = []
+        for data in records:
+            values = []
+            for column, value in data.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+
+                if column != group_key and math.isfinite(value):
+                    values.append((column, value))
+
+            if values:
+                parsed.append((str(data.get(group_key, "")) if group_key else "", values))
+
+        with self._lock: # Buckets are picked under the lock that closes them, so none is added to once written
+            received = time.time() if received is None else received
+
+            for interval, buckets in self._buckets.items():
+                start = max(int(received // interval * interval), self._written[interval])
+
+                for group, values in parsed:
+                    aggregates = buckets.get((start, group))
+                    if aggregates is None:
+                        aggregates = buckets[(start, group)] = {}
+
+                    for column, value in values:
+                        aggregate = aggregates.get(column)
+                        if aggregate is None:
+                            aggregates[column] = [1, value, value, value]
+                            continue
+
+                        aggregate[0] += 1
+                        if value < aggregate[1]:
+                            aggregate[1] = value
+                        elif value > aggregate[2]:
+                            aggregate[2] = value
+                        aggregate[3] += value
+
+    def flush(self, closed_only=True):
+        '''
+            Writes the buckets closed by now (or all of them), returns True if they were written
+        '''
+        ok = True
+
+        for interval, writer in self.writers.items():
+            with self._lock:
+                now = time.time() - self.flush_interval
+                buckets = self._buckets[interval]
+                keys = sorted([key for key in buckets if not closed_only or key[0] + interval <= now])
+                closed = [(key, buckets.pop(key)) for key in keys]
+                if keys:
+                    self._written[interval] = max(self._written[interval], keys[-1][0] + interval)
+
+            rows = {}
+            for (start, group), aggregates in closed:
+                rows.setdefault(start, []).extend([
+                    f"{start},{group},{column},{count},{minimum!r},{maximum!r},{total!r}"
+                    for column, (count, minimum, maximum, total) in aggregates.items()
+                ])
+
+            batches = [writer.append(bucket_rows, received=start) for start, bucket_rows in rows.items()]
+            if not all([writer.wait(batch) for batch in batches]):
+                logging.error(f"Error writing {sum(map(len, rows.values()))} rollup row(s) of {interval}s bucket(s), they are lost.")
+                ok = False
+
+        return ok
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        self.flush(closed_only=False)
+
+        for writer in self.writers.values():
+            writer.close()
+
+    def _flush_periodically(self):
+
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+def read_rollups(data_dir, interval, columns=None, start=None, end=None, group=None):
+    '''
+        Returns list of (bucket start, group, column, count, min, max, sum, mean) of the buckets of interval seconds
+        starting between start and end, for columns (all if None) and group (all if None), merged across workers
+        and sorted by bucket start, group and column
+    '''
+    merged = {}
+
+    for directory in worker_data_dirs(data_dir):
+        directory = rollup_dir(directory)
+        if not path.isdir(directory):
+            continue
+
+        for file_path in data_files(directory, f"rollup-{interval}", "csv", start=start, end=end):
+            for lines in read_indexed_lines(file_path, start=start, end=end):
+                for _, line in lines:
+                    bucket, row_group, column, count, minimum, maximum, total = line.split(",")
+                    bucket = int(bucket)
+
+                    if (start is not None and bucket < start) or (end is not None and bucket > end):
+                        continue
+                    if (columns is not None and column not in columns) or (group is not None and row_group != group):
+                        continue
+
+                    key = (bucket, row_group, column)
+                    aggregate = merged.get(key)
+                    if aggregate is None:
+                        merged[key] = [int(count), float(minimum), float(maximum), float(total)]
+                    else:
+                        aggregate[0] += int(count)
+                        aggregate[1] = min(aggregate[1], float(minimum))
+                        aggregate[2] = max(aggregate[2], float(maximum))
+                        aggregate[3] += float(total)
+
+    return [(*key, count, minimum, maximum, total, total / count) for key, (count, minimum, maximum, total) in sorted(merged.items())]
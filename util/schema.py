@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+from os import path
+from util.data_util import read_header_file, extend_header_file
+
+SCHEMA_FILE = "schema.csv"
+INVALID_KEY_CHARS = ",\n\r" # Would split a column name across fields or lines of schema.csv
+
+class SchemaRegistry:
+    '''
+        Versioned, append-only list of the columns of a data directory.
+
+        Every schema change adds one or more columns at the end and gets the next version id, persisted as one
+        "<version>,<column>,<column>..." line appended to schema.csv. Columns never move, so a row written with
+        version v holds exactly the first width(v) columns and older rows never have to be rewritten.
+
+        With read_only, nothing is written to data_dir (e.g. the source of a conversion): a directory that only
+        has header.csv is imported in memory, and adding columns raises ValueError.
+    '''
+
+    def __init__(self, data_dir, read_only=False):
+        self.data_dir = data_dir
+        self.read_only = read_only
+        self.schema_path = path.join(data_dir, SCHEMA_FILE)
+
+        self.columns = []
+        self.index = {} # Column name to position
+        self.widths = [0] # Number of columns in each version, version 0 is the empty schema
+        self._versions_by_width = {0: 0}
+        self._lock = threading.Lock()
+
+        self.load()
+
+    @property
+    def version(self):
+        return len(self.widths) - 1
+
+    def load(self):
+        if not path.exists(self.schema_path):
+            self._import_header()
+            return
+
+        with open(self.schema_path, "r") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+
+                version, *keys = line.split(",")
+                if int(version) != self.version + 1:
+                    raise ValueError(f"Schema version {version} in {self.schema_path} is out of order")
+
+                self._add(keys)
+
+    def _import_header(self):
+        # Data directories written before the registry existed only have header.csv, which becomes version 1
+        if self.read_only:
+            header_path = path.join(self.data_dir, "header.csv")
+            if not path.exists(header_path):
+                return
+
+            with open(header_path, "r") as f:
+                header = f.readline()
+        else:
+            header = read_header_file(self.data_dir)
+        header = header.rstrip() if header else ""
+
+        if header:
+            self._append_version(header.split(","))
+
+    def _add(self, keys):
+        for key in keys:
+            self.index[key] = len(self.columns)
+            self.columns.append(key)
+
+        self.widths.append(len(self.columns))
+        self._versions_by_width[len(self.columns)] = self.version
+
+    def add_columns(self, keys):
+        '''
+            Appends the unknown keys as a new schema version, returns the current version. Raises ValueError for
+            keys that schema.csv cannot hold, without adding any of the keys.
+        '''
+        with self._lock:
+            keys = [key for key in dict.fromkeys(keys) if key not in self.index]
+            if not keys:
+                return self.version
+            if self.read_only:
+                raise ValueError(f"Schema of {self.data_dir} is read only, cannot add column(s): {','.join(keys)}")
+
+            invalid = [key for key in keys if any([char in key for char in INVALID_KEY_CHARS])]
+            if invalid:
+                raise ValueError(f"Invalid column name(s): {invalid!r}")
+
+            self._append_version(keys)
+            extend_header_file(self.data_dir, keys) # header.csv mirrors the latest version for existing tools
+            logging.debug(f"Schema version {self.version} adds column(s): {','.join(keys)}")
+
+            return self.version
+
+    def _append_version(self, keys):
+        if not self.read_only:
+            with open(self.schema_path, "a") as f:
+                f.write(",".join([str(self.version + 1)] + keys))
+                f.write("\n")
+
+        self._add(keys)
+
+    def width(self, version):
+        return self.widths[version]
+
+    def columns_at(self, version):
+        return self.columns[:self.widths[version]]
+
+    def version_for_width(self, width):
+        '''
+            Returns the version a row of the given number of fields was written with
+        '''
+        try:
+            return self._versions_by_width[width]
+        except KeyError:
+            raise ValueError(f"No schema version has {width} column(s)")
+
+    def to_record(self, fields):
+        '''
+            Returns dict of column name to value for a row written with any schema version, empty values are omitted
+        '''
+        if len(fields) > len(self.columns):
+            raise ValueError(f"Row has {len(fields)} field(s) but the schema only has {len(self.columns)} column(s)")
+
+        # Columns are only ever appended, so a row always holds a prefix of the columns. This also covers rows
+        # written by header.csv-only versions, whose intermediate widths were never recorded.
+        return {key: value for key, value in zip(self.columns, fields) if value != ""}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+from operator import itemgetter
+from util.data_util import *
+from util.schema import SCHEMA_FILE, SchemaRegistry
+
+class CsvStorage:
+    '''
+        Stores records as rows of data.csv, with the columns versioned in schema.csv (mirrored to header.csv).
+        A row holds the columns of the schema version it was written with, see SchemaRegistry. Receipt times are
+        kept in the data.csv.tsidx timestamp index, see read_csv_rows.
+    '''
+
+    MAX_PROJECTIONS = 1024
+
+    def __init__(self, data_dir, flush_size=65536, flush_interval=1.0, durability="none", partition="none", partition_size=0, retention=0):
+        self.data_dir = data_dir
+        self._schema_lock = threading.Lock()
+        self._projections = {} # Key sequence -> function of a record's values to the values of its row
+
+        self.schema = SchemaRegistry(self.data_dir)
+        self.data_writer = create_file_writer(
+            self.data_dir,
+            "data",
+            "csv",
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            durability=durability,
+            ts_index=True,
+            partition=partition,
+            partition_size=partition_size,
+            retention=retention)
+
+    def store(self, records):
+        '''
+            Returns True if all records (dicts of column name to value) were stored
+        '''
+        return self.append_records(records).wait()
+
+    def append_records(self, records):
+        '''
+            Appends records to the writer, returns their Commit
+        '''
+        projections = self._projections
+
+        with self._schema_lock: # Connection threads share the schema and the order of its columns
+            rows = []
+            for data in records:
+                keys = tuple(data)
+                project = projections.get(keys)
+                if project is None:
+                    project = self._add_projection(keys)
+                    if project is None:
+                        return Commit(ok=False)
+
+                values = project(tuple(data.values()) + ("",))
+                try:
+                    rows.append(",".join(values))
+                except TypeError: # Not all values are strings
+                    rows.append(",".join(map(str, values)))
+
+            batch = self.data_writer.append(rows)
+
+        return Commit([(self.data_writer, batch)])
+
+    def _add_projection(self, keys):
+        '''
+            Adds the columns of keys missing from the schema and returns the projection of records with keys (in
+            that order), or None if the schema could not be written. Called with the schema lock held.
+        '''
+        new_keys = [key for key in keys if key not in self.schema.index]
+        if new_keys:
+            try:
+                self.schema.add_columns(new_keys)
+            except (OSError, ValueError) as e:
+                logging.error(f"{e}. Error adding column(s) to schema.")
+                return None
+
+        # Rows are as wide as the schema is now, columns missing from the record pick the "" after its values
+        positions = {self.schema.index[key]: i for i, key in enumerate(keys)}
+        getter = itemgetter(*[positions.get(column, len(keys)) for column in range(len(self.schema.columns))])
+        project = getter if len(self.schema.columns) > 1 else lambda values: (getter(values),)
+
+        if len(self._projections) >= self.MAX_PROJECTIONS:
+            self._projections.clear()
+        self._projections[keys] = project
+        return project
+
+    def close(self):
+        self.data_writer.close()
+
+class ShardedStorage:
+    '''
+        Routes records by the value of their shard_key (e.g. a device id) to shard directories under data_dir, one
+        per value or, with shards, one of shards directories by hash of the value (see shard_dir_name). Records
+        without shard_key go to the shard of the empty value.
+
+        Every shard is a storage of its own, created on its first record by create_shard(directory), so shards have
+        their own schema and writer and records of different shards are written in parallel. The shard directories
+        are listed in the shards.json manifest, through which readers find them (see worker_data_dirs). One
+        directory per value suits fleets of up to a few hundred devices, as every shard has its own flush thread.
+    '''
+
+    def __init__(self, data_dir, shard_key, create_shard, shards=0):
+        self.data_dir = data_dir
+        self.shard_key = shard_key
+        self.shards = shards
+        self.create_shard = create_shard
+
+        self._lock = threading.Lock() # Held to create shards
+        self._storages = {} # Shard directory name -> storage
+
+        self.manifest = read_shards(self.data_dir) or {"shard_key": shard_key, "shards": shards, "directories": []}
+        if (self.manifest["shard_key"], self.manifest["shards"]) != (shard_key, shards):
+            raise ValueError(f"{self.data_dir} is sharded by {self.manifest['shard_key']} into {self.manifest['shards']} shard(s), not by {shard_key} into {shards}")
+
+    def store(self, records):
+        '''
+            Returns True if all records (dicts of column name to value) were stored
+        '''
+        return self.append_records(records).wait()
+
+    def append_records(self, records):
+        '''
+            Appends records to the writers of their shards, returns their Commit
+        '''
+        shard_key = self.shard_key
+        groups = {}
+        for data in records:
+            groups.setdefault(str(data.get(shard_key, "")), []).append(data)
+
+        commit = Commit()
+        for value, shard_records in groups.items():
+            storage = self._storages.get(shard_dir_name(value, self.shards)) or self._add_shard(value)
+            commit.add(storage.append_records(shard_records) if storage is not None else Commit(ok=False))
+
+        return commit
+
+    def _add_shard(self, value):
+        name = shard_dir_name(value, self.shards)
+
+        with self._lock:
+            if name in self._storages: # Created by another connection in the meantime
+                return self._storages[name]
+
+            try:
+                directory = os.path.join(self.data_dir, name + "/")
+                os.makedirs(directory, exist_ok=True)
+                storage = self.create_shard(directory)
+
+                if name not in self.manifest["directories"]:
+                    self.manifest["directories"].append(name)
+                    write_shards(self.data_dir, self.manifest, fsync=True)
+
+            except (OSError, ValueError) as e:
+                logging.error(f"{e}. Error creating shard {name} in {self.data_dir}.")
+                return None
+
+            self._storages[name] = storage
+            return storage
+
+    def close(self):
+        with self._lock:
+            for storage in self._storages.values():
+                storage.close()
+
+def read_csv_records(data_dir, start=None, end=None):
+    '''
+        Yields the rows of data.csv (or of its partitions received between start and end) as dicts of column name
+        to value, whichever schema version they were written with. Per-worker directories follow data_dir.
+    '''
+    for directory in worker_data_dirs(data_dir):
+        if not _has_schema(directory):
+            continue
+
+        schema = SchemaRegistry(directory, read_only=True) # Queries never write schema.csv
+
+        for file_path in data_files(directory, "data", "csv", start=start, end=end):
+            with open(file_path, "r") as f:
+                for line in f:
+                    yield schema.to_record(line.rstrip("\n").split(","))
+
+def read_csv_rows(data_dir, columns, start=None, end=None, chunk_rows=1000, shard=None):
+    '''
+        Yields lists of (receipt time, [values of columns]) for rows received between start and end, at most
+        chunk_rows at a time. Seeks through the timestamp index rather than scanning, unindexed rows are skipped.
+        Rows of per-worker (and shard) directories are merged in receipt order. With shard, only the rows whose
+        shard key has that value are read, from the shard directories that hold them (see ShardedStorage).
+    '''
+    if shard is None:
+        streams = [_read_dir_rows(directory, columns, start, end, chunk_rows) for directory in worker_data_dirs(data_dir)]
+    else:
+        streams = [
+            _read_dir_rows(shard_dir, columns, start, end, chunk_rows, where=(read_shards(directory)["shard_key"], shard))
+            for directory in worker_data_dirs(data_dir) for shard_dir in shard_data_dirs(directory, shard)
+        ]
+
+    if not streams:
+        return
+
+    rows = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=lambda row: row[0])
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+def _has_schema(data_dir):
+    # Data directories of multi-worker servers only hold per-worker directories
+    return any([os.path.exists(os.path.join(data_dir, name)) for name in (SCHEMA_FILE, "header.csv")])
+
+def _read_dir_rows(data_dir, columns, start, end, chunk_rows, where=None):
+    # where is (column, value), rows whose column holds another value are skipped
+    if not _has_schema(data_dir):
+        return
+
+    schema = SchemaRegistry(data_dir, read_only=True)
+    positions = [schema.index.get(key) for key in columns]
+
+    if where is not None:
+        where_position = schema.index.get(where[0])
+        if where_position is None:
+            return
+
+    for file_path in data_files(data_dir, "data", "csv", start=start, end=end):
+        for lines in read_indexed_lines(file_path, start=start, end=end, chunk_rows=chunk_rows):
+            for received, line in lines:
+                fields = line.split(",")
+                if where is not None and (where_position >= len(fields) or fields[where_position] != where[1]):
+                    continue
+                yield (received, [fields[i] if i is not None and i < len(fields) else "" for i in positions])
+
+STORAGES = ("csv", "columnar")
+
+def create_storage(storage, data_dir, flush_size=65536, flush_interval=1.0, durability="none", partition="none", partition_size=0, retention=0, shard_key="", shards=0):
+    '''
+        Returns the storage backend for data_dir. Partitioning only applies to the csv backend, columnar data is
+        already split into segments. With shard_key, records are stored in shards of the backend, see ShardedStorage.
+    '''
+    if shard_key:
+        create_shard = lambda directory: create_storage(
+            storage,
+            directory,
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            durability=durability,
+            partition=partition,
+            partition_size=partition_size,
+            retention=retention)
+
+        return ShardedStorage(data_dir, shard_key, create_shard, shards=shards)
+
+    if storage == "csv":
+        return CsvStorage(
+            data_dir,
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            durability=durability,
+            partition=partition,
+            partition_size=partition_size,
+            retention=retention)
+
+    if storage == "columnar":
+        from util.columnar import ColumnarStorage
+        return ColumnarStorage(data_dir, flush_size=flush_size, flush_interval=flush_interval, durability=durability)
+
+    raise ValueError(f"Unknown storage backend: {storage}")
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+
+import bisect
+import heapq
+import itertools
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import zlib
+from operator import itemgetter
+from os import path
+from util.data_util import *
+
+'''
+    Inverted index of the tokens of a line file written with a timestamp index, kept in <file>.tokidx.
+
+    The file is a sequence of runs, each a RUN_HEADER followed by TOKEN_ENTRY records sorted by token hash and row.
+    A row is the position of the line in the timestamp index. Every flush appends one run, and runs of similar size
+    are merged so a file only ever has O(log rows) runs to search. A merge appends the merged run after the runs it
+    was merged from, which it supersedes, and dead runs are dropped by rewriting the file into a new one, so runs
+    are never removed before the run that replaces them is complete (see live_runs). Tokens are hashed, so matches
+    are verified against the line itself. Rows that no run covers (not indexed yet, or lost in a crash) are
+    scanned by readers and indexed again when the file is reopened for writing.
+'''
+
+RUN_HEADER = struct.Struct("<qqq") # First row, number of rows and number of entries covered by the run
+TOKEN_ENTRY = struct.Struct("<QI") # Token hash, row
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+MAX_PENDING = 16384 # Lines queued for the indexing thread, lines beyond that are read back from the file
+CHUNK_ENTRIES = 65536 # Entries read or written at a time by merges
+REINDEX_ROWS = 65536 # Rows indexed again at a time, between queued batches
+REINDEX_WAIT = 1.0 # In seconds, before reading back rows that were not in the file yet again
+
+def tokenize(line):
+    '''
+        Returns the set of lowercase word tokens of line, e.g. "Device 7: ERROR" -> {"device", "7", "error"}
+    '''
+    return set(TOKEN_PATTERN.findall(line.lower()))
+
+def token_hash(token):
+    data = token.encode("utf-8")
+    return zlib.crc32(data) << 32 | zlib.adler32(data)
+
+def read_runs(index_path):
+    '''
+        Returns list of (offset of the first entry, first row, rows, entries) of the complete runs in index_path
+    '''
+    with open(index_path, "rb") as f:
+        return _read_runs(f)
+
+def _read_runs(f):
+    runs = []
+    size = f.seek(0, os.SEEK_END)
+
+    offset = 0
+    f.seek(offset)
+    while offset + RUN_HEADER.size <= size:
+        first_row, rows, entries = RUN_HEADER.unpack(f.read(RUN_HEADER.size))
+        if offset + RUN_HEADER.size + entries * TOKEN_ENTRY.size > size: # Interrupted write
+            break
+
+        runs.append((offset + RUN_HEADER.size, first_row, rows, entries))
+        offset += RUN_HEADER.size + entries * TOKEN_ENTRY.size
+        f.seek(offset)
+
+    return runs
+
+def live_runs(runs):
+    '''
+        Returns the runs of read_runs that are not superseded by a later run covering all of their rows (merged from
+        them), in row order
+    '''
+    live = []
+    for run in runs:
+        first_row, end = run[1], run[1] + run[2]
+        live = [other for other in live if not (first_row <= other[1] and other[1] + other[2] <= end)]
+        live.append(run)
+
+    return sorted(live, key=itemgetter(1))
+
+def covered_ranges(runs):
+    '''
+        Returns the sorted, disjoint (first row, end row) ranges of the rows covered by runs
+    '''
+    ranges = []
+    for _, first_row, rows, _ in sorted(runs, key=itemgetter(1)):
+        if ranges and first_row <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], first_row + rows))
+        else:
+            ranges.append((first_row, first_row + rows))
+
+    return ranges
+
+def uncovered_ranges(ranges, start, end):
+    '''
+        Returns the (first row, end row) ranges between start and end that none of the sorted, disjoint ranges cover
+    '''
+    gaps = []
+    position = start
+
+    for first_row, end_row in ranges:
+        if first_row > position:
+            gaps.append((position, min(first_row, end)))
+        position = max(position, end_row)
+        if position >= end:
+            break
+
+    if position < end:
+        gaps.append((position, end))
+
+    return [(first_row, end_row) for first_row, end_row in gaps if first_row < end_row]
+
+def _read_chunks(f, run):
+    # Yields the entries of run from f, in lists of up to CHUNK_ENTRIES
+    offset, _, _, entries = run
+    for start in range(0, entries, CHUNK_ENTRIES):
+        f.seek(offset + start * TOKEN_ENTRY.size)
+        yield list(TOKEN_ENTRY.iter_unpack(f.read(min(CHUNK_ENTRIES, entries - start) * TOKEN_ENTRY.size)))
+
+def _merge_chunks(left, right):
+    # Yields sorted lists merging the sorted chunks of left and right, holding at most two chunks at a time
+    left_chunk, right_chunk = next(left, []), next(right, [])
+
+    while left_chunk and right_chunk:
+        bound = min(left_chunk[-1], right_chunk[-1]) # Every entry up to it is in the chunks
+        i, j = bisect.bisect_right(left_chunk, bound), bisect.bisect_right(right_chunk, bound)
+        yield sorted(left_chunk[:i] + right_chunk[:j])
+
+        left_chunk = left_chunk[i:] or next(left, [])
+        right_chunk = right_chunk[j:] or next(right, [])
+
+    yield left_chunk or right_chunk
+    yield from left
+    yield from right
+
+def _pack_entries(entries):
+    return b"".join(itertools.starmap(TOKEN_ENTRY.pack, entries))
+
+def _run_size(run):
+    return RUN_HEADER.size + run[3] * TOKEN_ENTRY.size
+
+class TokenIndexWriter:
+    '''
+        Indexes the tokens of lines in <file>.tokidx as they are written, see BufferedFileWriter(token_index=True).
+
+        add() only queues the lines, a thread of the writer tokenizes them and appends and merges the runs, so
+        flushes never wait for the index. Once MAX_PENDING lines are queued, rows are read back from the file
+        instead when the thread catches up. rows is the number of rows of the file when it is opened: runs beyond it
+        (rows truncated since) are dropped, and rows below it that no run covers are indexed again in between queued
+        batches. The index is not fsynced, as it is rebuilt this way.
+    '''
+
+    def __init__(self, file_path, rows=0):
+        self.file_path = file_path
+        self.index_path = token_index_path(file_path)
+
+        self._file = None
+        self._end = 0 # End of the complete runs, where the next run is written
+        self._live = [] # Live runs in row order, see live_runs
+        self._dead_bytes = 0
+        self._gaps = [] # Ranges of rows indexed again, from the file
+        self._lock = threading.Lock() # Guards _gaps and _pending, shared with add()
+        self._gaps_waiting = False
+        self._opened_rows = rows
+        self._closing = False
+
+        self._queue = queue.SimpleQueue()
+        self._pending = 0 # Lines in _queue
+        self._thread = threading.Thread(target=self._index, args=(rows,), daemon=True)
+        self._thread.start()
+
+    def add(self, first_row, lines):
+        with self._lock:
+            if self._pending + len(lines) <= MAX_PENDING or not self._pending:
+                self._pending += len(lines)
+                self._queue.put((first_row, lines))
+
+            elif self._gaps and self._gaps[-1][1] == first_row: # Written to the file before the next add()
+                self._gaps[-1] = (self._gaps[-1][0], first_row + len(lines))
+            else:
+                self._gaps.append((first_row, first_row + len(lines)))
+
+    def close(self):
+        # Queued lines are still indexed, a merge or re-indexing in progress is abandoned and readers scan those rows
+        self._closing = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _index(self, rows):
+
+        try:
+            self._open(rows)
+        except OSError as e:
+            logging.error(f"{e}. Error opening token index {self.index_path}, lines are scanned instead.")
+            self._close_file()
+
+        while True:
+            with self._lock:
+                gaps = bool(self._gaps) and self._file is not None and not self._closing
+
+            try:
+                job = self._queue.get(timeout=(REINDEX_WAIT if self._gaps_waiting else 0) if gaps else None)
+                if job is None:
+                    break
+            except queue.Empty:
+                job = None
+            self._gaps_waiting = False
+
+            if job is not None:
+                with self._lock:
+                    self._pending -= len(job[1])
+
+            if self._file is None:
+                continue
+
+            try:
+                if job is None:
+                    self._reindex()
+                else:
+                    self._append_run(job[0], len(job[1]), self._entries(job[0], job[1]))
+                self._merge()
+
+            except OSError as e:
+                logging.error(f"{e}. Error writing token index {self.index_path}, lines are scanned instead.")
+                self._close_file() # Indexed again when reopened
+
+        self._close_file()
+
+    def _open(self, rows):
+        runs = read_runs(self.index_path) if path.exists(self.index_path) else []
+        live = live_runs(runs)
+
+        self._file = open(self.index_path, "a+b")
+        self._end = runs[-1][0] + runs[-1][3] * TOKEN_ENTRY.size if runs else 0
+        if self._file.seek(0, os.SEEK_END) > self._end: # Interrupted run, which readers skip
+            self._file.truncate(self._end)
+
+        self._live = [run for run in live if run[1] + run[2] <= rows]
+        self._dead_bytes = self._end - sum([_run_size(run) for run in self._live])
+        if len(self._live) < len(live): # Rows truncated since, see PartitionedFileWriter
+            self._compact()
+
+        with self._lock:
+            self._gaps[:0] = uncovered_ranges(covered_ranges(self._live), 0, rows)
+
+    def _entries(self, first_row, lines):
+        return sorted([(token_hash(token), first_row + i) for i, line in enumerate(lines) for token in tokenize(line)])
+
+    def _append_run(self, first_row, rows, entries):
+        data = RUN_HEADER.pack(first_row, rows, len(entries)) + _pack_entries(entries)
+
+        self._file.write(data)
+        self._file.flush() # Readers see the run once it is complete
+
+        self._live.append((self._end + RUN_HEADER.size, first_row, rows, len(entries)))
+        self._live.sort(key=itemgetter(1))
+        self._end += len(data)
+
+    def _reindex(self):
+        with self._lock:
+            first_row, end_row = self._gaps[0]
+
+        rows = range(first_row, min(end_row, first_row + REINDEX_ROWS))
+        lines = [line for _, _, line in read_rows(self.file_path, rows)]
+
+        with self._lock:
+            if len(lines) == len(rows):
+                first_row_left = rows.stop
+            elif first_row < self._opened_rows: # Past the end of the file
+                first_row_left = end_row
+            else: # Not written yet
+                first_row_left = first_row + len(lines)
+                self._gaps_waiting = True
+
+            if first_row_left < self._gaps[0][1]:
+                self._gaps[0] = (first_row_left, self._gaps[0][1])
+            else:
+                self._gaps.pop(0)
+
+        if lines:
+            self._append_run(first_row, len(lines), self._entries(first_row, lines))
+
+    def _merge(self):
+        # Keep runs of consecutive rows size-tiered, every entry is rewritten O(log entries) times
+        i = len(self._live) - 2
+        while i >= 0 and not self._closing:
+            older, newer = self._live[i], self._live[i + 1]
+            if older[1] + older[2] != newer[1] or older[3] > 2 * newer[3]:
+                i -= 1
+                continue
+
+            if not self._merge_runs(older, newer):
+                return
+            i = min(i, len(self._live) - 2)
+
+        if self._dead_bytes > self._end - self._dead_bytes and not self._closing:
+            self._compact()
+
+    def _merge_runs(self, older, newer):
+        # Appends the merged run, streaming the entries of both runs. Returns False if abandoned on close.
+        entries = older[3] + newer[3]
+
+        with open(self.index_path, "rb") as older_file, open(self.index_path, "rb") as newer_file:
+            self._file.write(RUN_HEADER.pack(older[1], older[2] + newer[2], entries))
+
+            for chunk in _merge_chunks(_read_chunks(older_file, older), _read_chunks(newer_file, newer)):
+                if self._closing: # Drop the incomplete run, which readers skip
+                    self._file.flush()
+                    self._file.truncate(self._end)
+                    return False
+
+                self._file.write(_pack_entries(chunk))
+
+        self._file.flush()
+
+        i = self._live.index(older)
+        self._live[i:i + 2] = [(self._end + RUN_HEADER.size, older[1], older[2] + newer[2], entries)]
+        self._end += RUN_HEADER.size + entries * TOKEN_ENTRY.size
+        self._dead_bytes += _run_size(older) + _run_size(newer)
+
+        return True
+
+    def _compact(self):
+        # Copies the live runs into a new file that replaces the index, readers keep the file they opened
+        tmp_path = self.index_path + ".tmp"
+        live = []
+
+        with open(tmp_path, "wb") as out, open(self.index_path, "rb") as f:
+            for run in self._live:
+                f.seek(run[0] - RUN_HEADER.size)
+                live.append((out.tell() + RUN_HEADER.size, *run[1:]))
+
+                remaining = _run_size(run)
+                while remaining > 0:
+                    data = f.read(min(remaining, CHUNK_ENTRIES * TOKEN_ENTRY.size))
+                    out.write(data)
+                    remaining -= len(data)
+
+            out.flush()
+            os.fsync(out.fileno()) # Never replaces the index with a partially written file
+
+        os.replace(tmp_path, self.index_path)
+
+        self._file.close()
+        self._file = open(self.index_path, "a+b")
+        self._live = live
+        self._end = self._file.seek(0, os.SEEK_END)
+        self._dead_bytes = 0
+
+    def _close_file(self):
+        try:
+            if self._file is not None:
+                self._file.close()
+        except OSError:
+            pass
+
+        self._file = None
+
+def _find_rows(f, run, token):
+    # Binary search for the first entry of token's hash, then read its rows
+    offset, _, _, entries = run
+    key = token_hash(token)
+
+    low, high = 0, entries
+    while low < high:
+        mid = (low + high) // 2
+        f.seek(offset + mid * TOKEN_ENTRY.size)
+        if TOKEN_ENTRY.unpack(f.read(TOKEN_ENTRY.size))[0] < key:
+            low = mid + 1
+        else:
+            high = mid
+
+    rows = []
+    f.seek(offset + low * TOKEN_ENTRY.size)
+    for _ in range(low, entries):
+        entry_hash, row = TOKEN_ENTRY.unpack(f.read(TOKEN_ENTRY.size))
+        if entry_hash != key:
+            break
+        rows.append(row)
+
+    return rows
+
+def lookup_rows(file_path, tokens):
+    '''
+        Returns (sorted rows that may hold all tokens, sorted ranges of the rows covered by the index, see
+        covered_ranges), or None without index
+    '''
+    index_path = token_index_path(file_path)
+    if not path.exists(index_path):
+        return None
+
+    matches = None
+    with open(index_path, "rb") as f: # The same file throughout, compactions replace it
+        runs = live_runs(_read_runs(f))
+        covered = covered_ranges(runs)
+
+        for token in tokens:
+            rows = set([row for run in runs for row in _find_rows(f, run, token)])
+            matches = rows if matches is None else matches & rows
+            if not matches:
+                break
+
+    return sorted(matches or []), covered
+
+def _count_rows(file_path):
+    if file_path.endswith(COMPRESSED_EXT):
+        with open(block_index_path(file_path), "rb") as f:
+            return sum([rows for _, _, _, _, rows in BLOCK_INDEX_RECORD.iter_unpack(f.read())])
+
+    return path.getsize(ts_index_path(file_path)) // TS_INDEX_RECORD.size
+
+def _first_row(file_path, start):
+    # First row that may have been received at or after start
+    if not file_path.endswith(COMPRESSED_EXT):
+        return find_ts_index(ts_index_path(file_path), start)
+
+    with open(block_index_path(file_path), "rb") as f:
+        blocks = list(BLOCK_INDEX_RECORD.iter_unpack(f.read()))
+
+    first = 0
+    for _, last, _, _, rows in blocks:
+        if last >= start:
+            break
+        first += rows
+
+    return first
+
+def read_rows(file_path, rows):
+    '''
+        Yields (row, receipt time, line) for the given sorted rows of a file written with a timestamp index
+        (or compressed), rows past the end are skipped
+    '''
+    if file_path.endswith(COMPRESSED_EXT):
+        yield from _read_compressed_rows(file_path, rows)
+        return
+
+    with open(ts_index_path(file_path), "rb") as index_file, open(file_path, "rb") as data_file:
+        for row in rows:
+            index_file.seek(row * TS_INDEX_RECORD.size)
+            record = index_file.read(TS_INDEX_RECORD.size)
+            if len(record) < TS_INDEX_RECORD.size:
+                return
+
+            received, offset = TS_INDEX_RECORD.unpack(record)
+            data_file.seek(offset)
+            line = data_file.readline()
+            if not line.endswith(b"\n"): # Index is ahead of the data
+                return
+
+            yield row, received, line[:-1].decode("utf-8")
+
+def _read_compressed_rows(file_path, rows):
+    with open(block_index_path(file_path), "rb") as f:
+        blocks = list(BLOCK_INDEX_RECORD.iter_unpack(f.read()))
+
+    block_starts = []
+    total = 0
+    for block in blocks:
+        block_starts.append(total)
+        total += block[4]
+
+    with open(file_path, "rb") as f:
+        current, times, lines = None, None, None
+
+        for row in rows:
+            if row >= total:
+                return
+
+            i = bisect.bisect_right(block_starts, row) - 1
+            if i != current: # Decompress every block once
+                _, _, offset, size, block_rows = blocks[i]
+                f.seek(offset)
+                block = zlib.decompress(f.read(size))
+                times = struct.unpack_from(f"<{block_rows}d", block)
+                lines = block[block_rows * 8:].split(b"\n")
+                current = i
+
+            yield row, times[row - block_starts[i]], lines[row - block_starts[i]].decode("utf-8")
+
+def search_file(file_path, query, start=None, end=None):
+    '''
+        Yields (receipt time, line) of the lines of file_path received between start and end that hold all tokens
+        of query, in time order. Rows the token index does not cover (yet) are scanned.
+    '''
+    tokens = tokenize(query)
+
+    found = lookup_rows(file_path, tokens) if tokens else None
+    if found is None:
+        logging.debug(f"No token index for {file_path}, scanning")
+        rows, covered = [], []
+    else:
+        rows, covered = found
+
+    first = _first_row(file_path, start) if start is not None else 0
+    count = _count_rows(file_path)
+
+    scanned = itertools.chain.from_iterable([range(first_row, end_row) for first_row, end_row in uncovered_ranges(covered, first, count)])
+    rows = heapq.merge([row for row in rows if first <= row < count], scanned)
+
+    for _, received, line in read_rows(file_path, rows):
+        if end is not None and received > end:
+            return
+
+        if (start is None or received >= start) and tokens <= tokenize(line):
+            yield received, line
+
+def search_lines(data_dir, name, ext, query, start=None, end=None):
+    '''
+        Yields (receipt time, line) of the <name>.<ext> lines under data_dir (and its per-worker directories) that
+        hold all tokens of query, merged in time order
+    '''
+    streams = []
+    for directory in worker_data_dirs(data_dir):
+        files = data_files(directory, name, ext, start=start, end=end)
+        files = [file_path for file_path in files if path.exists(file_path) and (file_path.endswith(COMPRESSED_EXT) or path.exists(ts_index_path(file_path)))]
+        streams.append(line for file_path in files for line in search_file(file_path, query, start=start, end=end))
+
+    return heapq.merge(*streams, key=lambda line: line[0])